@@ -1,244 +1,195 @@
-from flask import Flask, request, jsonify 
+from flask import Flask, Response, request
 from flask_cors import CORS
-from database import db_connect, authenticate_student, get_student_grades
+import codec
+import database
+import menu
+from catalog import get_catalog
 import logging
-import re
-from cachetools import Cache
+import os
+import sqlite3
+import time
+from urllib.parse import parse_qsl
+from database_schema import create_tables
+from fast_wsgi import UssdFastPath
+from log_config import RedactFilter, configure_logging
+from metrics import REGISTRY, CONTENT_TYPE, CallbackCounter, Gauge, Histogram
+from session_store import create_session_backend, fallback_session_id, session_key
 
 app = Flask(__name__)
 CORS(app)
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging: records are formatted and written on a background thread,
+# with passwords in logged user input masked
+LOG_REDACTION = RedactFilter(menu.SERVICE_CODE, menu.ASK_PASSWORD)
+configure_logging(redact=LOG_REDACTION)
 
 # Cache for storing USSD session states
-# maxsize is the size of data the Cache can hold
-cache_data = Cache(maxsize=50000)
-
-class UssdState:
-    def __init__(self, session_id, msisdn, user_data, network, message, level, step, new_session):
-        self.session_id = session_id
-        self.msisdn = msisdn
-        self.user_data = user_data
-        self.network = network
-        self.message = message
-        self.level = level
-        self.step = step
-        self.new_session = new_session
-
-@app.route('/ussd', methods=['POST'])
-def ussd():
+# Entries expire SESSION_TTL seconds after the last hop, matching the
+# gateway's own session timeout. Set USSD_SESSION_BACKEND=sqlite when
+# running several gunicorn workers so they share sessions.
+cache_data = create_session_backend()
+_sweeper_pid = None
+
+
+def session_backend():
+    """
+    cache_data, with its sweeper running in this process. The sweeper is
+    started on first use rather than at import, so that each worker forked
+    from a preloaded app (gunicorn --preload) starts its own.
+    """
+    global _sweeper_pid
+    if _sweeper_pid != os.getpid():
+        cache_data.start_sweeper()
+        _sweeper_pid = os.getpid()
+    return cache_data
+
+
+# Bring the database up to the current schema (a no-op once it is)
+try:
+    create_tables()
+except sqlite3.Error as e:
+    logging.error("Could not migrate %s (%s); run seed_database.py or import_grades.py with write access to it",
+                  database.DB_PATH, e)
+
+# Course catalog is loaded once per worker, before the first request; with
+# USSD_DB_IN_MEMORY=1 this also copies the database into memory
+get_catalog()
+
+# screen is the "level.step" a hop answered, "dial" for a new session,
+# "expired" for a hop whose session was gone, and "replay" for /ussd/at
+REQUEST_SECONDS = Histogram('ussd_request_seconds', 'Time to handle one USSD hop', ('endpoint', 'screen'))
+
+
+def session_store_size():
+    stats = cache_data.stats()
+    if 'size' in stats:
+        return stats['size']
+    # Sharded backends report per shard; Redis does not report a size
+    sizes = [shard.get('size') for shard in stats.values() if isinstance(shard, dict)]
+    return sum(sizes) if sizes and None not in sizes else None
+
+
+Gauge('ussd_session_store_size', "Open sessions in this worker's session backend", session_store_size)
+CallbackCounter('ussd_result_cache_hits', 'Result checks served from the result cache', lambda: menu.results.hits)
+CallbackCounter('ussd_result_cache_targeted_invalidations',
+                'Grade imports that dropped only the cached results they changed',
+                lambda: menu.results.targeted_invalidations)
+CallbackCounter('ussd_prefetch_started', 'Prefetch tasks started', lambda: menu.prefetcher.started)
+CallbackCounter('ussd_prefetch_used', 'Year-selection hops answered from prefetched results',
+                lambda: menu.prefetcher.used)
+CallbackCounter('ussd_prefetch_not_waited', 'Year-selection hops that found their prefetch still queued',
+                lambda: menu.prefetcher.not_waited)
+CallbackCounter('ussd_dial_hops_saved', 'Round-trips skipped by direct-dial answers',
+                lambda: menu.dial_stats['hops_saved'])
+
+
+def handle_arkesel(body):
+    """Response body for one Arkesel hop, given the raw request body."""
+    started = time.perf_counter()
+    screen = 'dial'
     try:
         # Parse Arkesel USSD request format
-        data = request.get_json(silent=True) or {}
-        
-        session_id = data.get('sessionID', '')
-        user_id = data.get('userID', '')
-        new_session = data.get('newSession', True)
-        msisdn = data.get('msisdn', '')
-        user_data = data.get('userData', '')
-        network = data.get('network', '')
-        
-        logging.info(f"USSD Request - Session: {session_id}, New: {new_session}, Data: '{user_data}'")
-        
-        response = {
-            'sessionID': session_id or f"session_{hash(msisdn)}",
-            'userID': user_id or msisdn,
-            'msisdn': msisdn,
-            'continueSession': True,
-            'message': ''
-        }
-
-        # Menu constants
-        WELCOME_MENU = (
-            "Welcome to TTU Result Checker\n"
-            "1. Check Results\n"
-            "2. Exit"
-        )
-        ENTER_INDEX = "Enter your index number:"
-        ENTER_PASSWORD = "Enter your password:"
-        SELECT_YEAR = (
-            "Select Academic Year:\n"
-            "1. Level 100\n"
-            "2. Level 200\n"
-            "3. Level 300\n"
-            "4. Level 400"
-        )
-        THANK_YOU = "Thank you for using TTU Result Checker."
-        INVALID_INPUT = "Invalid input. Please try again."
-        NO_RECORD = "No record found for the provided details."
-
-        if new_session:
-            # Step 0 - Main menu
-            response['message'] = WELCOME_MENU
-            response['continueSession'] = True
-            
-            # Store initial state
-            current_state = UssdState(
-                session_id=session_id,
-                msisdn=msisdn,
-                user_data=user_data,
-                network=network,
-                message=response['message'],
-                level=0,
-                step=0,
-                new_session=True
-            )
-            
-            user_response_tracker = cache_data.get(hash(session_id), [])
-            user_response_tracker.append(current_state)
-            cache_data[hash(session_id)] = user_response_tracker
-            
+        hop = codec.decode_request(body)
+    except codec.CodecError as e:
+        logging.error("Invalid USSD request: %s", e)
+        return codec.encode_response('', '', '', menu.end(menu.UNEXPECTED_ERROR))
+
+    session_id = hop.session_id or fallback_session_id(hop.msisdn)
+    user_id = hop.user_id or hop.msisdn
+    try:
+        logging.info("USSD Request - Session: %(session)s, New: %(new)s",
+                     {'session': hop.session_id, 'new': hop.new_session}, extra={'event': 'ussd.request'})
+
+        key = session_key(session_id)
+        sessions = session_backend()
+
+        if hop.new_session:
+            # Step 0 - Main menu, or a later screen if the dial string
+            # pre-fills answers (*928*230*1*<index>#)
+            logging.info("Dialled: %(data)r", {'data': hop.user_data}, extra={'event': 'ussd.dial'})
+            reply, state = menu.start_dialled(hop.user_data)
+            menu.SESSION_EVENTS.inc('started')
         else:
-            # Get last response from cache
-            user_responses = cache_data.get(hash(session_id), [])
-            if not user_responses:
-                response['message'] = "Session expired. Please try again."
-                response['continueSession'] = False
-                return jsonify(response)
-            
-            last_response = user_responses[-1]
-            
-            user_inputs = []
-            for state in user_responses:
-                if state.user_data and state.user_data.strip():
-                    user_inputs.append(state.user_data.strip())
-            
-            # Add current input if it's not empty
-            if user_data and user_data.strip():
-                user_inputs.append(user_data.strip())
-            
-            logging.info(f"User inputs so far: {user_inputs}")
-            logging.info(f"Last response level: {last_response.level}, step: {last_response.step}")
-            
-            # Process based on current step
-            if last_response.level == 0:  # Main menu
-                if user_data == "1":
-                    # Step 1 - Ask index number
-                    response['message'] = ENTER_INDEX
-                    response['continueSession'] = True
-                    level, step = 1, 1
-                elif user_data == "2":
-                    # Exit option
-                    response['message'] = THANK_YOU
-                    response['continueSession'] = False
-                    level, step = 0, 0
-                else:
-                    response['message'] = INVALID_INPUT
-                    response['continueSession'] = False
-                    level, step = 0, 0
-                    
-            elif last_response.level == 1:  # Getting user details
-                if last_response.step == 1:  # After index number
-                    response['message'] = ENTER_PASSWORD
-                    response['continueSession'] = True
-                    level, step = 1, 2
-                elif last_response.step == 2:  # After password
-                    response['message'] = SELECT_YEAR
-                    response['continueSession'] = True
-                    level, step = 1, 3
-                elif last_response.step == 3:  # After year selection
-                    # Process the complete request
-                    if len(user_inputs) >= 5:
-                        index = user_inputs[2]  # Skip '*928*230#' and '1'
-                        password = user_inputs[3]  # Skip '*928*230#' and '1'
-                        year_choice = user_inputs[4]  # Skip '*928*230#' and '1'
-                        
-                        logging.info(f"Attempting authentication - Index: '{index}', Password: '{password}'")
-                        
-                        student = authenticate_student(index, password)
-                        if not student:
-                            logging.error(f"Authentication failed for index: '{index}', password: '{password}'")
-                            response['message'] = NO_RECORD
-                            response['continueSession'] = False
-                            return jsonify(response)
-
-                        student_id = student["id"]
-                        name = student["name"]
-
-                        # Map year choice to course groups
-                        course_groups = {
-                            "1": [
-                                "Communication Skills", "Information Technology I", "Introduction to Programming Using C++",
-                                "Discrete Mathematics", "Entrepreneurship", "Computer Applications", "Introduce to Economics",
-                                "African Studies", "Communication Skills II Industrial Attachment", "Programming Using Java",
-                                "Information Technology II", "Database Concepts & Technology", "Mathematics & Statistics",
-                                "Introduction to Economics II"
-                            ],
-                            "2": [
-                                "Visual Basic Dot Net", "Database Management System (Oracle)", "Web Technology I",
-                                "Hardware Technology I", "Networking I", "Introduction to Accounting", "Research Methodology",
-                                "Industrial Attachment II", "Hardware Technology II", "Introduction to Software Engineering",
-                                "Web Technology II", "Networking II", "Entrepreneurship II", "Introduction to Accounting II",
-                                "PHP Programming"
-                            ],
-                            "3": [
-                                "Management Information Systems", "Systems Analysis and Design", "Information Systems Security",
-                                "Systems Administration I", "Operating Systems", "E-Commerce", "Systems Administration II",
-                                "Computer Graphics", "Information Systems Security II", "Project",
-                                "Computer Organization & Architecture"
-                            ],
-                             "4": [
-                                "Pending..."
-                            ]
-                        }
-
-                        if year_choice not in course_groups:
-                            response['message'] = INVALID_INPUT
-                            response['continueSession'] = False
-                            return jsonify(response)
-
-                        selected_courses = course_groups[year_choice]
-
-                        grades_rows = get_student_grades(student_id, selected_courses)
-
-                        # Format output for USSD
-                        if grades_rows:
-                            grades_str = "\n".join([f"{row['course_name']}: {row['grade']}" for row in grades_rows])
-                            response['message'] = f"{name}\n{grades_str}"
-                        else:
-                            response['message'] = f"{name}\nNo grades found for selected year."
-                            
-                        response['continueSession'] = False
-                        return jsonify(response)
-
-                    else:
-                        response['message'] = INVALID_INPUT
-                        response['continueSession'] = False
-                        level, step = 0, 0
+            # Get session state from cache
+            state = sessions.get(key)
+            if state is None:
+                screen = 'expired'
+                reply = menu.end(menu.SESSION_EXPIRED)
+                menu.SESSION_EVENTS.inc('expired')
             else:
-                response['message'] = INVALID_INPUT
-                response['continueSession'] = False
-                level, step = 0, 0
-            
-            # Store current state if session continues
-            if response['continueSession']:
-                current_state = UssdState(
-                    session_id=session_id,
-                    msisdn=msisdn,
-                    user_data=user_data,
-                    network=network,
-                    message=response['message'],
-                    level=level,
-                    step=step,
-                    new_session=False
-                )
-                
-                user_response_tracker = cache_data.get(hash(session_id), [])
-                user_response_tracker.append(current_state)
-                cache_data[hash(session_id)] = user_response_tracker
+                screen = f'{state.level}.{state.step}'
+                logging.info("Session level: %(level)s, step: %(step)s, Data: %(data)r",
+                             {'level': state.level, 'step': state.step,
+                              'screen': (state.level, state.step), 'data': hop.user_data},
+                             extra={'event': 'ussd.state'})
+                reply = menu.advance(state, hop.user_data)
+
+        # Store current state if session continues
+        if reply.continue_session:
+            sessions[key] = state
+        elif state is not None:
+            sessions.delete(key)
+            menu.SESSION_EVENTS.inc(menu.ending_event(reply))
+
+    except Exception as e:
+        logging.error("USSD processing error: %s", e)
+        reply = menu.end(menu.UNEXPECTED_ERROR)
+
+    body = codec.encode_response(session_id, user_id, hop.msisdn, reply)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, 'arkesel', screen)
+    return body
+
+
+@app.route('/ussd', methods=['POST'])
+def ussd():
+    return Response(handle_arkesel(request.get_data()), mimetype='application/json')
+
+
+def handle_africastalking(body):
+    """Response body for one Africa's Talking hop, given the form-encoded request body."""
+    # Africa's Talking sends the whole input path (e.g. "1*0722000040*pw*2")
+    # as `text` on every hop, so the menu is replayed from the start and no
+    # session state is read or written.
+    started = time.perf_counter()
+    try:
+        form = dict(parse_qsl(body.decode()))
+        session_id = form.get('sessionId', '')
+        text = form.get('text', '')
+
+        logging.info("USSD Request (AT) - Session: %(session)s, Data: %(data)r",
+                     {'session': session_id, 'data': text}, extra={'event': 'ussd.request'})
+
+        reply, _ = menu.replay(text.split('*') if text else ())
+        body = ('CON ' if reply.continue_session else 'END ') + reply.message
+        if not text:
+            menu.SESSION_EVENTS.inc('started')
+        elif not reply.continue_session:
+            menu.SESSION_EVENTS.inc(menu.ending_event(reply))
 
     except Exception as e:
-        logging.error(f"USSD processing error: {e}")
-        response = {
-            'sessionID': session_id if 'session_id' in locals() else '',
-            'userID': user_id if 'user_id' in locals() else '',
-            'msisdn': msisdn if 'msisdn' in locals() else '',
-            'continueSession': False,
-            'message': "An unexpected error occurred. Please try again later."
-        }
-
-    return jsonify(response)
+        logging.error("USSD processing error: %s", e)
+        body = 'END ' + menu.UNEXPECTED_ERROR
+
+    REQUEST_SECONDS.observe(time.perf_counter() - started, 'africastalking', 'replay')
+    return body.encode()
+
+
+@app.route('/ussd/at', methods=['POST'])
+def ussd_africastalking():
+    return Response(handle_africastalking(request.get_data()), mimetype='text/plain')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+# POSTs to the USSD endpoints are answered before Flask routing and CORS;
+# the routes above stay for anything the fast path passes through.
+app.wsgi_app = UssdFastPath(app.wsgi_app, {
+    '/ussd': ('application/json', handle_arkesel),
+    '/ussd/at': ('text/plain; charset=utf-8', handle_africastalking),
+})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,835 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the USSD hot path
+
+Run every benchmark with `python benchmark.py`, or name the ones to run:
+    python benchmark.py sessions
+"""
+
+import argparse
+import gc
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import database
+import database_schema
+import menu
+from database import password_digest
+from prefetch import Prefetcher
+from result_blobs import rebuild_result_blobs
+from result_cache import ResultCache
+from session_store import SessionState, SessionStore
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark function under name."""
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def per_call_us(fn, repeat):
+    """Average wall time of fn() in microseconds over repeat calls."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def allocated_bytes(build):
+    """Bytes still allocated after build() returns, as seen by tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def percentiles(samples, *points):
+    """The given percentiles (0-100) of a list of samples."""
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points]
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    print("-" * len(title))
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f"  {label:<{width}}  {value}")
+
+
+# --- sessions --------------------------------------------------------------
+
+class _LegacyUssdState:
+    # The per-hop record app.py used to append to a list for every session.
+    def __init__(self, session_id, msisdn, user_data, network, message, level, step, new_session):
+        self.session_id = session_id
+        self.msisdn = msisdn
+        self.user_data = user_data
+        self.network = network
+        self.message = message
+        self.level = level
+        self.step = step
+        self.new_session = new_session
+
+
+def _legacy_session(i):
+    # A session sitting on the year screen: dial string, "1", index, password.
+    sid, msisdn = f"ATUid_{i:012d}", f"23355{i:07d}"
+    hops = [("*928*230#", 0, 0), ("1", 1, 1), (f"07220{i:05d}", 1, 2), (f"pw{i}", 1, 3)]
+    return [
+        _LegacyUssdState(sid, msisdn, data, "MTN", "Enter your password:", level, step, step == 0)
+        for data, level, step in hops
+    ]
+
+
+def _compact_session(i):
+    return SessionState(1, 3, f"07220{i:05d}", password_digest(f"pw{i}"))
+
+
+@benchmark("sessions")
+def bench_sessions(n_sessions=50000, repeat=200000):
+    """Bytes per stored session and per-hop bookkeeping CPU, legacy list vs SessionState."""
+    legacy_bytes = allocated_bytes(lambda: [_legacy_session(i) for i in range(n_sessions)])
+    compact_bytes = allocated_bytes(lambda: [_compact_session(i) for i in range(n_sessions)])
+
+    legacy_store = SessionStore(maxsize=n_sessions * 2)
+    compact_store = SessionStore(maxsize=n_sessions * 2)
+    for i in range(n_sessions):
+        legacy_store[i] = _legacy_session(i)
+        compact_store[i] = _compact_session(i)
+    key = n_sessions // 2
+
+    def legacy_hop():
+        # Re-scan every stored hop to rebuild the inputs, then append a new one.
+        responses = legacy_store.get(key, [])
+        last = responses[-1]
+        user_inputs = []
+        for state in responses:
+            if state.user_data and state.user_data.strip():
+                user_inputs.append(state.user_data.strip())
+        user_inputs.append("1")
+        responses.append(_LegacyUssdState(last.session_id, last.msisdn, "1", "MTN",
+                                          "Select Academic Year:", 1, 3, False))
+        legacy_store[key] = responses
+        responses.pop()
+
+    def compact_hop():
+        state = compact_store.get(key)
+        state.year = "1"
+        state.step = 3
+        compact_store[key] = state
+
+    report(f"Session state at {n_sessions:,} concurrent sessions", [
+        ("legacy bytes/session", f"{legacy_bytes / n_sessions:,.0f}"),
+        ("compact bytes/session", f"{compact_bytes / n_sessions:,.0f}"),
+        ("legacy us/hop", f"{per_call_us(legacy_hop, repeat):.2f}"),
+        ("compact us/hop", f"{per_call_us(compact_hop, repeat):.2f}"),
+    ])
+
+
+# --- dispatch --------------------------------------------------------------
+
+def _legacy_step(state, user_data):
+    # The nested if/elif chain ussd() used before menu.py, minus the database
+    # step, with its per-request menu constants.
+    WELCOME_MENU = (
+        "Welcome to TTU Result Checker\n"
+        "1. Check Results\n"
+        "2. Exit"
+    )
+    ENTER_INDEX = "Enter your index number:"
+    ENTER_PASSWORD = "Enter your password:"
+    SELECT_YEAR = (
+        "Select Academic Year:\n"
+        "1. Level 100\n"
+        "2. Level 200\n"
+        "3. Level 300\n"
+        "4. Level 400"
+    )
+    THANK_YOU = "Thank you for using TTU Result Checker."
+    INVALID_INPUT = "Invalid input. Please try again."
+    response = {'continueSession': True, 'message': WELCOME_MENU}
+    user_input = user_data.strip() if user_data else ''
+    if state.level == 0:
+        if user_data == "1":
+            response['message'] = ENTER_INDEX
+            state.level, state.step = 1, 1
+        elif user_data == "2":
+            response['message'] = THANK_YOU
+            response['continueSession'] = False
+        else:
+            response['message'] = INVALID_INPUT
+            response['continueSession'] = False
+    elif state.level == 1:
+        if state.step == 1:
+            state.index_number = user_input
+            response['message'] = ENTER_PASSWORD
+            state.step = 2
+        elif state.step == 2:
+            state.password_hash = password_digest(user_input) if user_input else None
+            response['message'] = SELECT_YEAR
+            state.step = 3
+    else:
+        response['message'] = INVALID_INPUT
+        response['continueSession'] = False
+    return response
+
+
+@benchmark("dispatch")
+def bench_dispatch(repeat=200000):
+    """Per-hop dispatch cost of the menu engine against the old if/elif handler."""
+    hops = (("1", (0, 0)), ("0722000040", (1, 1)), ("password1", (1, 2)), ("1", (7, 0)))
+    state = SessionState()
+
+    # The same menu with 100 more screens (e.g. per-semester sub-menus)
+    extra = tuple(menu.Screen((9, n), f"Screen {n}", options={"0": menu.MAIN_MENU}) for n in range(100))
+    bigger = menu.compile_screens(menu.SCREENS + extra)
+
+    def run(step):
+        def one_pass():
+            for user_data, (level, sub) in hops:
+                state.level, state.step = level, sub
+                step(state, user_data)
+        return per_call_us(one_pass, repeat) / len(hops)
+
+    report("Per-hop menu dispatch (menu choice, index, password, unknown state)", [
+        ("if/elif handler us/hop", f"{run(_legacy_step):.3f}"),
+        ("menu engine us/hop", f"{run(menu.advance):.3f}"),
+        ("menu engine, +100 screens us/hop", f"{run(lambda st, data: menu.advance(st, data, bigger)):.3f}"),
+    ])
+
+
+# --- grades ----------------------------------------------------------------
+
+def build_grades_db(path, n_students, indexes=True):
+    """A students database at path with n_students, each graded in every catalog course."""
+    database.DB_PATH = path
+    database_schema.create_tables()
+    conn = sqlite3.connect(path)
+    if not indexes:
+        # idx_grades_unique starts with student_id too; keep it and the
+        # "no index" lookups would still be index searches
+        conn.execute("DROP INDEX idx_grades_unique")
+        conn.execute("DROP INDEX idx_grades_student_course")
+        conn.execute("DROP INDEX idx_courses_level")
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    course_ids = [row[0] for row in conn.execute("SELECT id FROM courses")]
+    with conn:
+        conn.executemany(
+            "INSERT INTO students (id, index_number, password, name) VALUES (?, ?, ?, ?)",
+            ((i, f"07{i:08d}", f"pw{i}", f"Student {i}") for i in range(1, n_students + 1))
+        )
+        conn.executemany(
+            "INSERT INTO grades (student_id, course_id, grade) VALUES (?, ?, 'B+')",
+            ((i, c) for i in range(1, n_students + 1) for c in course_ids)
+        )
+    conn.close()
+
+
+def _level_grades(student_id, level):
+    # One level's grades by student id, as the final step read them before
+    # authentication and grades became one query
+    with database.connection() as conn:
+        return [tuple(row) for row in conn.execute(database.LEVEL_GRADES_SQL, (student_id, level))]
+
+
+@benchmark("grades")
+def bench_grades(n_students=100000, lookups=200):
+    """LEVEL_GRADES_SQL latency on n_students x 40 courses, with and without the covering index."""
+    rows = []
+    db_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "students.db")
+        build_grades_db(path, n_students, indexes=False)
+        rng = random.Random(1)
+        for label in ("no index", "covering index"):
+            if label == "covering index":
+                database_schema.create_tables()
+                conn = sqlite3.connect(path)
+                conn.execute("ANALYZE")
+                conn.close()
+            samples = []
+            for _ in range(lookups if label != "no index" else max(5, lookups // 20)):
+                student_id, level = rng.randint(1, n_students), rng.choice((100, 200, 300))
+                start = time.perf_counter()
+                _level_grades(student_id, level)
+                samples.append((time.perf_counter() - start) * 1e3)
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99 ms", f"{p50:.3f} / {p99:.3f}"))
+    database.DB_PATH = db_path
+    report(f"Level grade lookup, {n_students:,} students x 40 courses", rows)
+
+
+@benchmark("seed")
+def bench_seed(n_students=100000):
+    """Time to generate n_students synthetic students x every catalog course."""
+    db_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "students.db")
+        database_schema.create_tables()
+        start = time.perf_counter()
+        rows = database_schema.insert_synthetic_data(n_students, seed=1)
+        elapsed = time.perf_counter() - start
+    database.DB_PATH = db_path
+    report(f"Synthetic seed, {n_students:,} students", [
+        ("grade rows", f"{rows:,}"),
+        ("seconds", f"{elapsed:.1f}"),
+        ("rows/s", f"{rows / elapsed:,.0f}"),
+    ])
+
+
+@benchmark("import")
+def bench_import(n_students=25000):
+    """Throughput of import_grades for n_students x 40 courses (1M rows by default)."""
+    import csv
+
+    from catalog import load_catalog
+    from import_grades import import_grades
+
+    db_path = database.DB_PATH
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "students.db")
+        database_schema.create_tables()
+        database_schema.insert_synthetic_data(n_students, seed=1)
+        conn = sqlite3.connect(database.DB_PATH)
+        with conn:
+            conn.execute("DELETE FROM grades")
+        index_numbers = [row[0] for row in conn.execute("SELECT index_number FROM students ORDER BY id")]
+        conn.close()
+        course_names = list(load_catalog().course_ids)
+
+        def write_csv(path, seed, changes=0):
+            rng = random.Random(seed)
+            grades = [[rng.choice(database_schema.GRADE_SCALE) for _ in course_names] for _ in index_numbers]
+            for _ in range(changes):
+                student = grades[rng.randrange(len(grades))]
+                course = rng.randrange(len(course_names))
+                student[course] = next(g for g in database_schema.GRADE_SCALE if g != student[course])
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(("index_number", "course", "grade"))
+                for index_number, student in zip(index_numbers, grades):
+                    writer.writerows(zip(itertools.repeat(index_number), course_names, student))
+
+        first, second, third = (os.path.join(tmp, f"{name}.csv") for name in ("first", "second", "third"))
+        write_csv(first, 1)
+        write_csv(second, 2)
+        write_csv(third, 2, changes=300)
+        for label, path, full in (("into empty grades", first, False), ("same file again", first, False),
+                                  ("new grades for everyone", second, False),
+                                  ("300 changed rows", third, False), ("300 rows changed back, --full", second, True)):
+            result = import_grades(path, full=full)
+            rows.append((f"{label} rows/s", f"{result.rows / result.seconds:,.0f} "
+                                            f"({result.written:,} written, {len(result.affected):,} "
+                                            f"results affected, in {result.seconds:.1f}s)"))
+        database.close_pool()
+    database.DB_PATH = db_path
+    report(f"Grade import, {n_students * len(course_names):,} CSV rows", rows)
+
+
+# --- result step -----------------------------------------------------------
+
+def _connect_per_call_result(index, password_hash, level):
+    # The final step as it was before the connection pool: a fresh
+    # sqlite3.connect for authentication and another for the grades.
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    student = conn.execute(database.STUDENT_BY_INDEX_SQL, (index,)).fetchone()
+    conn.close()
+    if student is None or password_digest(student["password"]) != password_hash:
+        return None
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute(database.LEVEL_GRADES_SQL, (student["id"], level)).fetchall()
+    conn.close()
+    return rows
+
+
+def _pooled_two_query_result(state, year):
+    # Pooled connections, but authentication and grades as separate queries
+    with database.connection() as conn:
+        student = conn.execute(database.STUDENT_BY_INDEX_SQL, (state.index_number,)).fetchone()
+    if student is not None and password_digest(student["password"]) == state.password_hash:
+        return _level_grades(student["id"], menu.YEAR_LEVELS[year])
+
+
+@benchmark("result_step")
+def bench_result_step(n_students=20000, lookups=2000):
+    """p50/p99 of the final result hop: connection per query, pooled, pooled single query."""
+    rows = []
+    db_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        build_grades_db(os.path.join(tmp, "students.db"), n_students)
+        rng = random.Random(1)
+        picks = [rng.randint(1, n_students) for _ in range(lookups)]
+        years = [rng.choice("123") for _ in range(lookups)]
+
+        def run(label, step):
+            samples = []
+            for i, year in zip(picks, years):
+                state = SessionState(1, 3, f"07{i:08d}", password_digest(f"pw{i}"))
+                start = time.perf_counter()
+                step(state, year)
+                samples.append((time.perf_counter() - start) * 1e3)
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99 ms", f"{p50:.3f} / {p99:.3f}"))
+
+        run("connect per query", lambda state, year: _connect_per_call_result(
+            state.index_number, state.password_hash, menu.YEAR_LEVELS[year]))
+        run("pooled, auth + grades queries", _pooled_two_query_result)
+        run("pooled, single query (show_results)", menu.show_results)
+        run("pooled, single query + render", lambda state, year: menu.render_result(
+            database.get_student_result(state.index_number, state.password_hash, menu.YEAR_LEVELS[year])))
+        conn = sqlite3.connect(database.DB_PATH)
+        with conn:
+            rebuild_result_blobs(conn.cursor())
+        conn.close()
+        run("pooled, pre-rendered blob", lambda state, year: database.get_result_message(
+            state.index_number, state.password_hash, menu.YEAR_LEVELS[year]))
+        database.close_pool()
+    database.DB_PATH = db_path
+    report(f"Final result step, {n_students:,} students", rows)
+
+
+# --- snapshots -------------------------------------------------------------
+
+@benchmark("snapshot")
+def bench_snapshot(n_students=20000, seconds=2.0):
+    """Result lookups while grades are being rewritten: working database vs published snapshot."""
+    import threading
+
+    import snapshot
+
+    rows = []
+    db_path = database.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        build_grades_db(os.path.join(tmp, "students.db"), n_students)
+
+        def rewrite_grades(stop):
+            # A long import: big write transactions back to back
+            conn = sqlite3.connect(database.DB_PATH, isolation_level=None)
+            grades = database_schema.GRADE_SCALE
+            n = 0
+            while not stop.is_set():
+                first = n * 2000 % n_students
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("UPDATE grades SET grade = ? WHERE student_id BETWEEN ? AND ?",
+                             (grades[n % len(grades)], first, first + 2000))
+                conn.execute("COMMIT")
+                n += 1
+            conn.close()
+
+        def run(label):
+            rng = random.Random(1)
+            stop = threading.Event()
+            writer = threading.Thread(target=rewrite_grades, args=(stop,))
+            writer.start()
+            samples = []
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                i = rng.randint(1, n_students)
+                start = time.perf_counter()
+                database.get_student_result(f"07{i:08d}", password_digest(f"pw{i}"), 100)
+                samples.append((time.perf_counter() - start) * 1e3)
+            stop.set()
+            writer.join()
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99/max ms", f"{p50:.3f} / {p99:.3f} / {max(samples):.3f}"))
+
+        run("working database")
+        start = time.perf_counter()
+        path = snapshot.publish()
+        rows.append(("publish (build + verify + swap) s", f"{time.perf_counter() - start:.2f}"))
+        assert database.get_pool().path == path
+        run("published snapshot")
+        database.close_pool()
+    database.DB_PATH = db_path
+    report(f"Result lookups during an import, {n_students:,} students", rows)
+
+
+@benchmark("in_memory")
+def bench_in_memory(n_students=100000, lookups=20000):
+    """Result lookups from the file vs an in-memory copy, and the copy's load time and size."""
+    rows = []
+    db_path, in_memory = database.DB_PATH, database.IN_MEMORY
+    with tempfile.TemporaryDirectory() as tmp:
+        build_grades_db(os.path.join(tmp, "students.db"), n_students)
+        rng = random.Random(1)
+        picks = [rng.randint(1, n_students) for _ in range(lookups)]
+        for label, mode in (("file", False), ("in memory", True)):
+            database.close_pool()
+            database.IN_MEMORY = mode
+            start = time.perf_counter()
+            pool = database.get_pool()
+            with pool.connection():
+                pass
+            if mode:
+                rows.append(("load", f"{time.perf_counter() - start:.2f}s, "
+                                     f"{pool.memory_bytes / 2 ** 20:.1f} MiB"))
+            samples = []
+            for i in picks:
+                start = time.perf_counter()
+                database.get_student_result(f"07{i:08d}", password_digest(f"pw{i}"), 100)
+                samples.append((time.perf_counter() - start) * 1e6)
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99 us", f"{p50:.1f} / {p99:.1f}"))
+        database.close_pool()
+    database.DB_PATH, database.IN_MEMORY = db_path, in_memory
+    report(f"Result lookups, {n_students:,} students", rows)
+
+
+# --- prefetch --------------------------------------------------------------
+
+@benchmark("prefetch")
+def bench_prefetch(n_students=20000, sessions=500, think_ms=20):
+    """Final-step latency with and without prefetch, with think_ms between hops."""
+    import logging
+
+    rows = []
+    db_path = database.DB_PATH
+    saved = menu.results, menu.prefetcher
+    # Every hop logs through menu; keep the output to the report
+    logging.disable(logging.INFO)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            build_grades_db(os.path.join(tmp, "students.db"), n_students)
+            rng = random.Random(1)
+            picks = [(rng.randint(1, n_students), rng.choice("123")) for _ in range(sessions)]
+            for enabled in (False, True):
+                menu.results = ResultCache()
+                menu.prefetcher = Prefetcher(menu.render_result, menu.YEAR_LEVELS.values(),
+                                             enabled=enabled, cache=menu.results)
+                for i, year in picks:
+                    state = SessionState(*menu.ASK_INDEX)
+                    menu.advance(state, f"07{i:08d}")
+                    time.sleep(think_ms / 1e3)
+                    menu.advance(state, f"pw{i}")
+                    time.sleep(think_ms / 1e3)
+                    menu.advance(state, year)
+                stats = menu.prefetcher.stats()
+                menu.prefetcher.shutdown()
+                label = "prefetched" if enabled else "not_prefetched"
+                p50, p99 = stats[f'final_step_{label}_p50_ms'], stats[f'final_step_{label}_p99_ms']
+                rows.append((f"prefetch {'on' if enabled else 'off'} final step p50/p99 ms", f"{p50:.3f} / {p99:.3f}"))
+            database.close_pool()
+    finally:
+        logging.disable(logging.NOTSET)
+        menu.results, menu.prefetcher = saved
+        database.DB_PATH = db_path
+    report(f"Final step with speculative prefetch, {think_ms} ms think-time", rows)
+
+
+# --- stateless -------------------------------------------------------------
+
+@benchmark("stateless")
+def bench_stateless(sessions=500):
+    """Whole result-check sessions through /ussd (session store) and /ussd/at (replayed path)."""
+    # Imported here: app sets up logging and loads the catalog on import
+    import logging
+
+    import app
+
+    client = app.app.test_client()
+    path = ['1', '0722000040', 'password1', '1']
+
+    def arkesel(n):
+        for hop, user_data in enumerate(['*928*230#'] + path):
+            client.post('/ussd', json={
+                'sessionID': f'bench-{n}', 'userID': 'bench', 'newSession': hop == 0,
+                'msisdn': '233500000000', 'userData': user_data, 'network': 'MTN',
+            })
+
+    def africastalking(n):
+        for hop in range(len(path) + 1):
+            client.post('/ussd/at', data={
+                'sessionId': f'bench-{n}', 'phoneNumber': '+233500000000', 'text': '*'.join(path[:hop]),
+            })
+
+    rows = []
+    # Per-hop INFO logging would dominate both arms
+    logging.disable(logging.INFO)
+    try:
+        for label, run in (("/ussd, session-backed", arkesel), ("/ussd/at, stateless replay", africastalking)):
+            samples = []
+            for n in range(sessions):
+                start = time.perf_counter()
+                run(n)
+                samples.append((time.perf_counter() - start) * 1e3)
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99 ms/session", f"{p50:.3f} / {p99:.3f}"))
+    finally:
+        logging.disable(logging.NOTSET)
+    report(f"Five-hop result check over {sessions} sessions (Flask test client)", rows)
+
+
+# --- codec -----------------------------------------------------------------
+
+@benchmark("codec")
+def bench_codec(repeat=100000):
+    """Per-request parse + serialize: get_json/jsonify against the codec module."""
+    import json
+
+    import codec
+    from flask import Flask, jsonify, request
+
+    body = json.dumps({
+        'sessionID': '1d2c3b4a5f6e7d8c', 'userID': 'arkesel', 'newSession': False,
+        'msisdn': '233500000000', 'userData': '1', 'network': 'MTN',
+    }).encode()
+    result = menu.end("Mensah Miguel Etornam Kwame\n" + "\n".join(f"Course {i}: B+" for i in range(10)))
+    flask_app = Flask(__name__)
+
+    def flask_codec(reply):
+        with flask_app.test_request_context('/ussd', method='POST', data=body,
+                                            content_type='application/json'):
+            data = request.get_json(silent=True) or {}
+            jsonify({
+                'sessionID': data.get('sessionID', ''), 'userID': data.get('userID', ''),
+                'msisdn': data.get('msisdn', ''),
+                'continueSession': reply.continue_session, 'message': reply.message,
+            }).get_data()
+
+    def fast_codec(reply):
+        hop = codec.decode_request(body)
+        codec.encode_response(hop.session_id, hop.user_id, hop.msisdn, reply)
+
+    def context_only():
+        with flask_app.test_request_context('/ussd', method='POST', data=body,
+                                            content_type='application/json'):
+            pass
+
+    context_us = per_call_us(context_only, repeat // 10)
+    rows = [("JSON backend", codec.JSON_BACKEND)]
+    for label, reply in (("welcome screen", menu.WELCOME), ("rendered result", result)):
+        flask_us = per_call_us(lambda: flask_codec(reply), repeat // 10) - context_us
+        rows.append((f"{label}: get_json + jsonify us", f"{flask_us:.2f}"))
+        rows.append((f"{label}: codec us", f"{per_call_us(lambda: fast_codec(reply), repeat):.2f}"))
+    report("Per-request serialization (request context setup excluded)", rows)
+
+
+# --- wsgi ------------------------------------------------------------------
+
+@benchmark("wsgi")
+def bench_wsgi(sessions=1000):
+    """Requests per second for identical session scripts through Flask and the WSGI fast path."""
+    import json
+    import logging
+
+    import app
+    from loadgen import wsgi_post
+
+    path = ['1', '0722000040', 'password1', '1']
+    script = []
+    for n in range(sessions):
+        for hop, user_data in enumerate(['*928*230#'] + path):
+            script.append(('/ussd', json.dumps({
+                'sessionID': f'wsgi-{n}', 'userID': 'bench', 'newSession': hop == 0,
+                'msisdn': '233500000000', 'userData': user_data, 'network': 'MTN',
+            }).encode(), 'application/json'))
+        for hop in range(len(path) + 1):
+            script.append(('/ussd/at', f"sessionId=wsgi-{n}&text={'*'.join(path[:hop])}".encode(),
+                           'application/x-www-form-urlencoded'))
+
+    fast_path = app.app.wsgi_app
+    rows = []
+    logging.disable(logging.INFO)
+    try:
+        for label, wsgi_app in (("Flask routing + CORS", fast_path.app), ("WSGI fast path", fast_path)):
+            start = time.perf_counter()
+            for request in script:
+                wsgi_post(wsgi_app, *request)
+            elapsed = time.perf_counter() - start
+            rows.append((f"{label} requests/s", f"{len(script) / elapsed:,.0f}"))
+    finally:
+        logging.disable(logging.NOTSET)
+    report(f"USSD throughput, one core, {len(script):,} requests", rows)
+
+
+# --- logging ---------------------------------------------------------------
+
+@benchmark("logging")
+def bench_logging(hops=50000):
+    """Request-thread cost of a hop's log lines: synchronous f-strings against the queue pipeline."""
+    import logging
+    import queue
+    from logging.handlers import QueueListener
+
+    from log_config import LOG_FORMAT, LazyQueueHandler, RedactFilter, SamplingFilter, skip_unused_record_fields
+
+    state = SessionState(*menu.ASK_PASSWORD)
+
+    def eager(log):
+        # The hop's log lines as app.py used to write them
+        log.info(f"USSD Request - Session: sess-1, New: False, Data: 'password1'")
+        log.info(f"Session level: {state.level}, step: {state.step}")
+        log.info(f"Attempting authentication - Index: '0722000040'")
+
+    def lazy(log):
+        log.info("USSD Request - Session: %(session)s, New: %(new)s", {'session': 'sess-1', 'new': False},
+                 extra={'event': 'ussd.request'})
+        log.info("Session level: %(level)s, step: %(step)s, Data: %(data)r",
+                 {'level': state.level, 'step': state.step, 'screen': (state.level, state.step),
+                  'data': 'password1'}, extra={'event': 'ussd.state'})
+        log.info("Attempting authentication - Index: %r", '0722000040', extra={'event': 'ussd.auth'})
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(label, handler, lines, listener=None):
+            log = logging.getLogger(f"bench.{label}")
+            log.propagate = False
+            log.setLevel(logging.INFO)
+            log.addHandler(handler)
+            if listener:
+                listener.start()
+            samples = []
+            for _ in range(hops):
+                start = time.perf_counter()
+                lines(log)
+                samples.append((time.perf_counter() - start) * 1e6)
+            if listener:
+                listener.stop()
+            log.removeHandler(handler)
+            p50, p99 = percentiles(samples, 50, 99)
+            rows.append((f"{label} p50/p99 us/hop", f"{p50:.2f} / {p99:.2f}"))
+
+        def file_handler(name):
+            handler = logging.FileHandler(os.path.join(tmp, name))
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            return handler
+
+        run("synchronous file, f-strings", file_handler("sync.log"), eager)
+        saved = logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing
+        skip_unused_record_fields()
+        for label, rates in (("queue + lazy args", {}), ("queue, ussd.state sampled 10%", {'ussd.state': 0.1})):
+            records = queue.SimpleQueue()
+            writer = file_handler("queued.log")
+            writer.addFilter(RedactFilter(menu.SERVICE_CODE, menu.ASK_PASSWORD))
+            handler = LazyQueueHandler(records)
+            handler.addFilter(SamplingFilter(rates))
+            run(label, handler, lazy, QueueListener(records, writer))
+        logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing = saved
+    report(f"Logging cost on the request thread, 3 INFO lines per hop, {hops:,} hops", rows)
+
+
+# --- metrics ---------------------------------------------------------------
+
+class _NullMetric:
+    def observe(self, *args):
+        pass
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def time(self, *labels):
+        import contextlib
+        return contextlib.nullcontext()
+
+
+@benchmark("metrics")
+def bench_metrics(repeat=200000, sessions=2000):
+    """Cost of recording metrics, per call and per USSD hop."""
+    import json
+    import logging
+
+    import app
+    from metrics import Counter, Histogram, Registry
+
+    registry = Registry()
+    histogram = Histogram('bench_seconds', 'bench', ('endpoint', 'screen'), registry=registry)
+    counter = Counter('bench_events', 'bench', ('event',), registry=registry)
+
+    def timed():
+        with histogram.time('arkesel', '1.3'):
+            pass
+
+    rows = [
+        ("Histogram.observe us", f"{per_call_us(lambda: histogram.observe(0.0004, 'arkesel', '1.3'), repeat):.3f}"),
+        ("Histogram.time block us", f"{per_call_us(timed, repeat):.3f}"),
+        ("Counter.inc us", f"{per_call_us(lambda: counter.inc('started'), repeat):.3f}"),
+        ("/metrics render us", f"{per_call_us(app.REGISTRY.render, 1000):.1f}"),
+    ]
+
+    hops = []
+    for n in range(sessions):
+        for hop, user_data in enumerate(['*928*230#', '1', '0722000040', 'password1', '1']):
+            hops.append(json.dumps({
+                'sessionID': f'metrics-{n}', 'userID': 'bench', 'newSession': hop == 0,
+                'msisdn': '233500000000', 'userData': user_data, 'network': 'MTN',
+            }).encode())
+
+    def run():
+        samples = []
+        for body in hops:
+            start = time.perf_counter()
+            app.handle_arkesel(body)
+            samples.append((time.perf_counter() - start) * 1e6)
+        return percentiles(samples, 50, 99)
+
+    instruments = (app, 'REQUEST_SECONDS'), (menu, 'SESSION_EVENTS'), (database, 'QUERY_SECONDS')
+    saved = [getattr(module, name) for module, name in instruments]
+    logging.disable(logging.INFO)
+    try:
+        run()  # warm the result cache so both runs do the same work
+        with_metrics = run()
+        for module, name in instruments:
+            setattr(module, name, _NullMetric())
+        without_metrics = run()
+    finally:
+        for (module, name), metric in zip(instruments, saved):
+            setattr(module, name, metric)
+        logging.disable(logging.NOTSET)
+    rows.append(("hop without metrics p50/p99 us", "{:.2f} / {:.2f}".format(*without_metrics)))
+    rows.append(("hop with metrics p50/p99 us", "{:.2f} / {:.2f}".format(*with_metrics)))
+    report("Metrics recording overhead", rows)
+
+
+# --- replay ----------------------------------------------------------------
+
+@benchmark("replay")
+def bench_replay(n_sessions=1000, rate=500):
+    """Recorded session mix replayed in-process through the whole app."""
+    import logging
+
+    import loadgen
+
+    logging.disable(logging.ERROR)
+    try:
+        sessions = loadgen.record_sessions(n_sessions, seed=1)
+        result = loadgen.Replay(loadgen.InProcessTarget(), rate).run(sessions)
+    finally:
+        logging.disable(logging.NOTSET)
+    rows = [
+        ("hops/s", f"{result['hops_per_second']:,.0f}"),
+        ("errors / unexpected replies", f"{result['errors']} / {result['unexpected_replies']}"),
+        ("peak session store size", result['peak_session_store_size']),
+    ]
+    for step, stats in result['steps'].items():
+        rows.append((f"{step} p50/p95/p99 ms", f"{stats['p50_ms']} / {stats['p95_ms']} / {stats['p99_ms']}"))
+    report(f"Replay of {n_sessions} recorded sessions at {rate}/s", rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run (default: all of {', '.join(sorted(BENCHMARKS))})")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
@@ -0,0 +1,89 @@
+"""
+In-memory index of the course catalog
+
+The courses table is small and only changes between semesters, so it is
+read once and kept in memory: course names by ID, and each level's course
+IDs in catalog order. It is read again when the database readers use
+changes, so a course added with new grades is known as soon as they are.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from database import connection, get_grades_version, get_pool
+
+
+class Catalog:
+    def __init__(self, rows):
+        # rows: (id, name, level, semester) ordered by id
+        self.course_names = {}
+        self.course_levels = {}
+        self.level_courses = {}
+        for course_id, name, level, semester in rows:
+            self.course_names[course_id] = name
+            self.course_levels[course_id] = level
+            self.level_courses.setdefault(level, []).append(course_id)
+        self.level_courses = {level: tuple(ids) for level, ids in self.level_courses.items()}
+        self.course_ids = {name: course_id for course_id, name in self.course_names.items()}
+
+    def __len__(self):
+        return len(self.course_names)
+
+
+def load_catalog():
+    """Read the courses table into a new Catalog."""
+    with connection() as conn:
+        rows = conn.execute("SELECT id, name, level, semester FROM courses ORDER BY id").fetchall()
+    return Catalog(tuple(row) for row in rows)
+
+
+CATALOG_CHECK_INTERVAL = 1.0
+
+# (catalog, pool it was read from, grades_version it was read at, checked_at)
+_catalog = (None, None, None, None)
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    The process-wide Catalog, loaded on first use. It is read again when
+    get_pool() moves to another database (a published snapshot, a fresh
+    in-memory copy) or meta.grades_version changes, which is polled at most
+    once per CATALOG_CHECK_INTERVAL.
+    """
+    global _catalog
+    pool = get_pool()
+    catalog, loaded_from, version, checked_at = _catalog
+    now = time.monotonic()
+    if catalog is not None and loaded_from is pool and now - checked_at < CATALOG_CHECK_INTERVAL:
+        return catalog
+    with _lock:
+        catalog, loaded_from, version, checked_at = _catalog
+        if catalog is not None and loaded_from is pool and now - checked_at < CATALOG_CHECK_INTERVAL:
+            return catalog
+        try:
+            current = get_grades_version()
+        except sqlite3.Error as e:
+            if catalog is None:
+                raise
+            # Keep serving the catalog we have and try again next interval
+            logging.warning("Could not read grades version for the catalog: %s", e)
+            _catalog = (catalog, loaded_from, version, now)
+            return catalog
+        if catalog is None or loaded_from is not pool or current != version:
+            catalog = load_catalog()
+        _catalog = (catalog, pool, current, now)
+    return catalog
+
+
+def reload_catalog():
+    """Re-read the courses table, e.g. after new courses were added."""
+    global _catalog
+    with _lock:
+        pool = get_pool()
+        version = get_grades_version()
+        catalog = load_catalog()
+        _catalog = (catalog, pool, version, time.monotonic())
+    return catalog
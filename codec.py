@@ -0,0 +1,103 @@
+"""
+Fast decoding and encoding of Arkesel USSD requests and responses
+
+Requests are parsed with orjson when it is installed (set USSD_JSON=json to
+force the standard library) and their fixed fields checked in one pass.
+Responses whose message is one of the menu's fixed screens are built from
+pre-serialized byte templates, with only the ID fields spliced in; other
+messages, such as rendered results, are serialized normally.
+"""
+
+import json
+import os
+from collections import namedtuple
+
+import menu
+
+try:
+    if os.environ.get('USSD_JSON', '') == 'json':
+        raise ImportError
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+    loads = orjson.loads
+    dumps = orjson.dumps
+else:
+    JSON_BACKEND = 'json'
+    loads = json.loads
+
+    def dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class CodecError(ValueError):
+    """A request body that is not a valid Arkesel USSD request."""
+
+
+ArkeselRequest = namedtuple('ArkeselRequest', 'session_id user_id new_session msisdn user_data network')
+
+# (JSON field, expected type, default when missing), in ArkeselRequest order
+REQUEST_FIELDS = (
+    ('sessionID', str, ''),
+    ('userID', str, ''),
+    ('newSession', bool, True),
+    ('msisdn', str, ''),
+    ('userData', str, ''),
+    ('network', str, ''),
+)
+
+
+def decode_request(body):
+    """Parse and validate a raw Arkesel request body into an ArkeselRequest."""
+    if not body or not body.strip():
+        raise CodecError("empty request body")
+    try:
+        data = loads(body)
+    except ValueError as e:
+        raise CodecError(f"invalid JSON: {e}") from None
+    if not isinstance(data, dict):
+        raise CodecError("request body is not a JSON object")
+    values = []
+    for field, kind, default in REQUEST_FIELDS:
+        value = data.get(field)
+        if value is None:
+            value = default
+        elif type(value) is not kind:
+            raise CodecError(f"{field} must be {kind.__name__}")
+        values.append(value)
+    return ArkeselRequest._make(values)
+
+
+def _template(reply):
+    # Everything after the ID fields, with the closing brace
+    tail = dumps({'continueSession': reply.continue_session, 'message': reply.message})
+    return b',' + tail[1:]
+
+
+# Replies whose bytes never change: every prompt and fixed message
+FIXED_REPLIES = (
+    menu.WELCOME,
+    menu.INVALID,
+    menu.end(menu.THANK_YOU),
+    menu.end(menu.NO_RECORD),
+    menu.end(menu.SESSION_EXPIRED),
+    menu.end(menu.UNEXPECTED_ERROR),
+) + tuple(menu.Reply(screen.prompt, True) for screen in menu.SCREENS)
+
+TEMPLATES = {reply: _template(reply) for reply in FIXED_REPLIES}
+
+
+def encode_response(session_id, user_id, msisdn, reply):
+    """Serialized Arkesel response for a menu Reply."""
+    tail = TEMPLATES.get(reply)
+    if tail is None:
+        tail = _template(reply)
+    return b''.join((
+        b'{"sessionID":', dumps(session_id),
+        b',"userID":', dumps(user_id),
+        b',"msisdn":', dumps(msisdn),
+        tail,
+    ))
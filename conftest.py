@@ -0,0 +1,55 @@
+"""
+Shared fixtures. `db` points database.DB_PATH at a fresh sample database
+for the test; a test module that needs more (a connection, different pool
+settings, its own result cache) overrides `db` and asks for this one.
+
+`client` is a test client for app on that database, with a fresh
+in-process session store; `post_hop` and `post_session` send it Arkesel
+hops the way the gateway does.
+"""
+
+import pytest
+
+import database
+import database_schema
+from session_store import SessionStore
+
+SERVICE_CODE_DIAL = '*928*230#'
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'students.db'))
+    database_schema.create_tables()
+    database_schema.insert_sample_data()
+    yield database.DB_PATH
+    database.close_pool()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    import app as app_module  # imported here: app sets up logging and sessions on import
+    monkeypatch.setattr(app_module, 'cache_data', SessionStore())
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def post_hop(client):
+    """post_hop(session_id, user_data, new_session=False) -> the /ussd response."""
+    def post_hop(session_id, user_data, new_session=False):
+        return client.post('/ussd', json={
+            'sessionID': session_id, 'userID': 'test', 'newSession': new_session,
+            'msisdn': '233500000000', 'userData': user_data, 'network': 'MTN',
+        })
+    return post_hop
+
+
+@pytest.fixture
+def post_session(post_hop):
+    """post_session(session_id, answers) dials, answers each screen, and returns the last reply."""
+    def post_session(session_id, answers):
+        reply = post_hop(session_id, SERVICE_CODE_DIAL, new_session=True).get_json()
+        for user_data in answers:
+            reply = post_hop(session_id, user_data).get_json()
+        return reply
+    return post_session
@@ -1,5 +1,75 @@
 import sqlite3
 import logging
+import hashlib
+import hmac
+import os
+import queue
+import threading
+import time
+import atexit
+import itertools
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from metrics import Gauge, Histogram
+
+# Path of the students database; USSD_DB_PATH overrides it
+DB_PATH = os.environ.get('USSD_DB_PATH', 'instance/students.db')
+
+# Connections kept open per worker process; USSD_DB_POOL_SIZE overrides it
+POOL_SIZE = int(os.environ.get('USSD_DB_POOL_SIZE', 4))
+# Compiled statements cached per connection (sqlite3's default is 128)
+STATEMENT_CACHE_SIZE = 256
+# Idle connections older than this are checked with SELECT 1 before reuse
+HEALTH_CHECK_INTERVAL = 30
+# Bytes of a published snapshot each connection memory-maps; USSD_DB_MMAP_SIZE overrides it
+MMAP_SIZE = int(os.environ.get('USSD_DB_MMAP_SIZE', 256 * 1024 * 1024))
+# How often each worker re-reads the snapshot pointer (see snapshot.py)
+SNAPSHOT_CHECK_INTERVAL = 1.0
+# USSD_DB_IN_MEMORY=1 serves reads from a copy of the database held in RAM
+IN_MEMORY = os.environ.get('USSD_DB_IN_MEMORY', '') == '1'
+
+QUERY_SECONDS = Histogram('ussd_db_query_seconds', 'Time to run a hot-path query', ('query',))
+
+# Every query this module runs. Names end in _SQL so test_query_plans.py
+# can check that none of them needs a full table scan.
+AUTHENTICATE_SQL = "SELECT id, name, email FROM students WHERE index_number = ? AND password = ?"
+STUDENT_BY_INDEX_SQL = "SELECT id, name, email, password FROM students WHERE index_number = ?"
+STUDENT_GRADES_SQL = (
+    "SELECT c.name AS course_name, g.grade FROM grades g JOIN courses c ON c.id = g.course_id "
+    "WHERE g.student_id = ?"
+)
+# {placeholders} is filled with one ? per course name
+STUDENT_COURSE_GRADES_SQL = STUDENT_GRADES_SQL + " AND c.name IN ({placeholders})"
+LEVEL_GRADES_SQL = (
+    "SELECT g.course_id, g.grade FROM grades g JOIN courses c ON c.id = g.course_id "
+    "WHERE g.student_id = ? AND c.level = ? ORDER BY g.course_id"
+)
+# The whole result step in one statement: the student row, LEFT JOINed to
+# their grades for one level (a single row of NULL grades if there are none)
+STUDENT_LEVEL_RESULT_SQL = (
+    "SELECT s.id, s.name, s.password, g.course_id, g.grade FROM students s "
+    "LEFT JOIN grades g ON g.student_id = s.id "
+    "AND g.course_id IN (SELECT id FROM courses WHERE level = ?) "
+    "WHERE s.index_number = ? ORDER BY g.course_id"
+)
+# The final hop with pre-rendered results: the student row and, if one has
+# been rendered, their result message for one level (see result_blobs.py)
+RESULT_MESSAGE_SQL = (
+    "SELECT s.id, s.password, b.message FROM students s "
+    "LEFT JOIN result_blobs b ON b.student_id = s.id AND b.level = ? "
+    "WHERE s.index_number = ?"
+)
+STUDENT_ALL_GRADES_SQL = "SELECT course_id, grade FROM grades WHERE student_id = ? ORDER BY course_id"
+GRADES_VERSION_SQL = "SELECT value FROM meta WHERE key = 'grades_version'"
+GRADE_CHANGE_BATCHES_SQL = "SELECT COUNT(*) FROM grade_change_batches WHERE version > ? AND version <= ?"
+GRADE_CHANGES_SQL = "SELECT DISTINCT student_id, level FROM grade_changes WHERE version > ? AND version <= ?"
+
+# Authenticated student with one level's grades as (course_id, grade) pairs
+StudentResult = namedtuple('StudentResult', 'student_id name grades')
+# Authenticated student with one level's pre-rendered message, or None if it has not been rendered
+StudentMessage = namedtuple('StudentMessage', 'student_id message')
 
 def db_connect():
     """
@@ -7,52 +77,425 @@ def db_connect():
     Updated to match user's database setup.
     """
     try:
-        conn = sqlite3.connect('instance/students.db')
+        conn = sqlite3.connect(DB_PATH)
         conn.row_factory = sqlite3.Row  # This enables column access by name
         cursor = conn.cursor()
         return conn, cursor
     except Exception as e:
-        logging.error(f"Database connection error: {e}")
+        logging.error("Database connection error: %s", e)
         raise e
 
+class ConnectionPool:
+    """
+    Fixed-size pool of long-lived SQLite connections for one worker process.
+
+    Connections are opened on demand up to `size` and handed out LIFO, so
+    the warmest connection (page cache, compiled statements) is reused
+    first. A connection idle for longer than health_check_interval is
+    checked before reuse and replaced if it fails.
+
+    A read_only pool is for a published snapshot, which is never written:
+    connections open it immutable (no locking, no change detection) and
+    memory-map it.
+
+    An in_memory pool copies the database with the backup API into an
+    in-memory database (the memdb VFS) when it opens its first connection.
+    Its connections share that one copy, read-only, and never touch the
+    file again; get_pool() makes a new pool when the file changes.
+    """
+
+    def __init__(self, path=None, size=POOL_SIZE, timeout=5.0,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, read_only=False, in_memory=False):
+        self.path = path or DB_PATH
+        self.read_only = read_only
+        self.in_memory = in_memory
+        self.memory_bytes = None
+        self.source_stamp = None  # the file's _file_stamp() when the pool was made
+        self._memory_uri = None
+        self._holder = None  # keeps the in-memory copy alive
+        self._load_lock = threading.Lock()
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()  # (connection, last_used)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._all = set()
+        self.closed = False
+
+    def _file_uri(self):
+        mode = "mode=ro&immutable=1" if self.read_only else "mode=ro"
+        return f"file:{quote(os.path.abspath(self.path))}?{mode}"
+
+    def load(self):
+        """Copy the database into memory; the first connection does it if nobody has."""
+        with self._load_lock:
+            if self._holder is not None:
+                return
+            start = time.perf_counter()
+            uri = f"file:/ussd-{os.getpid()}-{next(_memory_ids)}?vfs=memdb"
+            holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            source = sqlite3.connect(self._file_uri(), uri=True)
+            try:
+                source.backup(holder)
+            except sqlite3.Error:
+                holder.close()
+                raise
+            finally:
+                source.close()
+            page_size = holder.execute("PRAGMA page_size").fetchone()[0]
+            page_count = holder.execute("PRAGMA page_count").fetchone()[0]
+            self.memory_bytes = page_size * page_count
+            self._memory_uri, self._holder = uri, holder
+            logging.info("Loaded %s into memory: %.1f MiB in %.2fs",
+                         self.path, self.memory_bytes / 2 ** 20, time.perf_counter() - start)
+
+    def _open(self):
+        if self.in_memory:
+            self.load()
+            target, uri = self._memory_uri, True
+        elif self.read_only:
+            target, uri = self._file_uri(), True
+        else:
+            target, uri = self.path, False
+        conn = sqlite3.connect(
+            target,
+            timeout=self.timeout,
+            check_same_thread=False,  # a pooled connection moves between threads
+            cached_statements=STATEMENT_CACHE_SIZE,
+            uri=uri,
+        )
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        if self.in_memory:
+            conn.execute("PRAGMA query_only = ON")
+        if self.read_only or self.in_memory:
+            conn.execute(f"PRAGMA mmap_size = {int(MMAP_SIZE)}")
+        with self._lock:
+            self._all.add(conn)
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._all.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logging.warning("Dropping unhealthy database connection: %s", e)
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block."""
+        if self.closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+        try:
+            try:
+                conn, last_used = self._idle.get_nowait()
+                if time.monotonic() - last_used > self.health_check_interval and not self._healthy(conn):
+                    self._discard(conn)
+                    conn = self._open()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+            except sqlite3.DatabaseError:
+                # Don't hand a connection in an unknown state to the next caller
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                if self.closed:
+                    self._discard(conn)
+                else:
+                    self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close every connection; borrowed ones are closed when returned."""
+        self.closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        with self._load_lock:
+            if self._holder is not None:
+                # The copy is freed when the last borrowed connection closes
+                self._holder.close()
+                self._holder = None
+
+    def stats(self):
+        return {"size": self.size, "open": len(self._all), "idle": self._idle.qsize(),
+                "path": self.path, "read_only": self.read_only, "in_memory": self.in_memory,
+                "memory_bytes": self.memory_bytes}
+
+
+_memory_ids = itertools.count()
+
+
+def snapshot_pointer_path(db_path=None):
+    """The file naming the published snapshot of db_path (see snapshot.py)."""
+    return (db_path or DB_PATH) + '.live'
+
+
+def snapshot_dir(db_path=None):
+    """Where the snapshots of db_path are kept."""
+    return os.path.join(os.path.dirname(db_path or DB_PATH) or '.', 'snapshots')
+
+
+def read_snapshot_pointer(db_path=None):
+    """Path of the published snapshot of db_path, or None if none is published."""
+    try:
+        with open(snapshot_pointer_path(db_path)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(snapshot_dir(db_path), name) if name else None
+
+
+def _file_stamp(path):
+    # Changes whenever the file is written or replaced
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+# (checked_at, DB_PATH it was checked for, path readers use, its _file_stamp)
+_serving = (None, None, None, None)
+
+
+def serving_path():
+    """
+    The database readers use: the published snapshot if there is one, else
+    DB_PATH itself. The pointer is re-read at most every SNAPSHOT_CHECK_INTERVAL.
+    """
+    return _serving_source()[0]
+
+
+def _serving_source():
+    # (serving_path(), its _file_stamp()), both as of the last check
+    global _serving
+    checked_at, db_path, path, stamp = _serving
+    now = time.monotonic()
+    if db_path == DB_PATH and now - checked_at < SNAPSHOT_CHECK_INTERVAL:
+        return path, stamp
+    snapshot = read_snapshot_pointer()
+    if snapshot is None:
+        path = DB_PATH
+    elif os.path.exists(snapshot):
+        path = snapshot
+    else:
+        logging.error("Published snapshot %s is missing; still serving %s", snapshot, path or DB_PATH)
+        path = path if db_path == DB_PATH and path else DB_PATH
+    stamp = _file_stamp(path)
+    _serving = (now, DB_PATH, path, stamp)
+    return path, stamp
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _stale(pool, path, stamp):
+    return (pool is None or pool.pid != os.getpid() or pool.path != path or pool.closed
+            or pool.in_memory and pool.source_stamp != stamp)
+
+
+def get_pool():
+    """
+    This process's ConnectionPool, created on first use. A new pool is made
+    after a fork (connections must not cross processes), if DB_PATH changed,
+    or when a new snapshot is published (or, for an IN_MEMORY pool, when
+    the file it copied changes): connections already borrowed from the old
+    pool finish their query and are closed when returned.
+    """
+    global _pool
+    pool = _pool
+    path, stamp = _serving_source()
+    if _stale(pool, path, stamp):
+        usable = pool is not None and pool.pid == os.getpid() and not pool.closed
+        # While one thread loads a new in-memory copy, the rest keep using the old pool
+        if not _pool_lock.acquire(blocking=not usable):
+            return pool
+        try:
+            pool = _pool
+            if _stale(pool, path, stamp):
+                new = ConnectionPool(path, read_only=path != DB_PATH, in_memory=IN_MEMORY)
+                new.source_stamp = stamp
+                if new.in_memory:
+                    new.load()
+                if pool is not None and pool.pid == os.getpid():
+                    pool.close()
+                pool = _pool = new
+        finally:
+            _pool_lock.release()
+    return pool
+
+
+def memory_bytes():
+    """Size of this process's in-memory copy of the database, or None if there is none."""
+    pool = _pool
+    return pool.memory_bytes if pool is not None and pool.pid == os.getpid() else None
+
+
+Gauge('ussd_db_memory_bytes', 'Size of the in-memory copy of the database (USSD_DB_IN_MEMORY)', memory_bytes)
+
+
+def connection():
+    """Borrow a pooled connection: `with connection() as conn: ...`"""
+    return get_pool().connection()
+
+
+@atexit.register
+def close_pool():
+    """Close this process's pooled connections (runs at interpreter exit)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
 def authenticate_student(index_number, password):
     """
     Authenticate student using index number and password.
     Returns student data if authentication successful, None otherwise.
     """
     try:
-        conn, cursor = db_connect()
-        cursor.execute(
-            "SELECT id, name, email FROM students WHERE index_number = ? AND password = ?",
-            (index_number, password)
-        )
-        student = cursor.fetchone()
-        conn.close()
-        return student
+        with connection() as conn:
+            return conn.execute(AUTHENTICATE_SQL, (index_number, password)).fetchone()
     except Exception as e:
-        logging.error(f"Authentication error: {e}")
+        logging.error("Authentication error: %s", e)
         return None
 
+def password_digest(password):
+    """
+    SHA-256 digest of a password, so session state never holds the plaintext.
+    """
+    return hashlib.sha256(password.encode('utf-8')).digest()
+
 def get_student_grades(student_id, course_list=None):
     """
     Get grades for a student, optionally filtered by course list.
     """
     try:
-        conn, cursor = db_connect()
-        if course_list:
-            placeholders = ",".join("?" * len(course_list))
-            cursor.execute(
-                f"SELECT course_name, grade FROM grades WHERE student_id = ? AND course_name IN ({placeholders})",
-                (student_id, *course_list)
-            )
-        else:
-            cursor.execute(
-                "SELECT course_name, grade FROM grades WHERE student_id = ?",
-                (student_id,)
-            )
-        grades = cursor.fetchall()
-        conn.close()
-        return grades
+        with connection() as conn:
+            if course_list:
+                placeholders = ",".join("?" * len(course_list))
+                cursor = conn.execute(
+                    STUDENT_COURSE_GRADES_SQL.format(placeholders=placeholders),
+                    (student_id, *course_list)
+                )
+            else:
+                cursor = conn.execute(STUDENT_GRADES_SQL, (student_id,))
+            return cursor.fetchall()
+    except Exception as e:
+        logging.error("Error fetching grades: %s", e)
+        return []
+
+def get_student_by_index(index_number):
+    """
+    Student row (id, name, email, password) for an index number, or None.
+    Does not authenticate; the caller compares password digests.
+    """
+    try:
+        with connection() as conn, QUERY_SECONDS.time('student_by_index'):
+            return conn.execute(STUDENT_BY_INDEX_SQL, (index_number,)).fetchone()
+    except Exception as e:
+        logging.error("Error fetching student: %s", e)
+        return None
+
+def get_all_grades(student_id):
+    """Every (course_id, grade) pair for a student, in catalog order."""
+    try:
+        with connection() as conn, QUERY_SECONDS.time('all_grades'):
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            return cursor.execute(STUDENT_ALL_GRADES_SQL, (student_id,)).fetchall()
     except Exception as e:
-        logging.error(f"Error fetching grades: {e}")
+        logging.error("Error fetching grades: %s", e)
         return []
+
+def get_student_result(index_number, password_hash, level):
+    """
+    Authenticate a student by index number and password_digest() value and
+    fetch their grades for one level, in one query on one connection.
+    Returns a StudentResult, or None if authentication fails.
+    """
+    try:
+        # Authentication and grades are one statement; see STUDENT_LEVEL_RESULT_SQL
+        with connection() as conn, QUERY_SECONDS.time('auth_and_grades'):
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples, no sqlite3.Row per row
+            rows = cursor.execute(STUDENT_LEVEL_RESULT_SQL, (level, index_number)).fetchall()
+        if not rows:
+            return None
+        student_id, name, password = rows[0][:3]
+        if password is None or not hmac.compare_digest(password_digest(password), password_hash):
+            return None
+        grades = [(course_id, grade) for _, _, _, course_id, grade in rows if course_id is not None]
+        return StudentResult(student_id, name, grades)
+    except Exception as e:
+        logging.error("Error fetching student result: %s", e)
+        return None
+
+def get_result_message(index_number, password_hash, level):
+    """
+    Authenticate a student by index number and password_digest() value and
+    fetch their pre-rendered result message for one level, with one primary
+    key lookup. Returns a StudentMessage, or None if authentication fails.
+    If the message cannot be read (e.g. a database from before
+    result_blobs), returns a StudentMessage with neither field set, so the
+    caller renders the result from the grades, which authenticates again.
+    """
+    try:
+        with connection() as conn, QUERY_SECONDS.time('result_message'):
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            row = cursor.execute(RESULT_MESSAGE_SQL, (level, index_number)).fetchone()
+        if row is None:
+            return None
+        student_id, password, message = row
+        if password is None or not hmac.compare_digest(password_digest(password), password_hash):
+            return None
+        return StudentMessage(student_id, message)
+    except Exception as e:
+        logging.error("Error fetching result message: %s", e)
+        return StudentMessage(None, None)
+
+def get_grades_version():
+    """
+    Current meta.grades_version; it changes whenever grades or students are
+    written, from any process.
+    """
+    with connection() as conn:
+        row = conn.execute(GRADES_VERSION_SQL).fetchone()
+    return row[0] if row else 0
+
+def get_grade_changes(since, until):
+    """
+    The (student_id, level) results changed between two grades versions,
+    or None if some of the versions in between were not logged (e.g. a
+    grade edited by hand), in which case anything may have changed.
+    """
+    if until <= since:
+        return None
+    with connection() as conn:
+        logged = conn.execute(GRADE_CHANGE_BATCHES_SQL, (since, until)).fetchone()[0]
+        if logged != until - since:
+            return None
+        return [tuple(row) for row in conn.execute(GRADE_CHANGES_SQL, (since, until))]
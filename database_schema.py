@@ -1,13 +1,77 @@
+import itertools
+import random
 import sqlite3
+from contextlib import contextmanager
+
+import database
+from result_blobs import rebuild_result_blobs
+
+# Course catalog: (name, level, semester)
+COURSES = [
+    # Level 100 First Semester
+    ("Communication Skills", 100, 1),
+    ("Information Technology I", 100, 1),
+    ("Introduction to Programming Using C++", 100, 1),
+    ("Discrete Mathematics", 100, 1),
+    ("Entrepreneurship", 100, 1),
+    ("Computer Applications", 100, 1),
+    ("Introduce to Economics", 100, 1),
+
+    # Level 100 Second Semester
+    ("African Studies", 100, 2),
+    ("Communication Skills II Industrial Attachment", 100, 2),
+    ("Programming Using Java", 100, 2),
+    ("Information Technology II", 100, 2),
+    ("Database Concepts & Technology", 100, 2),
+    ("Mathematics & Statistics", 100, 2),
+    ("Introduction to Economics II", 100, 2),
+
+    # Level 200 First Semester
+    ("Visual Basic Dot Net", 200, 1),
+    ("Database Management System (Oracle)", 200, 1),
+    ("Web Technology I", 200, 1),
+    ("Hardware Technology I", 200, 1),
+    ("Networking I", 200, 1),
+    ("Introduction to Accounting", 200, 1),
+    ("Research Methodology", 200, 1),
+
+    # Level 200 Second Semester
+    ("Industrial Attachment II", 200, 2),
+    ("Hardware Technology II", 200, 2),
+    ("Introduction to Software Engineering", 200, 2),
+    ("Web Technology II", 200, 2),
+    ("Networking II", 200, 2),
+    ("Entrepreneurship II", 200, 2),
+    ("Introduction to Accounting II", 200, 2),
+    ("PHP Programming", 200, 2),
+
+    # Level 300 First Semester
+    ("Management Information Systems", 300, 1),
+    ("Systems Analysis and Design", 300, 1),
+    ("Information Systems Security", 300, 1),
+    ("Systems Administration I", 300, 1),
+    ("Operating Systems", 300, 1),
+
+    # Level 300 Second Semester
+    ("E-Commerce", 300, 2),
+    ("Systems Administration II", 300, 2),
+    ("Computer Graphics", 300, 2),
+    ("Information Systems Security II", 300, 2),
+    ("Project", 300, 2),
+    ("Computer Organization & Architecture", 300, 2),
+]
 
 # Connect to SQLite database (creates the file if it doesn't exist)
 def db_connect():
-   conn = sqlite3.connect('instance/students.db')
+   conn = sqlite3.connect(database.DB_PATH)
    conn.row_factory = sqlite3.Row  # Enable access to columns by name
    return conn, conn.cursor()
 
-# Create the students table
-def create_tables():
+# Create the students, courses and grades tables. Safe to run on every
+# start: existing databases are migrated to the current schema. With
+# render_results, an empty result_blobs is also rendered from the grades;
+# that reads every grade, so it is left to the seeder and the importer.
+def create_tables(render_results=False):
     conn, cursor = db_connect()
 
     # Students table
@@ -22,79 +86,253 @@ def create_tables():
         )
     ''')
 
+    # Courses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(200) UNIQUE,
+            level INTEGER,
+            semester INTEGER
+        )
+    ''')
+
     # Grades table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS grades (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_id INTEGER,
-            course_name VARCHAR(200),
+            course_id INTEGER,
             grade CHAR(2),
-            FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+            FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+    ''')
+
+    # Counters other processes poll to notice writes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key VARCHAR(50) PRIMARY KEY,
+            value INTEGER
+        )
+    ''')
+
+    # Content hash of each student's last imported grades (import_grades.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_hashes (
+            student_id INTEGER PRIMARY KEY,
+            hash INTEGER
+        )
+    ''')
+
+    # The (student, level) results each logged grades_version changed, so
+    # caches can drop just those. A version is only fully described if it
+    # has a row in grade_change_batches.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_change_batches (
+            version INTEGER PRIMARY KEY
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS grade_changes (
+            version INTEGER,
+            student_id INTEGER,
+            level INTEGER,
+            PRIMARY KEY (version, student_id, level)
+        ) WITHOUT ROWID
+    ''')
+
+    # Each (student, level) result message, rendered ahead of time (result_blobs.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS result_blobs (
+            student_id INTEGER,
+            level INTEGER,
+            message TEXT,
+            PRIMARY KEY (student_id, level)
+        ) WITHOUT ROWID
+    ''')
+
+    insert_courses(cursor)
+    migrate_grades_course_ids(cursor)
+    dedupe_grades(cursor)
+    create_indexes(cursor)
+    create_version_triggers(cursor)
+    create_hash_triggers(cursor)
+    create_blob_triggers(cursor)
+    if render_results and not cursor.execute("SELECT 1 FROM result_blobs LIMIT 1").fetchone():
+        # e.g. a database from before result_blobs: render what it already holds
+        rebuild_result_blobs(cursor)
 
     conn.commit()
     conn.close()
 
 
+def insert_courses(cursor):
+    """Add any catalog courses missing from the courses table."""
+    cursor.executemany('''
+        INSERT OR IGNORE INTO courses (name, level, semester)
+        VALUES (?, ?, ?)
+    ''', COURSES)
+
+
+def migrate_grades_course_ids(cursor):
+    """
+    Databases created before the courses table stored grades by course_name.
+    Add course_id to those and fill it in from the catalog.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(grades)")]
+    if 'course_id' in columns:
+        return
+    cursor.execute("ALTER TABLE grades ADD COLUMN course_id INTEGER REFERENCES courses(id)")
+    cursor.execute('''
+        UPDATE grades
+        SET course_id = (SELECT id FROM courses WHERE courses.name = grades.course_name)
+    ''')
+
+
+def dedupe_grades(cursor):
+    """
+    Databases from before idx_grades_unique can hold several grades for the
+    same student and course (re-running insert_sample_data duplicated them).
+    Keep the most recently inserted one so the unique index can be built.
+    """
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_grades_unique'").fetchone()
+    if exists:
+        return
+    cursor.execute('''
+        DELETE FROM grades WHERE id NOT IN (
+            SELECT MAX(id) FROM grades GROUP BY student_id, course_id
+        )
+    ''')
+
+
+def create_indexes(cursor):
+    """
+    Indexes for the USSD lookups. idx_grades_student_course covers the
+    grade queries: student_id and course_id are searched and grade is read
+    straight from the index, so the grades table itself is never touched.
+    idx_grades_unique allows one grade per student and course, which the
+    imports' UPSERTs rely on.
+    """
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_grades_unique
+        ON grades (student_id, course_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_grades_student_course
+        ON grades (student_id, course_id, grade)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_courses_level
+        ON courses (level)
+    ''')
+
+
+def create_version_triggers(cursor):
+    """
+    Keep meta.grades_version counting every write to grades, and to the
+    student rows results are rendered from, so cached results in any
+    worker can tell they are stale (see result_cache.py).
+    """
+    cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('grades_version', 0)")
+    for table, events in (('grades', ('INSERT', 'UPDATE', 'DELETE')), ('students', ('UPDATE', 'DELETE'))):
+        for event in events:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'grades_version';
+                END
+            ''')
+
+
+def create_hash_triggers(cursor):
+    """
+    Forget a student's import content hash whenever their grades are
+    written some other way, so the next import compares their rows again.
+    """
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS grades_hash_{event.lower()}
+            AFTER {event} ON grades
+            BEGIN
+                DELETE FROM grade_hashes WHERE student_id = {row}.student_id;
+            END
+        ''')
+
+
+def create_blob_triggers(cursor):
+    """
+    Drop a pre-rendered result whenever something it shows is written
+    outside an import: a grade, the student's name, or a course. The next
+    check renders it from the grades again.
+    """
+    level = "(SELECT level FROM courses WHERE id = {row}.course_id)"
+    for event, rows in (('INSERT', ('NEW',)), ('UPDATE', ('OLD', 'NEW')), ('DELETE', ('OLD',))):
+        deletes = ''.join(
+            f"DELETE FROM result_blobs WHERE student_id = {row}.student_id AND level = {level.format(row=row)};"
+            for row in rows)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS grades_blob_{event.lower()}
+            AFTER {event} ON grades
+            BEGIN
+                {deletes}
+            END
+        ''')
+    for event, columns, row in (('UPDATE', ' OF name', 'NEW'), ('DELETE', '', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS students_blob_{event.lower()}
+            AFTER {event}{columns} ON students
+            BEGIN
+                DELETE FROM result_blobs WHERE student_id = {row}.id;
+            END
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS courses_blob_update
+        AFTER UPDATE OF name, level ON courses
+        BEGIN
+            DELETE FROM result_blobs WHERE level IN (OLD.level, NEW.level);
+        END
+    ''')
+
+
+# One grade per (student_id, course_id); a changed grade replaces the old
+# one, and an unchanged grade is left alone so it does not count as a write
+UPSERT_GRADE_SQL = '''
+    INSERT INTO grades (student_id, course_id, grade) VALUES (?, ?, ?)
+    ON CONFLICT (student_id, course_id) DO UPDATE SET grade = excluded.grade
+    WHERE grade IS NOT excluded.grade
+'''
+
+
+@contextmanager
+def bulk_write(cursor):
+    """
+    For the duration of a bulk write inside one transaction, drop the
+    version, hash and result blob triggers so they do not fire once per
+    row, then restore them and bump grades_version once.
+
+    The caller is responsible for the grade_hashes and result_blobs of the
+    students it writes.
+    If the block raises, the transaction must be rolled back, which also
+    brings the triggers back.
+    """
+    triggers = [row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+    for trigger in triggers:
+        cursor.execute(f"DROP TRIGGER {trigger}")
+    yield
+    create_version_triggers(cursor)
+    create_hash_triggers(cursor)
+    create_blob_triggers(cursor)
+    cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'grades_version'")
+
+
 # Insert sample data
 def insert_sample_data():
     conn, cursor = db_connect()
 
-    # List of all courses
-    courses = [
-        # Level 100 First Semester
-        "Communication Skills",
-        "Information Technology I",
-        "Introduction to Programming Using C++",
-        "Discrete Mathematics",
-        "Entrepreneurship",
-        "Computer Applications",
-        "Introduce to Economics",
-
-        # Level 100 Second Semester
-        "African Studies",
-        "Communication Skills II Industrial Attachment",
-        "Programming Using Java",
-        "Information Technology II",
-        "Database Concepts & Technology",
-        "Mathematics & Statistics",
-        "Introduction to Economics II",
-
-        # Level 200 First Semester
-        "Visual Basic Dot Net",
-        "Database Management System (Oracle)",
-        "Web Technology I",
-        "Hardware Technology I",
-        "Networking I",
-        "Introduction to Accounting",
-        "Research Methodology",
-
-        # Level 200 Second Semester
-        "Industrial Attachment II",
-        "Hardware Technology II",
-        "Introduction to Software Engineering",
-        "Web Technology II",
-        "Networking II",
-        "Entrepreneurship II",
-        "Introduction to Accounting II",
-        "PHP Programming",
-
-        # Level 300 First Semester
-        "Management Information Systems",
-        "Systems Analysis and Design",
-        "Information Systems Security",
-        "Systems Administration I",
-        "Operating Systems",
-
-        # Level 300 Second Semester
-        "E-Commerce",
-        "Systems Administration II",
-        "Computer Graphics",
-        "Information Systems Security II",
-        "Project",
-        "Computer Organization & Architecture"
-    ]
+    cursor.execute("SELECT id FROM courses ORDER BY id")
+    course_ids = [row["id"] for row in cursor.fetchall()]
 
     # Sample students
     students = [
@@ -105,27 +343,132 @@ def insert_sample_data():
         ('0722000019', 'password5', '0722000019@ttu.edu.gh', 'Ebenezer Okai Mensah', '0557461295'),
     ]
 
-    # Insert students and grades
+    # Insert students and grades. Safe to re-run: existing students are
+    # kept and their grades upserted rather than added again.
     for student in students:
         cursor.execute('''
             INSERT OR IGNORE INTO students (index_number, password, email, name, phone)
             VALUES (?, ?, ?, ?, ?)
         ''', student)
-        student_id = cursor.lastrowid
+        student_id = cursor.execute(
+            "SELECT id FROM students WHERE index_number = ?", (student[0],)).fetchone()["id"]
 
         # Assign grades for all courses (randomized for demo)
-        import random
-        for course in courses:
-            grade = random.choice(['A+'])
-            cursor.execute('''
-                INSERT INTO grades (student_id, course_name, grade)
-                VALUES (?, ?, ?)
-            ''', (student_id, course, grade))
+        cursor.executemany(UPSERT_GRADE_SQL, (
+            (student_id, course_id, random.choice(['A+'])) for course_id in course_ids
+        ))
 
     conn.commit()
     conn.close()
 
-    
 
-create_tables()
-insert_sample_data()
+# Letter grades with the share of each a student of middling ability gets
+GRADE_SCALE = ('A+', 'A', 'B+', 'B', 'C+', 'C', 'D+', 'D', 'F')
+GRADE_WEIGHTS = (4, 8, 14, 18, 18, 14, 10, 7, 7)
+# Ability bands move the whole distribution up (positive) or down by this many grades
+ABILITY_SHIFTS = (-2, -1, 0, 1, 2)
+
+FIRST_NAMES = ('Kwame', 'Ama', 'Kofi', 'Akosua', 'Yaw', 'Abena', 'Kwabena', 'Adwoa', 'Kojo', 'Efua',
+               'Selorm', 'Elikem', 'Delali', 'Mawuli', 'Edem', 'Esi', 'Fiifi', 'Naa', 'Nii', 'Dede')
+SURNAMES = ('Mensah', 'Owusu', 'Boateng', 'Asante', 'Agyeman', 'Osei', 'Addo', 'Tetteh', 'Quaye',
+            'Agbeko', 'Dzidzienyo', 'Amedzro', 'Kumah', 'Ansah', 'Ofori', 'Appiah', 'Lartey', 'Darko')
+# Entry years the synthetic index numbers are spread over: 07<yy><seq>
+ENTRY_YEARS = (19, 20, 21, 22)
+# Synthetic sequence numbers start above the sample students' (0722000040)
+SYNTHETIC_SEQ_START = 100000
+
+
+def _grade_cum_weights(shift):
+    # GRADE_WEIGHTS moved `shift` grades towards A+, or towards F if negative
+    weights = list(GRADE_WEIGHTS)
+    for _ in range(abs(shift)):
+        if shift > 0:
+            weights = [weights[0] + weights[1]] + weights[2:] + [0]
+        else:
+            weights = [0] + weights[:-2] + [weights[-2] + weights[-1]]
+    return list(itertools.accumulate(weights))
+
+
+def synthetic_students(n_students, seed=0):
+    """
+    Deterministic (index_number, password, email, name, phone) rows for
+    n_students synthetic students, spread over ENTRY_YEARS.
+    """
+    rng = random.Random(seed)
+    for n in range(n_students):
+        year = ENTRY_YEARS[n % len(ENTRY_YEARS)]
+        index_number = f"07{year:02d}{SYNTHETIC_SEQ_START + n // len(ENTRY_YEARS):06d}"
+        name = f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)}"
+        yield (index_number, f"pw{index_number[2:]}", f"{index_number}@ttu.edu.gh", name,
+               f"05{rng.randrange(10 ** 8):08d}")
+
+
+def insert_synthetic_data(n_students, seed=0):
+    """
+    Add n_students synthetic students, each graded in every catalog course
+    with grades drawn around a per-student ability. The same seed always
+    produces the same data. Returns the number of grade rows written.
+
+    Everything is written in one transaction. The grade index and version
+    triggers are dropped for the bulk insert and rebuilt afterwards, and
+    grades_version is bumped once for the whole batch.
+
+    Python only draws each student's grades, as one string of GRADE_SCALE
+    positions; SQLite expands those into grade rows with a single INSERT
+    ... SELECT, so no per-grade tuple is built or bound.
+    """
+    conn = sqlite3.connect(database.DB_PATH, isolation_level=None)
+    cursor = conn.cursor()
+    course_ids = [row[0] for row in cursor.execute("SELECT id FROM courses ORDER BY id")]
+    first_id = cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM students").fetchone()[0]
+    rng = random.Random(seed)
+    cum_weights = [_grade_cum_weights(shift) for shift in ABILITY_SHIFTS]
+    codes = ''.join(str(n) for n in range(len(GRADE_SCALE)))
+
+    def student_codes():
+        for student_id in range(first_id, first_id + n_students):
+            drawn = rng.choices(codes, cum_weights=rng.choice(cum_weights), k=len(course_ids))
+            yield student_id, ''.join(drawn)
+
+    cursor.execute("PRAGMA synchronous = OFF")
+    try:
+        cursor.execute("BEGIN")
+        with bulk_write(cursor):
+            cursor.execute("DROP INDEX IF EXISTS idx_grades_student_course")
+            cursor.execute("DROP INDEX IF EXISTS idx_grades_unique")
+            cursor.executemany('''
+                INSERT INTO students (id, index_number, password, email, name, phone)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ((first_id + n, *student) for n, student in enumerate(synthetic_students(n_students, seed))))
+            cursor.execute("CREATE TEMP TABLE synthetic_codes (student_id INTEGER PRIMARY KEY, codes TEXT)")
+            cursor.execute("CREATE TEMP TABLE synthetic_courses (position INTEGER PRIMARY KEY, course_id INTEGER)")
+            cursor.execute("CREATE TEMP TABLE synthetic_grades (code TEXT PRIMARY KEY, grade TEXT) WITHOUT ROWID")
+            cursor.executemany("INSERT INTO synthetic_courses VALUES (?, ?)", enumerate(course_ids, start=1))
+            cursor.executemany("INSERT INTO synthetic_grades VALUES (?, ?)", zip(codes, GRADE_SCALE))
+            cursor.executemany("INSERT INTO synthetic_codes VALUES (?, ?)", student_codes())
+            # CROSS JOIN keeps the loop order, so rows go in by student and course
+            cursor.execute('''
+                INSERT INTO grades (student_id, course_id, grade)
+                SELECT s.student_id, c.course_id, g.grade
+                FROM synthetic_codes s
+                CROSS JOIN synthetic_courses c
+                CROSS JOIN synthetic_grades g
+                WHERE g.code = substr(s.codes, c.position, 1)
+                ORDER BY s.student_id, c.position
+            ''')
+            for table in ('synthetic_codes', 'synthetic_courses', 'synthetic_grades'):
+                cursor.execute(f"DROP TABLE temp.{table}")
+            create_indexes(cursor)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return n_students * len(course_ids)
+
+
+
+if __name__ == "__main__":
+    create_tables()
+    insert_sample_data()
@@ -0,0 +1,37 @@
+"""
+WSGI fast path for the USSD endpoints
+
+The gateways only ever POST to the USSD endpoints, and those handlers work
+on the raw request body. UssdFastPath wraps the Flask WSGI app and answers
+those POSTs itself, skipping Flask's request context, routing and the CORS
+after-request hooks. Everything else, including OPTIONS preflights and
+admin routes, is passed through to Flask unchanged.
+"""
+
+import logging
+
+
+class UssdFastPath:
+    def __init__(self, app, routes):
+        # routes: path -> (content_type, handler(body) -> response bytes)
+        self.app = app
+        self.routes = routes
+
+    def __call__(self, environ, start_response):
+        route = self.routes.get(environ.get('PATH_INFO')) if environ.get('REQUEST_METHOD') == 'POST' else None
+        if route is None:
+            return self.app(environ, start_response)
+
+        content_type, handler = route
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        try:
+            body = handler(environ['wsgi.input'].read(length) if length > 0 else b'')
+        except Exception as e:
+            logging.error("USSD fast path error: %s", e)
+            start_response('500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain'), ('Content-Length', '0')])
+            return [b'']
+        start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
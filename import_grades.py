@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Import grades from a registry CSV export
+
+    python import_grades.py grades.csv [--batch-size 20000] [--dry-run] [--full]
+                                       [--affected affected.csv]
+
+The file needs index_number, course and grade columns (course is the
+catalog course name); any other columns are ignored. Rows are streamed, so
+the file can be larger than memory, and checked against the students
+table, the course catalog and the grade scale. Invalid rows are reported
+and skipped.
+
+Registry exports are usually re-exports with a few changed rows, so the
+import works on the difference. A first pass hashes each student's rows and
+compares the hash with the one stored by the last import (grade_hashes);
+only students whose hash changed are read again, staged, and compared row
+by row with the grades table. The rows that differ are upserted inside one
+transaction: a student's grade for a course is added, or replaced if it
+changed. Re-importing the same file writes nothing. --full compares every
+student, e.g. after grades were edited with the hash triggers dropped.
+
+Every result of the students an import changed is re-rendered into
+result_blobs. The (student_id, level) results it changed are logged under
+the grades_version the import produced (grade_changes), so result caches
+drop just those entries; --affected also writes them to a CSV file.
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+import database
+from catalog import load_catalog
+from database_schema import GRADE_SCALE, bulk_write, create_tables
+from result_blobs import refresh_result_blobs
+
+BATCH_SIZE = 20000
+REQUIRED_COLUMNS = ('index_number', 'course', 'grade')
+# Invalid rows kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# grade_changes keeps the changes of this many recent grades versions
+CHANGE_LOG_VERSIONS = 1000
+HASH_MODULUS = 2 ** 63
+
+ImportResult = namedtuple('ImportResult',
+                          'rows written unchanged invalid errors students_changed affected seconds')
+
+
+class CSVFormatError(ValueError):
+    """A CSV file that cannot be imported at all, e.g. missing columns."""
+
+
+def read_rows(f, students, course_ids, errors):
+    """
+    Yield (student_id, course_id, grade) for each valid row of CSV file f.
+    Invalid rows are appended to errors as (line, reason) and skipped.
+    """
+    reader = csv.reader(f)
+    header = [column.strip().lower() for column in next(reader, [])]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise CSVFormatError(f"missing column(s): {', '.join(missing)}")
+    index_col, course_col, grade_col = (header.index(column) for column in REQUIRED_COLUMNS)
+    width = max(index_col, course_col, grade_col) + 1
+    grades = frozenset(GRADE_SCALE)
+
+    for line, row in enumerate(reader, start=2):
+        if len(row) < width:
+            if any(row):
+                errors.append((line, "too few columns"))
+            continue
+        student_id = students.get(row[index_col].strip())
+        course_id = course_ids.get(row[course_col].strip())
+        grade = row[grade_col].strip().upper()
+        if student_id is None:
+            errors.append((line, f"unknown index number {row[index_col].strip()!r}"))
+        elif course_id is None:
+            errors.append((line, f"unknown course {row[course_col].strip()!r}"))
+        elif grade not in grades:
+            errors.append((line, f"invalid grade {row[grade_col].strip()!r}"))
+        else:
+            yield student_id, course_id, grade
+
+
+def _row_hashes(course_ids):
+    """
+    A 63-bit hash for every (course_id, grade). A student's hash is the sum
+    of their rows' hashes, so it does not depend on the order of the rows.
+    """
+    return {
+        (course_id, grade): int.from_bytes(
+            hashlib.blake2b(f"{course_id}:{grade}".encode(), digest_size=8).digest(), 'big') % HASH_MODULUS
+        for course_id in course_ids.values() for grade in GRADE_SCALE
+    }
+
+
+def student_hashes(rows, course_ids):
+    """{student_id: content hash} of (student_id, course_id, grade) rows, and the row count."""
+    row_hashes = _row_hashes(course_ids)
+    hashes = {}
+    count = 0
+    for student_id, course_id, grade in rows:
+        hashes[student_id] = (hashes.get(student_id, 0) + row_hashes[course_id, grade]) % HASH_MODULUS
+        count += 1
+    return hashes, count
+
+
+def _stage_rows(cursor, rows, batch_size):
+    # A later row for the same grade replaces an earlier one, as the upsert would
+    cursor.execute('''
+        CREATE TEMP TABLE import_rows (
+            student_id INTEGER,
+            course_id INTEGER,
+            grade CHAR(2),
+            PRIMARY KEY (student_id, course_id)
+        ) WITHOUT ROWID
+    ''')
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.executemany("INSERT OR REPLACE INTO import_rows VALUES (?, ?, ?)", batch)
+
+
+# The results staged rows would change
+AFFECTED_SQL = '''
+    SELECT DISTINCT i.student_id, c.level
+    FROM import_rows i
+    JOIN courses c ON c.id = i.course_id
+    LEFT JOIN grades g ON g.student_id = i.student_id AND g.course_id = i.course_id
+    WHERE g.grade IS NOT i.grade
+    ORDER BY i.student_id, c.level
+'''
+
+# WHERE true: SQLite needs it to tell ON CONFLICT from a join constraint
+UPSERT_STAGED_SQL = '''
+    INSERT INTO grades (student_id, course_id, grade)
+    SELECT student_id, course_id, grade FROM import_rows WHERE true
+    ON CONFLICT (student_id, course_id) DO UPDATE SET grade = excluded.grade
+    WHERE grade IS NOT excluded.grade
+'''
+
+
+def log_changes(cursor, affected):
+    """Record the keys the current grades_version changed, and forget old versions."""
+    version = cursor.execute(database.GRADES_VERSION_SQL).fetchone()[0]
+    cursor.execute("INSERT INTO grade_change_batches (version) VALUES (?)", (version,))
+    cursor.executemany("INSERT INTO grade_changes (version, student_id, level) VALUES (?, ?, ?)",
+                       ((version, student_id, level) for student_id, level in affected))
+    oldest = version - CHANGE_LOG_VERSIONS
+    cursor.execute("DELETE FROM grade_change_batches WHERE version <= ?", (oldest,))
+    cursor.execute("DELETE FROM grade_changes WHERE version <= ?", (oldest,))
+    return version
+
+
+class _Errors(list):
+    # Keeps the first MAX_REPORTED_ERRORS errors and counts the rest
+    count = 0
+
+    def append(self, error):
+        self.count += 1
+        if len(self) < MAX_REPORTED_ERRORS:
+            super().append(error)
+
+
+def import_grades(path, batch_size=BATCH_SIZE, dry_run=False, full=False):
+    """
+    Import the CSV file at path; returns an ImportResult. With full=True,
+    every student's rows are compared, not only those whose hash changed.
+    """
+    start = time.perf_counter()
+    create_tables(render_results=True)  # bring an older database up to the current schema
+    conn = sqlite3.connect(database.DB_PATH, isolation_level=None)
+    cursor = conn.cursor()
+    students = dict(cursor.execute("SELECT index_number, id FROM students"))
+    course_ids = load_catalog().course_ids
+    errors = _Errors()
+    written = 0
+    affected = []
+
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            hashes, rows = student_hashes(read_rows(f, students, course_ids, errors), course_ids)
+
+        cursor.execute("BEGIN IMMEDIATE")
+        stored = {} if full else dict(cursor.execute("SELECT student_id, hash FROM grade_hashes"))
+        changed = {student_id for student_id, digest in hashes.items() if stored.get(student_id) != digest}
+        if changed:
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                # Errors were counted by the first pass
+                staged = (row for row in read_rows(f, students, course_ids, _Errors()) if row[0] in changed)
+                _stage_rows(cursor, staged, batch_size)
+            affected = [tuple(row) for row in cursor.execute(AFFECTED_SQL)]
+            if affected and not dry_run:
+                with bulk_write(cursor):
+                    before = conn.total_changes
+                    cursor.execute(UPSERT_STAGED_SQL)
+                    written = conn.total_changes - before
+                    refresh_result_blobs(cursor, {student_id for student_id, _ in affected})
+                log_changes(cursor, affected)
+            cursor.executemany("INSERT OR REPLACE INTO grade_hashes (student_id, hash) VALUES (?, ?)",
+                               ((student_id, hashes[student_id]) for student_id in changed))
+        cursor.execute("ROLLBACK" if dry_run or not changed else "COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    return ImportResult(rows, written, rows - written if not dry_run else 0, errors.count,
+                        list(errors), len(changed), affected, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="CSV file with index_number, course and grade columns")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per executemany")
+    parser.add_argument("--dry-run", action="store_true", help="validate the file without writing")
+    parser.add_argument("--full", action="store_true", help="compare every student, not only changed hashes")
+    parser.add_argument("--affected", metavar="PATH", help="write the changed student_id,level results to PATH")
+    args = parser.parse_args()
+
+    try:
+        result = import_grades(args.path, args.batch_size, args.dry_run, args.full)
+    except CSVFormatError as e:
+        sys.exit(f"{args.path}: {e}")
+
+    for line, reason in result.errors:
+        print(f"{args.path}:{line}: {reason}", file=sys.stderr)
+    if result.invalid > len(result.errors):
+        print(f"... and {result.invalid - len(result.errors)} more invalid rows", file=sys.stderr)
+    if args.affected:
+        with open(args.affected, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('student_id', 'level'))
+            writer.writerows(result.affected)
+    action = "validated" if args.dry_run else f"imported ({result.written} written, {result.unchanged} unchanged)"
+    print(f"{result.students_changed} students changed since the last import, "
+          f"{len(result.affected)} results affected")
+    print(f"{result.rows} rows {action}, {result.invalid} invalid, in {result.seconds:.1f}s "
+          f"({result.rows / max(result.seconds, 1e-9):,.0f} rows/s)")
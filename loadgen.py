@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Record and replay realistic Arkesel USSD sessions
+
+Record sessions for the students in the database to JSONL: result checks,
+wrong passwords, exits from the main menu, and sessions abandoned part way:
+
+    python loadgen.py record --sessions 2000 --out instance/loadgen_sessions.jsonl
+
+Replay them at a controlled rate, in-process against the Flask app or
+against a running server, and report throughput, per-step latency and the
+session store's size:
+
+    python loadgen.py replay --rate 200 --think 0.5
+    python loadgen.py replay --rate 200 --url http://127.0.0.1:8000
+"""
+
+import argparse
+import io
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+import database
+import menu
+
+DEFAULT_PATH = 'instance/loadgen_sessions.jsonl'
+
+# Share of recorded sessions of each kind
+SESSION_MIX = (
+    ('result', 0.75),
+    ('wrong_password', 0.10),
+    ('exit', 0.05),
+    ('abandoned', 0.10),
+)
+STEP_NAMES = ('dial', 'main_menu', 'index', 'password', 'year')
+
+
+def record_sessions(n_sessions, seed=0):
+    """n_sessions session scripts, as dicts, for students in the database."""
+    with database.connection() as conn:
+        students = [tuple(row) for row in conn.execute(
+            "SELECT index_number, password FROM students WHERE password IS NOT NULL ORDER BY id")]
+    if not students:
+        raise SystemExit("No students in the database; seed it first")
+
+    rng = random.Random(seed)
+    kinds, weights = zip(*SESSION_MIX)
+    sessions = []
+    for n in range(n_sessions):
+        kind = rng.choices(kinds, weights)[0]
+        index_number, password = rng.choice(students)
+        year = rng.choice(tuple(menu.YEAR_LEVELS))
+        if kind == 'exit':
+            hops = [menu.SERVICE_CODE + '#', '2']
+        elif kind == 'wrong_password':
+            hops = [menu.SERVICE_CODE + '#', '1', index_number, password + 'x', year]
+        else:
+            hops = [menu.SERVICE_CODE + '#', '1', index_number, password, year]
+            if kind == 'abandoned':
+                hops = hops[:rng.randint(1, 4)]
+        sessions.append({
+            'session': f's{n}',
+            'msisdn': f'23320{rng.randrange(10 ** 7):07d}',
+            'kind': kind,
+            'hops': hops,
+        })
+    return sessions
+
+
+def save_sessions(sessions, path):
+    with open(path, 'w') as f:
+        for session in sessions:
+            f.write(json.dumps(session) + '\n')
+
+
+def load_sessions(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def wsgi_post(wsgi_app, path, body, content_type='application/json'):
+    """One POST through a WSGI callable, without a server or test client."""
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    return b''.join(wsgi_app(environ, lambda status, headers, exc_info=None: None))
+
+
+class InProcessTarget:
+    """Sends hops straight to the app's WSGI callable."""
+
+    def __init__(self):
+        import app
+        self.app = app
+
+    def post(self, body):
+        return wsgi_post(self.app.app, '/ussd', body)
+
+    def session_store_size(self):
+        return self.app.session_store_size()
+
+    def session_entry_bytes(self):
+        """Approximate memory per open session in the in-memory store."""
+        import tracemalloc
+        from session_store import SessionState, SessionStore, session_key
+        if not isinstance(self.app.cache_data, SessionStore):
+            return None
+        store = SessionStore()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for n in range(1000):
+            store[session_key(f'loadgen-{n}')] = SessionState(*menu.ASK_YEAR, f'07{n:08d}',
+                                                              database.password_digest('x'))
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used // 1000
+
+
+class HttpTarget:
+    """Sends hops to a running server, one keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = (parts.path.rstrip('/') or '') + '/ussd'
+        self.metrics_path = (parts.path.rstrip('/') or '') + '/metrics'
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = HTTPConnection(self.host, self.port, timeout=10)
+        return conn
+
+    def post(self, body):
+        conn = self._connection()
+        try:
+            conn.request('POST', self.path, body, {'Content-Type': 'application/json'})
+            return conn.getresponse().read()
+        except Exception:
+            conn.close()
+            self.local.conn = None
+            raise
+
+    def session_store_size(self):
+        # Only the worker that answers the scrape is counted
+        conn = HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            conn.request('GET', self.metrics_path)
+            for line in conn.getresponse().read().decode().splitlines():
+                if line.startswith('ussd_session_store_size '):
+                    return int(line.split()[1])
+        finally:
+            conn.close()
+        return None
+
+
+def _expected(kind, reply):
+    # Whether the last reply is what a session of this kind should end on
+    if kind == 'abandoned':
+        return reply['continueSession']
+    if kind == 'exit':
+        return reply['message'] == menu.THANK_YOU
+    if kind == 'wrong_password':
+        return reply['message'] == menu.NO_RECORD
+    return not reply['continueSession'] and reply['message'] not in (
+        menu.NO_RECORD, menu.UNEXPECTED_ERROR, menu.SESSION_EXPIRED, menu.INVALID_INPUT)
+
+
+class Replay:
+    def __init__(self, target, rate, think=0.0, workers=64, run_id=None):
+        self.target = target
+        self.rate = rate
+        self.think = think
+        self.workers = workers
+        self.run_id = run_id or f'{time.time():.0f}'
+        self.latency = {step: [] for step in STEP_NAMES}
+        self.hops = 0
+        self.errors = 0
+        self.unexpected = 0
+        self.peak_store_size = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def _session(self, session):
+        session_id = f"{self.run_id}-{session['session']}"
+        reply = None
+        try:
+            for hop, user_data in enumerate(session['hops']):
+                if hop and self.think:
+                    time.sleep(self.think)
+                body = json.dumps({
+                    'sessionID': session_id, 'userID': 'loadgen', 'newSession': hop == 0,
+                    'msisdn': session['msisdn'], 'userData': user_data, 'network': 'MTN',
+                }).encode()
+                start = time.perf_counter()
+                reply = json.loads(self.target.post(body))
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.latency[STEP_NAMES[hop]].append(elapsed)
+                    self.hops += 1
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        if not _expected(session['kind'], reply):
+            with self._lock:
+                self.unexpected += 1
+
+    def _watch_store(self, done):
+        while not done.wait(0.25):
+            size = self.target.session_store_size()
+            if size is not None:
+                self.peak_store_size = max(self.peak_store_size, size)
+
+    def run(self, sessions):
+        """Start sessions at `rate` per second and wait for all of them."""
+        done = threading.Event()
+        watcher = threading.Thread(target=self._watch_store, args=(done,), daemon=True)
+        watcher.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.workers) as pool:
+            for n, session in enumerate(sessions):
+                due = start + n / self.rate
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._session, session)
+        self.elapsed = time.perf_counter() - start
+        done.set()
+        watcher.join()
+        size = self.target.session_store_size()
+        if size is not None:
+            self.peak_store_size = max(self.peak_store_size, size)
+        return self.report(len(sessions))
+
+    def report(self, n_sessions):
+        report = {
+            'sessions': n_sessions,
+            'hops': self.hops,
+            'seconds': round(self.elapsed, 3),
+            'hops_per_second': round(self.hops / self.elapsed, 1),
+            'errors': self.errors,
+            'unexpected_replies': self.unexpected,
+            'peak_session_store_size': self.peak_store_size,
+            'steps': {},
+        }
+        entry_bytes = getattr(self.target, 'session_entry_bytes', lambda: None)()
+        if entry_bytes is not None:
+            report['peak_session_store_bytes'] = self.peak_store_size * entry_bytes
+        for step, samples in self.latency.items():
+            if samples:
+                samples.sort()
+                report['steps'][step] = {
+                    'count': len(samples),
+                    **{f'p{p}_ms': round(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1e3, 3)
+                       for p in (50, 95, 99)},
+                }
+        return report
+
+
+def print_report(report):
+    print(f"{report['sessions']} sessions, {report['hops']} hops in {report['seconds']}s "
+          f"({report['hops_per_second']} hops/s); errors: {report['errors']}, "
+          f"unexpected replies: {report['unexpected_replies']}")
+    memory = report.get('peak_session_store_bytes')
+    print(f"peak session store size: {report['peak_session_store_size']}"
+          + (f" (~{memory / 1024:.0f} KiB)" if memory is not None else ""))
+    print(f"{'step':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for step, stats in report['steps'].items():
+        print(f"{step:<10} {stats['count']:>7} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help='record session scripts to JSONL')
+    record.add_argument('--sessions', type=int, default=1000)
+    record.add_argument('--seed', type=int, default=0)
+    record.add_argument('--out', default=DEFAULT_PATH)
+    replay = commands.add_parser('replay', help='replay recorded sessions and report')
+    replay.add_argument('--in', dest='path', default=DEFAULT_PATH)
+    replay.add_argument('--rate', type=float, default=100, help='sessions started per second')
+    replay.add_argument('--think', type=float, default=0.0, help='seconds between hops of a session')
+    replay.add_argument('--workers', type=int, default=64, help='sessions in flight at once')
+    replay.add_argument('--url', help='server to replay against (default: the app, in-process)')
+    replay.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        sessions = record_sessions(args.sessions, args.seed)
+        save_sessions(sessions, args.out)
+        print(f"Recorded {len(sessions)} sessions to {args.out}")
+    else:
+        target = HttpTarget(args.url) if args.url else InProcessTarget()
+        result = Replay(target, args.rate, args.think, args.workers).run(load_sessions(args.path))
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_report(result)
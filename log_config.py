@@ -0,0 +1,175 @@
+"""
+Non-blocking logging for the USSD hot path
+
+configure_logging() replaces logging.basicConfig: the root logger gets a
+queue handler, and a QueueListener thread formats and writes the records,
+so neither formatting nor I/O happens on the request thread.
+
+Hot-path calls log lazily, with %-style arguments, and name their event:
+
+    logging.info("Session level: %(level)s", {'level': level}, extra={'event': 'ussd.state'})
+
+Each event can be sampled (USSD_LOG_SAMPLE="ussd.state=0.1,ussd.request=0.5")
+and is dropped before it is queued. Passwords in logged user input are
+masked on the writer thread by the RedactFilter passed as `redact`.
+
+USSD_LOG_SKIP_RECORD_FIELDS=1 also stops the logging module from filling in
+record fields LOG_FORMAT never shows; see skip_unused_record_fields().
+"""
+
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+REDACTED = '***'
+
+# Where the password sits in an answer path: 1*<index>*<password>*<year>
+PASSWORD_ANSWER = 2
+
+
+def parse_sample_rates(spec):
+    """"ussd.state=0.1,ussd.request=0.5" -> {"ussd.state": 0.1, "ussd.request": 0.5}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        event, _, rate = item.partition('=')
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records for each event; warnings and errors are always kept."""
+
+    def __init__(self, rates, random=random.random):
+        super().__init__()
+        self.rates = rates
+        self.random = random
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return rate >= 1 or self.random() < rate
+
+
+def redact_input(data, screen, service_code, password_screen):
+    """
+    User input with any password in it masked. screen is the screen the
+    input answers; password_screen is the one that asks for the password.
+    """
+    if not data:
+        return data
+    if screen == password_screen:
+        return REDACTED
+    # Dial strings (*928*230*1*<index>*<password>#) and Africa's Talking
+    # text paths (1*<index>*<password>) carry the password as one answer
+    if data.startswith('*'):
+        if not data.startswith(service_code + '*'):
+            return data
+        offset = service_code.count('*') + 1
+    else:
+        offset = 0
+    suffix = '#' if data.endswith('#') else ''
+    parts = data[:len(data) - len(suffix)].split('*')
+    position = offset + PASSWORD_ANSWER
+    if len(parts) > position:
+        parts[position] = REDACTED
+        return '*'.join(parts) + suffix
+    return data
+
+
+class RedactFilter(logging.Filter):
+    """
+    Mask passwords in records that log user input as a `data` argument,
+    with the screen it answers as `screen`. service_code is the code users
+    dial and password_screen the screen that asks for the password.
+    """
+
+    def __init__(self, service_code, password_screen):
+        super().__init__()
+        self.service_code = service_code
+        self.password_screen = password_screen
+
+    def filter(self, record):
+        args = record.args
+        if isinstance(args, dict) and 'data' in args:
+            data = redact_input(args['data'], args.get('screen'), self.service_code, self.password_screen)
+            record.args = dict(args, data=data)
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks can't outlive the frame they refer to
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def skip_unused_record_fields():
+    """
+    Stop filling in LogRecord fields LOG_FORMAT never shows. Finding the
+    caller's file and line walks the stack on every call. This changes the
+    logging module for the whole process, so it is only done on request.
+    """
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+
+_listener = None
+
+
+def configure_logging(level=None, sample_rates=None, stream=None, redact=None, skip_unused_fields=None):
+    """
+    Route the root logger through a queue to a background writer. redact
+    is a RedactFilter for the written records. Safe to call more than once;
+    later calls reconfigure. Returns the listener.
+    """
+    global _listener
+    if level is None:
+        level = os.environ.get('USSD_LOG_LEVEL', 'INFO').upper()
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.environ.get('USSD_LOG_SAMPLE', ''))
+    if skip_unused_fields is None:
+        skip_unused_fields = os.environ.get('USSD_LOG_SKIP_RECORD_FIELDS') == '1'
+
+    stop_logging()
+    if skip_unused_fields:
+        skip_unused_record_fields()
+    records = queue.SimpleQueue()
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+    if redact is not None:
+        writer.addFilter(redact)
+    handler = LazyQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, LazyQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write out every queued record and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
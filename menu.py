@@ -0,0 +1,298 @@
+"""
+USSD menu for the TTU result checker: screens, input handling and transitions
+
+Screens are declared once in SCREENS and compiled at import into TRANSITIONS,
+a flat dict from a session's (level, step) to the handler for the answer it
+is waiting on. Handling a hop is one dict lookup plus one call, however many
+screens the menu grows.
+"""
+
+import logging
+import time
+from collections import Counter, namedtuple
+
+import metrics
+from catalog import get_catalog
+from database import StudentMessage, get_result_message, get_student_result, password_digest
+from prefetch import Prefetcher
+from result_blobs import format_result
+from result_cache import results
+from session_store import SessionState
+
+# Menu constants
+WELCOME_MENU = (
+    "Welcome to TTU Result Checker\n"
+    "1. Check Results\n"
+    "2. Exit"
+)
+ENTER_INDEX = "Enter your index number:"
+ENTER_PASSWORD = "Enter your password:"
+SELECT_YEAR = (
+    "Select Academic Year:\n"
+    "1. Level 100\n"
+    "2. Level 200\n"
+    "3. Level 300\n"
+    "4. Level 400"
+)
+THANK_YOU = "Thank you for using TTU Result Checker."
+INVALID_INPUT = "Invalid input. Please try again."
+NO_RECORD = "No record found for the provided details."
+SESSION_EXPIRED = "Session expired. Please try again."
+UNEXPECTED_ERROR = "An unexpected error occurred. Please try again later."
+
+# Dial string for the service; answers may be appended, e.g. *928*230*1*<index>#
+SERVICE_CODE = "*928*230"
+
+# Screen positions, stored in SessionState as (level, step)
+MAIN_MENU = (0, 0)
+ASK_INDEX = (1, 1)
+ASK_PASSWORD = (1, 2)
+ASK_YEAR = (1, 3)
+
+# Map year choice to the level whose courses it shows
+YEAR_LEVELS = {"1": 100, "2": 200, "3": 300, "4": 400}
+
+# started and expired, then how sessions ended: completed (results shown),
+# failed_auth, invalid, exited or error; see ending_event
+SESSION_EVENTS = metrics.Counter('ussd_session_events', 'USSD session lifecycle events', ('event',))
+
+
+class Reply(namedtuple('Reply', 'message continue_session')):
+    """What to show the user, and whether the session stays open."""
+
+
+def end(message):
+    return Reply(message, False)
+
+
+INVALID = end(INVALID_INPUT)
+
+
+class Screen:
+    """
+    Declaration of one menu screen: where it sits, what it asks, and what
+    its answer does. Exactly one of options, store or action is given.
+
+    options: answer -> next screen position, or a final message string
+    store:   SessionState field to save the answer in (after convert),
+             then continue to `next`
+    action:  function(state, answer) -> Reply for the last screen
+    choices: answers the action accepts; anything else is invalid input
+    after:   function(state) called once a stored answer is accepted
+    """
+
+    def __init__(self, position, prompt, options=None, store=None, convert=None,
+                 next=None, action=None, choices=None, after=None):
+        self.position = position
+        self.prompt = prompt
+        self.options = options
+        self.store = store
+        self.convert = convert
+        self.next = next
+        self.action = action
+        self.choices = choices
+        self.after = after
+
+
+def render_result(result):
+    """USSD message for a StudentResult."""
+    return format_result(result.name, result.grades, get_catalog().course_names)
+
+
+# Loads results in the background while the user is still typing (USSD_PREFETCH=1)
+prefetcher = Prefetcher(render_result, YEAR_LEVELS.values())
+
+
+def prefetch_student(state):
+    prefetcher.index_entered(state)
+
+
+def prefetch_results(state):
+    prefetcher.password_entered(state)
+
+
+def show_results(state, year_choice):
+    """Authenticate the session's student and render their grades for the chosen year."""
+    started = time.perf_counter()
+    prefetched = prefetcher.wait(state.index_number, state.password_hash)
+    reply = _show_results(state, year_choice)
+    prefetcher.record_final_step(time.perf_counter() - started, prefetched)
+    return reply
+
+
+def _show_results(state, year_choice):
+    index = state.index_number
+    level = YEAR_LEVELS[year_choice]
+    state.year = year_choice
+
+    message = results.get(index, state.password_hash, level)
+    if message is not None:
+        return end(message)
+
+    logging.info("Attempting authentication - Index: %r", index, extra={'event': 'ussd.auth'})
+
+    version = results.version()
+    found = get_result_message(index, state.password_hash, level)
+    if found is not None and found.message is None:
+        # Not rendered yet (or dropped by a write outside an import)
+        result = get_student_result(index, state.password_hash, level)
+        found = result and StudentMessage(result.student_id, render_result(result))
+    if found is None:
+        logging.error("Authentication failed for index: %r", index)
+        return end(NO_RECORD)
+
+    results.put(index, state.password_hash, found.student_id, level, found.message, version)
+    return end(found.message)
+
+
+SCREENS = (
+    Screen(MAIN_MENU, WELCOME_MENU, options={"1": ASK_INDEX, "2": THANK_YOU}),
+    Screen(ASK_INDEX, ENTER_INDEX, store="index_number", next=ASK_PASSWORD,
+           after=prefetch_student),
+    Screen(ASK_PASSWORD, ENTER_PASSWORD, store="password_hash", convert=password_digest, next=ASK_YEAR,
+           after=prefetch_results),
+    Screen(ASK_YEAR, SELECT_YEAR, action=show_results, choices=YEAR_LEVELS),
+)
+
+
+def _invalid(state, answer):
+    return INVALID
+
+
+def _compile_options(options, prompts):
+    # Resolve every option to its Reply and next position up front.
+    outcomes = {}
+    for answer, target in options.items():
+        if isinstance(target, tuple):
+            outcomes[answer] = (Reply(prompts[target], True), target)
+        else:
+            outcomes[answer] = (end(target), None)
+
+    def handle(state, answer):
+        outcome = outcomes.get(answer)
+        if outcome is None:
+            return INVALID
+        reply, target = outcome
+        if target is not None:
+            state.level, state.step = target
+        return reply
+
+    return handle
+
+
+def _compile_store(field, convert, target, prompts, after):
+    reply = Reply(prompts[target], True)
+    level, step = target
+
+    def handle(state, answer):
+        if not answer:
+            return INVALID
+        setattr(state, field, convert(answer) if convert else answer)
+        state.level, state.step = level, step
+        if after is not None:
+            after(state)
+        return reply
+
+    return handle
+
+
+def _compile_action(action, choices):
+    def handle(state, answer):
+        if choices is not None and answer not in choices:
+            return INVALID
+        return action(state, answer)
+
+    return handle
+
+
+def compile_screens(screens):
+    """Build the (level, step) -> handler table for a sequence of Screens."""
+    prompts = {screen.position: screen.prompt for screen in screens}
+    table = {}
+    for screen in screens:
+        if screen.options is not None:
+            handler = _compile_options(screen.options, prompts)
+        elif screen.store is not None:
+            handler = _compile_store(screen.store, screen.convert, screen.next, prompts, screen.after)
+        else:
+            handler = _compile_action(screen.action, screen.choices)
+        table[screen.position] = handler
+    return table
+
+
+TRANSITIONS = compile_screens(SCREENS)
+WELCOME = Reply(WELCOME_MENU, True)
+
+
+_ENDINGS = {NO_RECORD: 'failed_auth', INVALID_INPUT: 'invalid', THANK_YOU: 'exited',
+            UNEXPECTED_ERROR: 'error'}
+
+
+def ending_event(reply):
+    """The SESSION_EVENTS label for a reply that ends a session."""
+    return _ENDINGS.get(reply.message, 'completed')
+
+
+def start():
+    """Reply and fresh state for a new session."""
+    return WELCOME, SessionState(*MAIN_MENU)
+
+
+def advance(state, user_data, transitions=TRANSITIONS):
+    """
+    Apply the user's answer to the screen `state` is on. Updates state in
+    place and returns the Reply to send.
+    """
+    answer = user_data.strip() if user_data else ''
+    return transitions.get((state.level, state.step), _invalid)(state, answer)
+
+
+def replay(answers, transitions=TRANSITIONS):
+    """
+    Run a new session through a sequence of answers, as if each had arrived
+    on its own hop. Returns the last Reply and the resulting state; stops at
+    the first reply that ends the session.
+    """
+    reply, state = start()
+    for answer in answers:
+        reply = advance(state, answer, transitions)
+        if not reply.continue_session:
+            break
+    return reply, state
+
+
+# Direct dials and the gateway round-trips their pre-filled answers saved
+dial_stats = Counter()
+
+
+def dial_answers(dial_string):
+    """
+    Answers appended to the service code in a dial string:
+    "*928*230*1*0722000040#" -> ["1", "0722000040"]. Anything else,
+    including the bare service code, has none.
+    """
+    dial_string = dial_string.strip() if dial_string else ''
+    if not dial_string.startswith(SERVICE_CODE + "*"):
+        return []
+    answers = dial_string[len(SERVICE_CODE) + 1:].rstrip('#').split('*')
+    return answers if all(answers) else []
+
+
+def start_dialled(dial_string, transitions=TRANSITIONS):
+    """
+    Like start(), but apply any answers pre-filled in the dial string, so
+    the session opens on a later screen.
+    """
+    reply, state = start()
+    saved = 0
+    for answer in dial_answers(dial_string):
+        reply = advance(state, answer, transitions)
+        if reply is INVALID:
+            break
+        saved += 1
+        if not reply.continue_session:
+            break
+    if saved:
+        dial_stats['direct_dials'] += 1
+        dial_stats['hops_saved'] += saved
+    return reply, state
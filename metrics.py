@@ -0,0 +1,167 @@
+"""
+In-process metrics, exposed as OpenMetrics text on /metrics
+
+Counters and histograms are plain per-worker Python objects: recording a
+value is a dict lookup, a bisect and a couple of additions under a lock,
+cheap enough to leave on for every hop. Each gunicorn worker reports its
+own numbers; the scraper sums them.
+
+    REQUESTS = Counter('ussd_requests', 'USSD hops handled', ('endpoint',))
+    REQUESTS.inc('arkesel')
+"""
+
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Upper bounds in seconds, from 100us (a cache hit) to 2.5s (a stuck query)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the OpenMetrics text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.append('# EOF\n')
+        return '\n'.join(lines)
+
+
+REGISTRY = Registry()
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def header(self):
+        return [f'# TYPE {self.name} {self.kind}', f'# HELP {self.name} {_escape(self.help)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f'{self.name}_total{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager that observes the wall time of its block."""
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = self.header()
+        bounds = [f'le="{float(b)!r}"' for b in self.buckets] + ['le="+Inf"']
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}')
+            label_str = _labels(self.labelnames, labels)
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+            lines.append(f'{self.name}_sum{label_str} {series[-1]}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Gauge(Metric):
+    """A value read from a callback at scrape time, e.g. a store's size."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, read, registry=REGISTRY):
+        super().__init__(name, help, (), registry)
+        self.read = read
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return self.header() + [f'{self.name} {value}']
+
+
+class CallbackCounter(Gauge):
+    """A counter kept elsewhere (e.g. ResultCache.hits), read at scrape time."""
+    kind = 'counter'
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return self.header() + [f'{self.name}_total {value}']
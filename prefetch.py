@@ -0,0 +1,155 @@
+"""
+Speculative prefetch of a student's results while they are still typing
+
+There are several seconds of think-time between the index, password and
+year screens. With prefetch enabled (USSD_PREFETCH=1), entering the index
+number starts loading the student record on a thread pool, and entering
+the password verifies it and renders every level's result into the result
+cache. The final year-selection hop then only waits for that work, if it
+is already running, and reads the result cache; work still queued behind
+a busy pool is not waited for, and the hop queries itself.
+
+A student record loaded for an index number is only used while the grades
+version it was read under is current, so a password or name changed since
+then is read again. Prefetched results are cached with the session TTL, so
+they go away with the session that asked for them.
+"""
+
+import hmac
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import get_catalog
+from database import StudentResult, get_all_grades, get_student_by_index, password_digest
+from metrics import Histogram
+from result_cache import results
+from session_store import SESSION_TTL, SessionStore
+
+PREFETCH_ENABLED = os.environ.get('USSD_PREFETCH', '') == '1'
+PREFETCH_WORKERS = 4
+# Longest the final step waits for an in-flight prefetch before querying itself
+PREFETCH_WAIT = 2.0
+
+FINAL_STEP_SECONDS = Histogram('ussd_final_step_seconds', 'Time to answer the year-selection hop',
+                               ('prefetched',))
+
+
+class Prefetcher:
+    def __init__(self, render, levels, enabled=PREFETCH_ENABLED, workers=PREFETCH_WORKERS,
+                 ttl=SESSION_TTL, cache=results):
+        self.render = render
+        self.levels = tuple(levels)
+        self.enabled = enabled
+        self.workers = workers
+        self.ttl = ttl
+        self.cache = cache
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._students = SessionStore(ttl=ttl)  # index_number -> Future of (version, student row)
+        self._resolved = SessionStore(ttl=ttl)  # (index_number, password_hash) -> Future
+
+        self.started = 0
+        self.used = 0
+        self.not_waited = 0
+        self.final_step_ms = {True: deque(maxlen=1000), False: deque(maxlen=1000)}
+
+    def _submit(self, fn, *args):
+        # The pool is created lazily, and again after a fork, since worker
+        # threads do not survive into a forked child.
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='prefetch')
+                    self._pid = os.getpid()
+        self.started += 1
+        return self._executor.submit(fn, *args)
+
+    def index_entered(self, state):
+        """Screen hook: start loading the student record for the index number."""
+        if not self.enabled:
+            return
+        index = state.index_number
+        if self._students.get(index) is None:
+            self._students[index] = self._submit(self._load_student, index)
+
+    def _load_student(self, index):
+        # The version is read first, as for ResultCache.put
+        version = self.cache.version()
+        return version, get_student_by_index(index)
+
+    def password_entered(self, state):
+        """Screen hook: verify the password and render every level's result."""
+        if not self.enabled:
+            return
+        key = (state.index_number, state.password_hash)
+        if self._resolved.get(key) is None:
+            self._resolved[key] = self._submit(self._resolve, *key)
+
+    def _resolve(self, index, password_hash):
+        version = self.cache.version()
+        pending = self._students.get(index)
+        loaded_version, student = pending.result() if pending is not None else (None, None)
+        if version is None or loaded_version != version:
+            # Not loaded, or loaded before the latest write: it may be stale
+            student = get_student_by_index(index)
+        if student is None or student["password"] is None:
+            return False
+        if not hmac.compare_digest(password_digest(student["password"]), password_hash):
+            return False
+
+        grades = {level: [] for level in self.levels}
+        course_levels = get_catalog().course_levels
+        for course_id, grade in get_all_grades(student["id"]):
+            level = course_levels.get(course_id)
+            if level in grades:
+                grades[level].append((course_id, grade))
+        for level, level_grades in grades.items():
+            message = self.render(StudentResult(student["id"], student["name"], level_grades))
+            self.cache.put(index, password_hash, student["id"], level, message, version, ttl=self.ttl)
+        return True
+
+    def wait(self, index, password_hash):
+        """
+        Wait for an in-flight prefetch for these credentials. Returns True if
+        one completed, so its results are now in the result cache.
+        """
+        if not self.enabled:
+            return False
+        pending = self._resolved.get((index, password_hash))
+        if pending is None:
+            return False
+        if not (pending.running() or pending.done()):
+            # Still queued behind other sessions' work: querying now is quicker
+            self.not_waited += 1
+            return False
+        try:
+            done = pending.result(timeout=PREFETCH_WAIT)
+        except Exception as e:
+            logging.error("Prefetch failed: %s", e)
+            return False
+        if done:
+            self.used += 1
+        return done
+
+    def record_final_step(self, seconds, prefetched):
+        self.final_step_ms[prefetched].append(seconds * 1e3)
+        FINAL_STEP_SECONDS.observe(seconds, 'true' if prefetched else 'false')
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "started": self.started, "used": self.used,
+                 "not_waited": self.not_waited}
+        for prefetched, label in ((True, "prefetched"), (False, "not_prefetched")):
+            samples = sorted(self.final_step_ms[prefetched])
+            if samples:
+                stats[f"final_step_{label}_p50_ms"] = samples[len(samples) // 2]
+                stats[f"final_step_{label}_p99_ms"] = samples[min(len(samples) - 1, len(samples) * 99 // 100)]
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
+        self._executor = None
@@ -0,0 +1,212 @@
+"""
+Redis-protocol session backend for multi-node deployments
+
+Speaks RESP directly over pooled sockets, so it needs no client library and
+works against Redis or any server that implements GET/SET/EXPIRE/DEL
+(KeyDB, Dragonfly, ...). Every backend call is a single pipelined round-trip.
+"""
+
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from session_store import SessionBackend, SessionState, SESSION_TTL, SWEEP_INTERVAL
+
+REDIS_URL = 'redis://localhost:6379/0'
+KEY_PREFIX = b'ussd:session:'
+
+
+class RedisError(Exception):
+    """Error reply from the server."""
+
+
+class RedisConnection:
+    """One socket to the server; sends pipelines and reads their replies."""
+
+    def __init__(self, host, port, db=0, password=None, timeout=2.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        setup = []
+        if password:
+            setup.append((b'AUTH', password))
+        if db:
+            setup.append((b'SELECT', db))
+        if setup:
+            try:
+                self.execute(setup)
+            except BaseException:
+                self.close()
+                raise
+
+    def execute(self, commands):
+        """Send every command in one write and return their replies in order."""
+        self.sock.sendall(b''.join(_encode(command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by Redis server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body
+        if kind == b'-':
+            return RedisError(body.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from Redis server: {line!r}")
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def _encode(command):
+    parts = [b'*%d\r\n' % len(command)]
+    for arg in command:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, int):
+            arg = b'%d' % arg
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+class RedisConnectionPool:
+    """
+    Thread-safe pool of RedisConnections. Connections are opened lazily up to
+    max_connections. A connection goes back to the pool after an error
+    reply, whose replies were all read; after any other error it is closed.
+    """
+
+    def __init__(self, url=REDIS_URL, max_connections=16, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.round_trips = 0
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ConnectionError("Timed out waiting for a Redis connection")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = RedisConnection(self.host, self.port, self.db, self.password, self.timeout)
+            try:
+                yield conn
+            except RedisError:
+                self._idle.put(conn)
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def execute(self, *commands):
+        """Run commands as one pipeline on a pooled connection."""
+        with self.connection() as conn:
+            self.round_trips += 1
+            return conn.execute(commands)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    Session backend stored in Redis, shared by every node behind the load
+    balancer. Expiry is left to Redis: every write sets the key's TTL, and
+    each hop that continues a session writes it, so there is nothing to
+    sweep and a read is a plain GET.
+    """
+
+    def __init__(self, url=REDIS_URL, ttl=SESSION_TTL, max_connections=16,
+                 timeout=2.0, key_prefix=KEY_PREFIX):
+        self.ttl = ttl
+        self.sweep_interval = SWEEP_INTERVAL
+        self.key_prefix = key_prefix
+        self.pool = RedisConnectionPool(url, max_connections=max_connections, timeout=timeout)
+
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        return self.key_prefix + key
+
+    def get(self, key, default=None):
+        data, = self.pool.execute((b'GET', self._key(key)))
+        if data is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return SessionState.from_bytes(data)
+
+    def set(self, key, value):
+        self.pool.execute((b'SET', self._key(key), value.to_bytes(), b'EX', self.ttl))
+
+    def pop(self, key, default=None):
+        key = self._key(key)
+        data, _ = self.pool.execute((b'GET', key), (b'DEL', key))
+        if data is None:
+            return default
+        return SessionState.from_bytes(data)
+
+    def delete(self, key):
+        self.pool.execute((b'DEL', self._key(key)))
+
+    def sweep(self):
+        # Redis expires keys itself
+        return 0
+
+    def start_sweeper(self):
+        pass
+
+    def close(self):
+        self.pool.close()
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "round_trips": self.pool.round_trips,
+        }
+
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Pre-rendered result messages, one row per (student, level)
+
+The final USSD hop shows a student's grades for one level. Rendering that
+message means reading up to 15 grade rows and formatting them; result_blobs
+stores the finished text instead, so the hop is one lookup by primary key
+after the password check (database.get_result_message).
+
+import_grades.py re-renders the results an import changes. Triggers drop a
+message when its grades, student or courses are written any other way,
+and a hop without a message falls back to rendering from the grades. To
+render every result, e.g. after seeding:
+
+    python result_blobs.py
+"""
+
+import itertools
+import logging
+import sqlite3
+import time
+
+import database
+
+NO_GRADES = "No grades found for selected year."
+# Every level the year menu offers (menu.YEAR_LEVELS); a level without
+# courses still gets a NO_GRADES message, so no check falls back
+LEVELS = (100, 200, 300, 400)
+
+# Every student's grades, in the order the covering index keeps them
+ALL_GRADES_SQL = "SELECT student_id, course_id, grade FROM grades ORDER BY student_id, course_id"
+
+
+def format_result(name, grades, course_names):
+    """USSD result message for a student's (course_id, grade) pairs, in catalog order."""
+    if grades:
+        grades_str = "\n".join([f"{course_names[course_id]}: {grade}" for course_id, grade in grades])
+        return f"{name}\n{grades_str}"
+    return f"{name}\n{NO_GRADES}"
+
+
+def _render(conn, students, wanted):
+    # students: (student_id, name, [(course_id, grade), ...]);
+    # wanted(student_id) -> the levels to render for that student
+    course_names, course_levels = {}, {}
+    for course_id, name, level in conn.execute("SELECT id, name, level FROM courses"):
+        course_names[course_id] = name
+        course_levels[course_id] = level
+    orphaned = 0
+    for student_id, name, grades in students:
+        by_level = {}
+        for course_id, grade in grades:
+            level = course_levels.get(course_id)
+            if level is None:
+                # e.g. a grade migrated from a course name the catalog lacks
+                orphaned += 1
+                continue
+            by_level.setdefault(level, []).append((course_id, grade))
+        for level in wanted(student_id):
+            yield student_id, level, format_result(name, by_level.get(level), course_names)
+    if orphaned:
+        logging.warning("Skipped %d grades whose course is not in the catalog", orphaned)
+
+
+def refresh_result_blobs(cursor, student_ids, levels=LEVELS):
+    """Render every level's result for the given students; returns how many rows were written."""
+    conn = cursor.connection
+
+    def students():
+        for student_id in sorted(set(student_ids)):
+            row = conn.execute("SELECT name FROM students WHERE id = ?", (student_id,)).fetchone()
+            if row is not None:
+                yield student_id, row[0], conn.execute(database.STUDENT_ALL_GRADES_SQL, (student_id,)).fetchall()
+
+    before = conn.total_changes
+    cursor.executemany("INSERT OR REPLACE INTO result_blobs (student_id, level, message) VALUES (?, ?, ?)",
+                       _render(conn, students(), lambda student_id: levels))
+    return conn.total_changes - before
+
+
+def rebuild_result_blobs(cursor, levels=LEVELS):
+    """Render every student's result for every level; returns how many."""
+    conn = cursor.connection
+
+    def students():
+        # Both queries are in student_id order; students without grades get []
+        graded = itertools.groupby(conn.execute(ALL_GRADES_SQL), key=lambda row: row[0])
+        current = next(graded, None)
+        for student_id, name in conn.execute("SELECT id, name FROM students ORDER BY id"):
+            while current is not None and current[0] < student_id:
+                current = next(graded, None)
+            grades = []
+            if current is not None and current[0] == student_id:
+                grades = [(course_id, grade) for _, course_id, grade in current[1]]
+                current = next(graded, None)
+            yield student_id, name, grades
+
+    cursor.execute("DELETE FROM result_blobs")
+    before = conn.total_changes
+    cursor.executemany("INSERT INTO result_blobs (student_id, level, message) VALUES (?, ?, ?)",
+                       _render(conn, students(), lambda student_id: levels))
+    return conn.total_changes - before
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        count = rebuild_result_blobs(conn.cursor())
+    conn.close()
+    print(f"Rendered {count} results in {time.perf_counter() - start:.1f}s")
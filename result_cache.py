@@ -0,0 +1,151 @@
+"""
+Read-through cache of rendered USSD result messages
+
+When results are released the same students check them again and again.
+Each (student_id, level) result message is rendered once and then served
+from memory, along with the verified credentials for the student's index
+number, so a repeat check does not query SQLite at all.
+
+Entries are dropped when meta.grades_version changes. Every worker polls
+the version at most once per version_check_interval, so a grade written by
+any process is visible everywhere within that interval. When the versions
+in between were written by logged imports, only the (student, level)
+entries they changed are dropped; otherwise the whole cache is.
+"""
+
+import hmac
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from database import get_grade_changes, get_grades_version
+
+RESULT_CACHE_SIZE = 20000
+RESULT_CACHE_TTL = 600
+VERSION_CHECK_INTERVAL = 1.0
+
+
+class ResultCache:
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL,
+                 version_check_interval=VERSION_CHECK_INTERVAL,
+                 version_source=get_grades_version, changes_source=get_grade_changes,
+                 timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._version_source = version_source
+        self._changes_source = changes_source
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._results = OrderedDict()   # (student_id, level) -> (expires_at, message)
+        self._students = OrderedDict()  # index_number -> (student_id, password_hash)
+        self._version = None
+        self._checked_at = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.targeted_invalidations = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def _check_version(self, now):
+        # Caller holds the lock
+        if self._checked_at is not None and now - self._checked_at < self.version_check_interval:
+            return
+        self._checked_at = now
+        try:
+            version = self._version_source()
+        except sqlite3.Error as e:
+            # Keep serving what is cached and try again next interval
+            logging.warning("Result cache could not read grades version: %s", e)
+            return
+        if version == self._version:
+            return
+        changes = None
+        if self._version is not None:
+            try:
+                changes = self._changes_source(self._version, version)
+            except sqlite3.Error as e:
+                logging.warning("Result cache could not read grade changes, clearing: %s", e)
+        if changes is None:
+            if self._version is not None:
+                self.invalidations += 1
+            self._results.clear()
+            self._students.clear()
+        else:
+            self.targeted_invalidations += 1
+            for key in changes:
+                self._results.pop(key, None)
+        self._version = version
+
+    def get(self, index_number, password_hash, level):
+        """
+        The cached message for this student and level, or None. Only returned
+        if password_hash matches the one verified when the entry was stored.
+        """
+        with self._lock:
+            now = self._timer()
+            self._check_version(now)
+            student = self._students.get(index_number)
+            if student is None or not hmac.compare_digest(student[1], password_hash):
+                self.misses += 1
+                return None
+            key = (student[0], level)
+            entry = self._results.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self._students.move_to_end(index_number)
+            self.hits += 1
+            return entry[1]
+
+    def version(self):
+        """
+        The grades version entries are currently valid for. Read it before
+        querying and pass it to put(), so a result fetched just before a
+        write is not cached under the new version.
+        """
+        with self._lock:
+            self._check_version(self._timer())
+            return self._version
+
+    def put(self, index_number, password_hash, student_id, level, message, version=None, ttl=None):
+        """Store a message rendered for a student whose password_hash was just verified."""
+        with self._lock:
+            now = self._timer()
+            self._check_version(now)
+            if version is not None and version != self._version:
+                return
+            self._students[index_number] = (student_id, password_hash)
+            self._students.move_to_end(index_number)
+            self._results[(student_id, level)] = (now + (ttl or self.ttl), message)
+            self._results.move_to_end((student_id, level))
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+            while len(self._students) > self.maxsize:
+                self._students.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._students.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._results),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "targeted_invalidations": self.targeted_invalidations,
+            "version": self._version,
+        }
+
+
+# Shared by every request in this worker
+results = ResultCache()
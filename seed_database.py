@@ -3,16 +3,20 @@
 Database seeding script to initialize the TTU USSD database with sample data
 """
 
+import argparse
 import os
 import sqlite3
-from database_schema import create_tables, insert_sample_data
+import time
+import database
+from database_schema import create_tables, insert_sample_data, insert_synthetic_data
+from result_blobs import rebuild_result_blobs
 
 def check_database_exists():
     """Check if database file exists and has data"""
-    db_path = 'instance/students.db'
+    db_path = database.DB_PATH
     
-    # Create instance directory if it doesn't exist
-    os.makedirs('instance', exist_ok=True)
+    # Create the database's directory if it doesn't exist
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
     
     if not os.path.exists(db_path):
         print("❌ Database file doesn't exist. Creating...")
@@ -45,11 +49,37 @@ def seed_database():
     print("Inserting sample student data...")
     insert_sample_data()
     print("✓ Sample data inserted successfully")
+    render_results()
+
+def seed_synthetic(n_students, seed):
+    """Add n_students generated students, graded in every course"""
+    print("Creating database tables...")
+    create_tables()
+    print(f"Generating {n_students} synthetic students (seed {seed})...")
+    start = time.perf_counter()
+    try:
+        grade_count = insert_synthetic_data(n_students, seed)
+    except sqlite3.IntegrityError:
+        print("❌ Synthetic students with these index numbers already exist.")
+        print(f"To regenerate, delete the '{database.DB_PATH}' file first.")
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - start
+    print(f"✓ {grade_count} grades inserted in {elapsed:.1f}s ({grade_count / elapsed:,.0f} rows/s)")
+    render_results()
+
+def render_results():
+    """Pre-render every student's result messages (see result_blobs.py)"""
+    start = time.perf_counter()
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        count = rebuild_result_blobs(conn.cursor())
+    conn.close()
+    print(f"✓ {count} result messages rendered in {time.perf_counter() - start:.1f}s")
 
 def verify_seeding():
     """Verify that seeding was successful"""
     try:
-        conn = sqlite3.connect('instance/students.db')
+        conn = sqlite3.connect(database.DB_PATH)
         cursor = conn.cursor()
         
         # Check students
@@ -75,12 +105,23 @@ def verify_seeding():
         print(f"❌ Error verifying database: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed the TTU USSD database")
+    parser.add_argument("--students", type=int, metavar="N",
+                        help="generate N synthetic students instead of the sample data")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for --students (default: 0)")
+    args = parser.parse_args()
+
     print("TTU USSD Database Seeder")
     print("=" * 30)
     
-    if not check_database_exists():
+    if args.students:
+        os.makedirs(os.path.dirname(database.DB_PATH) or '.', exist_ok=True)
+        seed_synthetic(args.students, args.seed)
+        verify_seeding()
+    elif not check_database_exists():
         seed_database()
         verify_seeding()
     else:
-        print("Database already exists and has data. Skipping seeding.")
-        print("To force re-seed, delete the 'instance/students.db' file first.")
+        create_tables(render_results=True)
+        print("Database already exists and has data; schema brought up to date. Skipping seeding.")
+        print(f"To force re-seed, delete the '{database.DB_PATH}' file first.")
@@ -0,0 +1,419 @@
+"""
+USSD session storage: the SessionState record and the backends that hold it
+
+Backends share the SessionBackend interface. SessionStore keeps sessions in
+process memory; SQLiteSessionBackend keeps them in a WAL-mode SQLite file so
+several gunicorn workers see the same sessions; RedisSessionBackend (in
+redis_session.py) shares them between nodes. create_session_backend()
+picks one from the USSD_SESSION_BACKEND environment variable.
+"""
+
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+# Arkesel drops an idle USSD dialogue after roughly three minutes, so a
+# session we have not heard from in that window can never be resumed.
+SESSION_TTL = 180
+SESSION_MAXSIZE = 50000
+SWEEP_INTERVAL = 30
+SESSION_DB_PATH = 'instance/sessions.db'
+SESSION_KEY_SIZE = 16
+
+
+def session_key(session_id):
+    """
+    Fixed-size binary key for a session ID.
+
+    Unlike hash(), the digest is the same in every process and across
+    restarts, so workers and nodes agree on it and it can be used to pick
+    a shard (see sharding.py).
+    """
+    if isinstance(session_id, str):
+        session_id = session_id.encode('utf-8')
+    return hashlib.blake2b(session_id, digest_size=SESSION_KEY_SIZE).digest()
+
+
+def fallback_session_id(msisdn):
+    """Stable session ID for requests where the gateway sent none."""
+    return f"session_{session_key(msisdn).hex()}"
+
+
+class SessionState:
+    """
+    Where a USSD dialogue is in the menu, plus the inputs collected so far.
+
+    One fixed-size record per session, updated in place on every hop.
+    The password is kept only as a digest (see database.password_digest).
+    """
+
+    __slots__ = ("level", "step", "index_number", "password_hash", "year")
+
+    def __init__(self, level=0, step=0, index_number=None, password_hash=None, year=None):
+        self.level = level
+        self.step = step
+        self.index_number = index_number
+        self.password_hash = password_hash
+        self.year = year
+
+    # level, step, index length, password hash length. Index numbers come
+    # straight from user input, so their length gets two bytes.
+    _header = struct.Struct('!BBHB')
+
+    def to_bytes(self):
+        """Pack into a compact byte string for network/disk backends."""
+        index = (self.index_number or '').encode('utf-8')
+        password_hash = self.password_hash or b''
+        year = (self.year or '').encode('utf-8')
+        header = self._header.pack(self.level, self.step, len(index), len(password_hash))
+        return header + index + password_hash + year
+
+    @classmethod
+    def from_bytes(cls, data):
+        level, step, index_len, hash_len = cls._header.unpack_from(data)
+        pos = cls._header.size
+        index = data[pos:pos + index_len].decode('utf-8')
+        pos += index_len
+        password_hash = data[pos:pos + hash_len]
+        year = data[pos + hash_len:].decode('utf-8')
+        return cls(level, step, index or None, password_hash or None, year or None)
+
+    def __repr__(self):
+        return f"SessionState(level={self.level}, step={self.step}, index_number={self.index_number!r})"
+
+
+class SessionBackend:
+    """
+    Interface for session storage: get/set/pop/delete by key, expiry after `ttl`
+    seconds without a write, and a background sweeper for expired entries.
+    """
+
+    ttl = SESSION_TTL
+    sweep_interval = SWEEP_INTERVAL
+    _sweeper = None
+
+    def get(self, key, default=None):
+        """Return the live value for key, or default if missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Store value under key and restart its TTL."""
+        raise NotImplementedError
+
+    def pop(self, key, default=None):
+        """Remove key and return its value (expired entries count as missing)."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove key without reading its value."""
+        self.pop(key)
+
+    def sweep(self):
+        """Drop every expired entry and return how many were removed."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Snapshot of the backend's size and counters."""
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def start_sweeper(self):
+        """
+        Start a daemon thread that sweeps expired sessions periodically.
+        Threads do not survive a fork, so a forked worker calls this again.
+        """
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, name="session-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._stop.set()
+            self._sweeper.join()
+            self._sweeper = None
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.sweep()
+
+
+class SessionStore(SessionBackend):
+    """
+    Bounded in-process session cache where each entry expires `ttl` seconds after its
+    last write.
+
+    Every USSD hop reads the session and then writes the next state, so
+    entries are kept in write order: the front of the dict is both the
+    least recently used and the first to expire. That lets eviction and
+    sweeping pop from the front without scanning live sessions.
+    """
+
+    def __init__(self, maxsize=SESSION_MAXSIZE, ttl=SESSION_TTL,
+                 sweep_interval=SWEEP_INTERVAL, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._timer = timer
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= self._timer():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        now = self._timer()
+        with self._lock:
+            data = self._data
+            if key in data:
+                data.move_to_end(key)
+            elif len(data) >= self.maxsize:
+                self._expire(now)
+                if len(data) >= self.maxsize:
+                    data.popitem(last=False)
+                    self.evictions += 1
+            data[key] = (now + self.ttl, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= self._timer():
+            return default
+        return entry[1]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def sweep(self):
+        with self._lock:
+            return self._expire(self._timer())
+
+    def _expire(self, now):
+        # Caller holds the lock. Entries are in write order, so expired
+        # ones are all at the front.
+        data = self._data
+        removed = 0
+        while data:
+            key, (expires_at, _) = next(iter(data.items()))
+            if expires_at > now:
+                break
+            del data[key]
+            removed += 1
+        self.expirations += removed
+        return removed
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Session backend stored in a SQLite file in WAL mode.
+
+    Every worker process opens the same file, so any worker can pick up the
+    next hop of a session. Each thread gets its own connection, opened on
+    first use and again in a forked child, which must not use its parent's;
+    WAL lets readers proceed while another worker writes. Counters are per
+    process.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL,
+                 sweep_interval=SWEEP_INTERVAL, timer=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        # Expiry times are compared across processes, so use wall-clock time
+        self._timer = timer
+        self._local = threading.local()
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def _connection(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Drop connections inherited from the parent unused
+                    self._local = threading.local()
+                    self._create_table(self._open())
+                    self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+        return conn
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit; each statement is its own short transaction
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _create_table(conn):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                key BLOB PRIMARY KEY,
+                level INTEGER,
+                step INTEGER,
+                index_number TEXT,
+                password_hash BLOB,
+                year TEXT,
+                expires_at REAL
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)')
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE expires_at > ?', (self._timer(),)
+        ).fetchone()[0]
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            'SELECT level, step, index_number, password_hash, year, expires_at FROM sessions WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        if row[5] <= self._timer():
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.hits += 1
+        return SessionState(*row[:5])
+
+    def set(self, key, value):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, value.level, value.step, value.index_number, value.password_hash,
+             value.year, self._timer() + self.ttl)
+        )
+
+    def pop(self, key, default=None):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            value = self.get(key, default)
+            conn.execute('DELETE FROM sessions WHERE key = ?', (key,))
+        finally:
+            conn.execute('COMMIT')
+        return value
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM sessions')
+
+    def sweep(self):
+        removed = self._connection().execute(
+            'DELETE FROM sessions WHERE expires_at <= ?', (self._timer(),)
+        ).rowcount
+        self.expirations += removed
+        return removed
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+        }
+
+
+SESSION_BACKENDS = ('memory', 'sqlite', 'redis')
+
+
+def create_session_backend(name=None, **options):
+    """
+    Build the session backend named by `name`, falling back to the
+    USSD_SESSION_BACKEND environment variable and then 'memory'.
+    USSD_SESSION_DB overrides the SQLite backend's file path and
+    USSD_REDIS_URL the Redis server (redis://host:port/db). A comma-separated
+    USSD_REDIS_URL shards sessions over several servers.
+    """
+    name = name or os.environ.get('USSD_SESSION_BACKEND', 'memory')
+    if name == 'memory':
+        return SessionStore(**options)
+    if name == 'sqlite':
+        options.setdefault('path', os.environ.get('USSD_SESSION_DB', SESSION_DB_PATH))
+        return SQLiteSessionBackend(**options)
+    if name == 'redis':
+        from redis_session import RedisSessionBackend, REDIS_URL
+        urls = options.pop('url', None) or os.environ.get('USSD_REDIS_URL', REDIS_URL)
+        urls = [url.strip() for url in urls.split(',') if url.strip()]
+        if len(urls) == 1:
+            return RedisSessionBackend(urls[0], **options)
+        from sharding import ShardedSessionBackend
+        return ShardedSessionBackend({url: RedisSessionBackend(url, **options) for url in urls})
+    raise ValueError(f"Unknown session backend: {name!r}")
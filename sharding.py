@@ -0,0 +1,89 @@
+"""
+Consistent-hash routing of USSD sessions to shards (workers or nodes)
+
+Sessions are placed by their session_key() digest, so every process agrees
+on which shard owns a session, and adding or removing a shard only moves
+about 1/N of the sessions.
+"""
+
+import bisect
+import hashlib
+
+from session_store import SessionBackend, session_key
+
+REPLICAS = 128
+
+
+def _point(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with `replicas` virtual points per shard."""
+
+    def __init__(self, shards=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self._points = []  # sorted ring positions
+        self._owners = []  # shard at the same index as _points
+        for shard in shards:
+            self.add(shard)
+
+    def __len__(self):
+        return len(set(self._owners))
+
+    def add(self, shard):
+        for i in range(self.replicas):
+            point = _point(f"{shard}#{i}".encode('utf-8'))
+            at = bisect.bisect(self._points, point)
+            self._points.insert(at, point)
+            self._owners.insert(at, shard)
+
+    def remove(self, shard):
+        keep = [(p, s) for p, s in zip(self._points, self._owners) if s != shard]
+        self._points = [p for p, _ in keep]
+        self._owners = [s for _, s in keep]
+
+    def shard_for_key(self, key):
+        """Shard owning a session_key() digest."""
+        if not self._points:
+            raise LookupError("Hash ring has no shards")
+        point = int.from_bytes(key[:8], 'big')
+        at = bisect.bisect(self._points, point)
+        return self._owners[at % len(self._points)]
+
+    def shard_for_session(self, session_id):
+        """Shard owning the session with this gateway session ID."""
+        return self.shard_for_key(session_key(session_id))
+
+
+class ShardedSessionBackend(SessionBackend):
+    """Spreads session keys over several backends using a HashRing."""
+
+    def __init__(self, backends, replicas=REPLICAS):
+        self.backends = dict(backends)
+        self.ring = HashRing(self.backends, replicas=replicas)
+
+    def backend_for(self, key):
+        return self.backends[self.ring.shard_for_key(key)]
+
+    def get(self, key, default=None):
+        return self.backend_for(key).get(key, default)
+
+    def set(self, key, value):
+        self.backend_for(key).set(key, value)
+
+    def pop(self, key, default=None):
+        return self.backend_for(key).pop(key, default)
+
+    def delete(self, key):
+        self.backend_for(key).delete(key)
+
+    def sweep(self):
+        return sum(backend.sweep() for backend in self.backends.values())
+
+    def start_sweeper(self):
+        for backend in self.backends.values():
+            backend.start_sweeper()
+
+    def stats(self):
+        return {name: backend.stats() for name, backend in self.backends.items()}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Publish read-only snapshots of the students database
+
+Imports and seeding write instance/students.db. The USSD workers can
+instead read a published snapshot of it: a compact, fully indexed copy that
+is never written again, so result lookups never wait on a writer's lock.
+
+    python snapshot.py publish     # build, verify and switch to a new snapshot
+    python snapshot.py rollback    # switch back to the previous snapshot
+    python snapshot.py status
+
+publish copies the database with VACUUM INTO to instance/snapshots/, checks
+the copy (integrity, grades version, and a query plan with no table scan
+for every query in database.py), then replaces the pointer file
+instance/students.db.live with os.replace. Each worker re-reads the pointer
+at most once a second and moves its connection pool to the new file; see
+database.serving_path(). A snapshot that fails verification is deleted and
+the pointer is left alone.
+
+rollback points back at the snapshot published before the current one,
+which is kept on disk until KEEP_SNAPSHOTS newer ones exist.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from urllib.parse import quote
+
+import database
+
+KEEP_SNAPSHOTS = 5
+# A table this small may be scanned; with ANALYZE statistics the planner
+# rightly prefers that to an index for a handful of rows
+SMALL_TABLE_ROWS = 1000
+HISTORY_FILE = 'published'
+
+
+class SnapshotError(Exception):
+    """A snapshot that cannot be published or rolled back to."""
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _history_path():
+    return os.path.join(database.snapshot_dir(), HISTORY_FILE)
+
+
+def read_history():
+    """Published snapshot file names, oldest first; the last is live."""
+    try:
+        with open(_history_path()) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _replace_file(path, text):
+    # Write a sibling temp file, then swap it in with one rename
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path) or '.')
+
+
+def build_snapshot():
+    """Copy DB_PATH into a new snapshot file; returns (path, grades_version)."""
+    directory = database.snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(database.DB_PATH, isolation_level=None)
+    try:
+        version = conn.execute(database.GRADES_VERSION_SQL).fetchone()[0]
+        now = time.time()
+        stamp = time.strftime('%Y%m%d%H%M%S', time.localtime(now)) + f"{int(now * 1e6) % 1000000:06d}"
+        name = f"students-v{version}-{stamp}.db"
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            raise SnapshotError(f"{path} already exists")
+        conn.execute("VACUUM INTO ?", (path,))
+    finally:
+        conn.close()
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Readers open snapshots immutable, which rules out a WAL file
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+    return path, version
+
+
+def verify_snapshot(path, min_version=0):
+    """Raise SnapshotError unless the snapshot at path is fit to serve."""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if problems != ['ok']:
+            raise SnapshotError(f"integrity check failed: {'; '.join(problems[:5])}")
+        version = conn.execute(database.GRADES_VERSION_SQL).fetchone()
+        if version is None or version[0] < min_version:
+            raise SnapshotError(f"grades version {version and version[0]} is older than {min_version}")
+        if not conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0]:
+            raise SnapshotError("no courses")
+        for name, sql in vars(database).items():
+            if not name.endswith('_SQL'):
+                continue
+            sql = sql.format(placeholders='?')
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count('?'))]
+            scans = [step for step in plan if step.startswith('SCAN') and not _small_table(conn, step.split()[1])]
+            if scans:
+                raise SnapshotError(f"{name} would scan: {', '.join(scans)}")
+    except sqlite3.DatabaseError as e:
+        raise SnapshotError(str(e)) from e
+    finally:
+        conn.close()
+
+
+def _small_table(conn, name):
+    # name is a table or, for an aliased table, its alias (never small)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone():
+        return False
+    return conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] < SMALL_TABLE_ROWS
+
+
+def switch_to(name):
+    """Point readers at the snapshot file `name` in the snapshot directory."""
+    _replace_file(database.snapshot_pointer_path(), name + '\n')
+
+
+def publish():
+    """Build, verify and switch to a new snapshot; returns its path."""
+    path, version = build_snapshot()
+    try:
+        verify_snapshot(path, version)
+    except SnapshotError:
+        os.remove(path)
+        raise
+    name = os.path.basename(path)
+    switch_to(name)
+    history = read_history() + [name]
+    _replace_file(_history_path(), ''.join(line + '\n' for line in history))
+    prune(history)
+    return path
+
+
+def rollback():
+    """Switch back to the snapshot published before the live one; returns its path."""
+    history = read_history()
+    if len(history) < 2:
+        raise SnapshotError("no earlier snapshot to roll back to")
+    previous = history[-2]
+    path = os.path.join(database.snapshot_dir(), previous)
+    if not os.path.exists(path):
+        raise SnapshotError(f"{path} is missing")
+    switch_to(previous)
+    _replace_file(_history_path(), ''.join(line + '\n' for line in history[:-1]))
+    return path
+
+
+def prune(history):
+    """Delete snapshot files older than the last KEEP_SNAPSHOTS published ones."""
+    keep = set(history[-KEEP_SNAPSHOTS:])
+    directory = database.snapshot_dir()
+    for name in os.listdir(directory):
+        if name.endswith('.db') and name not in keep:
+            # Workers still reading it keep their open file until they move on
+            os.remove(os.path.join(directory, name))
+    if len(history) > KEEP_SNAPSHOTS:
+        _replace_file(_history_path(), ''.join(line + '\n' for line in history[-KEEP_SNAPSHOTS:]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("publish", "rollback", "status"))
+    args = parser.parse_args()
+
+    try:
+        if args.command == "publish":
+            print(f"Published {publish()}")
+        elif args.command == "rollback":
+            print(f"Rolled back to {rollback()}")
+        else:
+            live = database.read_snapshot_pointer()
+            print(f"Serving {live or database.DB_PATH + ' (no snapshot published)'}")
+            for name in reversed(read_history()[:-1]):
+                print(f"  earlier: {name}")
+    except SnapshotError as e:
+        sys.exit(f"snapshot {args.command} failed: {e}")
@@ -0,0 +1,50 @@
+"""
+Africa's Talking endpoint tests: the cumulative text path is replayed
+through the menu without touching the session backend.
+"""
+
+import pytest
+
+import app as app_module
+from session_store import SessionStore
+
+PATH = ['1', '0722000040', 'password1', '1']
+
+
+class NoSessions:
+    def __getattr__(self, name):
+        raise AssertionError("the stateless endpoint must not use cache_data")
+
+
+@pytest.fixture
+def client(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'cache_data', NoSessions())
+    return client
+
+
+def post(client, text):
+    response = client.post('/ussd/at', data={
+        'sessionId': 'at-flow', 'serviceCode': '*928*230#',
+        'phoneNumber': '+233500000000', 'networkCode': '62001', 'text': text,
+    })
+    assert response.mimetype == 'text/plain'
+    return response.get_data(as_text=True)
+
+
+def test_each_hop_of_the_path(client):
+    assert post(client, '') == 'CON Welcome to TTU Result Checker\n1. Check Results\n2. Exit'
+    assert post(client, '*'.join(PATH[:1])) == 'CON Enter your index number:'
+    assert post(client, '*'.join(PATH[:2])) == 'CON Enter your password:'
+    assert post(client, '*'.join(PATH[:3])).startswith('CON Select Academic Year:')
+    assert post(client, '*'.join(PATH)).startswith('END Mensah Miguel Etornam Kwame\n')
+
+
+def test_matches_session_backed_endpoint(client, post_session, monkeypatch):
+    monkeypatch.setattr(app_module, 'cache_data', SessionStore())
+    reply = post_session('arkesel', PATH)
+    assert post(client, '*'.join(PATH)) == 'END ' + reply['message']
+
+
+def test_invalid_input_ends_session(client):
+    assert post(client, '3') == 'END Invalid input. Please try again.'
+    assert post(client, '1*0722000040*wrong*1') == 'END No record found for the provided details.'
@@ -0,0 +1,44 @@
+"""
+Codec tests: request validation, and template responses that decode to the
+same JSON as a normally serialized response.
+"""
+
+import json
+
+import pytest
+
+import codec
+import menu
+
+REQUEST = {
+    'sessionID': 's1', 'userID': 'u1', 'newSession': False,
+    'msisdn': '233500000000', 'userData': '1', 'network': 'MTN',
+}
+
+
+def test_decode_request():
+    hop = codec.decode_request(json.dumps(REQUEST).encode())
+    assert hop == ('s1', 'u1', False, '233500000000', '1', 'MTN')
+    assert codec.decode_request(b'{}') == ('', '', True, '', '', '')
+
+
+@pytest.mark.parametrize('body', [b'', b' \n', b'null', b'"1"', b'not json', b'[1, 2]',
+                                  json.dumps(dict(REQUEST, newSession='no')).encode(),
+                                  json.dumps(dict(REQUEST, userData=1)).encode()])
+def test_decode_rejects_invalid_requests(body):
+    with pytest.raises(codec.CodecError):
+        codec.decode_request(body)
+
+
+@pytest.mark.parametrize('reply', codec.FIXED_REPLIES + (menu.end('Kofi "K" Mensah\nMaths: A'),))
+def test_encode_response(reply):
+    ids = ('s"1\\', 'u1', '233500000000')
+    assert json.loads(codec.encode_response(*ids, reply)) == {
+        'sessionID': ids[0], 'userID': ids[1], 'msisdn': ids[2],
+        'continueSession': reply.continue_session, 'message': reply.message,
+    }
+
+
+def test_fixed_screens_use_templates():
+    assert menu.WELCOME in codec.TEMPLATES
+    assert menu.Reply(menu.ENTER_PASSWORD, True) in codec.TEMPLATES
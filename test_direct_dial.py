@@ -0,0 +1,62 @@
+"""
+Direct-dial tests: answers appended to the service code pre-fill the menu,
+at every depth, and are counted as saved round-trips.
+"""
+
+import pytest
+
+import app as app_module
+import menu
+from session_store import session_key
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture(autouse=True)
+def dial_stats(monkeypatch):
+    stats = menu.Counter()
+    monkeypatch.setattr(menu, 'dial_stats', stats)
+    return stats
+
+
+@pytest.mark.parametrize('dial_string, position, prompt', [
+    ('*928*230#', menu.MAIN_MENU, menu.WELCOME_MENU),
+    ('*928*230*1#', menu.ASK_INDEX, menu.ENTER_INDEX),
+    (f'*928*230*1*{INDEX}#', menu.ASK_PASSWORD, menu.ENTER_PASSWORD),
+    (f'*928*230*1*{INDEX}*{PASSWORD}#', menu.ASK_YEAR, menu.SELECT_YEAR),
+])
+def test_prefix_depths(dial_string, position, prompt, dial_stats):
+    reply, state = menu.start_dialled(dial_string)
+    assert reply == (prompt, True)
+    assert (state.level, state.step) == position
+    depth = dial_string.count('*') - 2
+    assert dial_stats['hops_saved'] == depth
+    assert dial_stats['direct_dials'] == (1 if depth else 0)
+
+
+def test_full_path_ends_with_results(db, dial_stats):
+    reply, _ = menu.start_dialled(f'*928*230*1*{INDEX}*{PASSWORD}*2#')
+    assert not reply.continue_session
+    assert reply.message.startswith('Mensah Miguel Etornam Kwame\n')
+    assert dial_stats['hops_saved'] == 4
+
+
+@pytest.mark.parametrize('dial_string', ['*928*231*1#', '*928*230*#', '*928*230**1#', '', None])
+def test_other_dial_strings_start_at_main_menu(dial_string, dial_stats):
+    assert menu.start_dialled(dial_string)[0] == menu.WELCOME
+    assert not dial_stats
+
+
+def test_invalid_prefilled_answer(dial_stats):
+    assert menu.start_dialled('*928*230*3#')[0] == menu.INVALID
+    assert not dial_stats
+
+
+def test_session_continues_from_prefilled_screen(post_hop):
+    def hop(user_data, new_session=False):
+        return post_hop('direct', user_data, new_session).get_json()
+
+    assert hop(f'*928*230*1*{INDEX}#', new_session=True)['message'] == menu.ENTER_PASSWORD
+    assert hop(PASSWORD)['message'] == menu.SELECT_YEAR
+    assert hop('1')['message'].startswith('Mensah Miguel Etornam Kwame\n')
+    assert app_module.cache_data.get(session_key('direct')) is None
@@ -0,0 +1,41 @@
+"""
+WSGI fast path tests: USSD POSTs are answered without Flask, and every
+other request still reaches the Flask app.
+"""
+
+import app as app_module
+from fast_wsgi import UssdFastPath
+
+
+def test_ussd_posts_skip_flask(client, post_hop, monkeypatch):
+    fast_path = app_module.app.wsgi_app
+    assert isinstance(fast_path, UssdFastPath)
+
+    def no_flask(environ, start_response):
+        raise AssertionError("USSD POST reached Flask")
+    monkeypatch.setattr(fast_path, 'app', no_flask)
+
+    response = post_hop('fast', '*928*230#', new_session=True)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['message'].startswith('Welcome to TTU Result Checker')
+    assert post_hop('fast', '1').get_json()['message'] == 'Enter your index number:'
+
+    response = client.post('/ussd/at', data={'sessionId': 'fast', 'text': '1'})
+    assert response.get_data(as_text=True) == 'CON Enter your index number:'
+
+
+def test_other_requests_reach_flask(client):
+    assert client.get('/ussd').status_code == 405
+    assert client.post('/missing').status_code == 404
+    preflight = client.options('/ussd', headers={'Origin': 'https://example.com',
+                                                 'Access-Control-Request-Method': 'POST'})
+    assert 'Access-Control-Allow-Origin' in preflight.headers
+
+
+def test_handler_error_is_500(post_hop, monkeypatch):
+    def broken(body):
+        raise RuntimeError("boom")
+    fast_path = app_module.app.wsgi_app
+    monkeypatch.setitem(fast_path.routes, '/ussd', ('application/json', broken))
+    assert post_hop('fast', '1').status_code == 500
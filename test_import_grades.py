@@ -0,0 +1,128 @@
+"""
+Grade import tests: validation against the catalog, UPSERT semantics, and
+re-running the sample data without duplicating grades, and delta re-imports
+that only compare students whose rows changed.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import database_schema
+from import_grades import CSVFormatError, import_grades
+
+INDEX = '0722000040'
+
+
+@pytest.fixture
+def db(db):
+    conn = sqlite3.connect(db)
+    yield conn
+    conn.close()
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / 'grades.csv'
+    path.write_text(text)
+    return path
+
+
+def grade(conn, course_id, index=INDEX):
+    return conn.execute(
+        "SELECT grade FROM grades g JOIN students s ON s.id = g.student_id "
+        "WHERE s.index_number = ? AND g.course_id = ?", (index, course_id)).fetchall()
+
+
+def version(conn):
+    return conn.execute("SELECT value FROM meta WHERE key = 'grades_version'").fetchone()[0]
+
+
+def test_upsert_and_reimport(db, tmp_path):
+    path = write_csv(tmp_path,
+                     "programme,index_number,course,grade\n"
+                     f"CPS,{INDEX},Communication Skills,b+\n"
+                     f"CPS,{INDEX},Project,A+\n"
+                     f"CPS,0722000012,Communication Skills,C\n")
+    before = version(db)
+    result = import_grades(path, batch_size=2)
+    assert (result.rows, result.written, result.unchanged, result.invalid) == (3, 2, 1, 0)
+    assert grade(db, 1) == [('B+',)]
+    assert version(db) == before + 1
+
+    again = import_grades(path)
+    assert (again.written, again.unchanged) == (0, 3)
+    assert version(db) == before + 1
+
+
+def test_invalid_rows_are_skipped(db, tmp_path):
+    path = write_csv(tmp_path,
+                     "index_number,course,grade\n"
+                     "0799999999,Communication Skills,A\n"
+                     f"{INDEX},Underwater Basket Weaving,A\n"
+                     f"{INDEX},Communication Skills,Z\n"
+                     f"{INDEX}\n"
+                     "\n"
+                     f"{INDEX},Communication Skills,C\n")
+    result = import_grades(path)
+    assert (result.rows, result.invalid) == (1, 4)
+    assert [line for line, _ in result.errors] == [2, 3, 4, 5]
+    assert grade(db, 1) == [('C',)]
+
+
+def test_dry_run_writes_nothing(db, tmp_path):
+    path = write_csv(tmp_path, f"index_number,course,grade\n{INDEX},Communication Skills,F\n")
+    assert import_grades(path, dry_run=True).rows == 1
+    assert grade(db, 1) == [('A+',)]
+
+
+def test_missing_columns(db, tmp_path):
+    with pytest.raises(CSVFormatError):
+        import_grades(write_csv(tmp_path, "index_number,grade\n"))
+
+
+def test_sample_data_is_not_duplicated(db):
+    count = db.execute("SELECT COUNT(*) FROM grades").fetchone()[0]
+    database_schema.insert_sample_data()
+    assert db.execute("SELECT COUNT(*) FROM grades").fetchone()[0] == count == 5 * len(database_schema.COURSES)
+
+
+def test_existing_duplicates_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'old.db'))
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.executescript(
+        "CREATE TABLE grades (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, "
+        "course_id INTEGER, grade CHAR(2));"
+        "INSERT INTO grades (student_id, course_id, grade) VALUES (1, 1, 'A'), (1, 1, 'B'), (1, 2, 'C');")
+    conn.close()
+    database_schema.create_tables()
+    conn = sqlite3.connect(database.DB_PATH)
+    assert conn.execute("SELECT student_id, course_id, grade FROM grades ORDER BY id").fetchall() == [
+        (1, 1, 'B'), (1, 2, 'C')]
+
+
+def test_reimport_only_touches_changed_students(db, tmp_path):
+    header = "index_number,course,grade\n"
+    rows = [f"{INDEX},Communication Skills,B\n", f"{INDEX},Project,B\n", "0722000012,Project,C\n"]
+    import_grades(write_csv(tmp_path, header + ''.join(rows)))
+    before = version(db)
+
+    # Another student's row moves, one grade changes: only that student is compared
+    rows[1] = f"{INDEX},Project,A\n"
+    result = import_grades(write_csv(tmp_path, header + ''.join(reversed(rows))))
+    assert (result.written, result.students_changed) == (1, 1)
+    project_level = db.execute("SELECT level FROM courses WHERE name = 'Project'").fetchone()[0]
+    assert result.affected == [(1, project_level)]
+    assert version(db) == before + 1
+    assert database.get_grade_changes(before, before + 1) == [(1, project_level)]
+
+
+def test_grades_written_elsewhere_are_compared_again(db, tmp_path):
+    path = write_csv(tmp_path, f"index_number,course,grade\n{INDEX},Communication Skills,B\n")
+    import_grades(path)
+    with db:
+        db.execute("UPDATE grades SET grade = 'F' WHERE student_id = 1 AND course_id = 1")
+    assert import_grades(path).written == 1
+    assert grade(db, 1) == [('B',)]
+    # The hand edit was not logged, so caches cannot rely on the change log across it
+    assert database.get_grade_changes(version(db) - 2, version(db)) is None
@@ -0,0 +1,75 @@
+"""
+In-memory serving tests: reads come from a copy of the database in RAM,
+which is reloaded when the file it was copied from changes.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import snapshot
+from catalog import get_catalog
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(database, 'SNAPSHOT_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(database, 'IN_MEMORY', True)
+    return db
+
+
+def first_grade():
+    return database.get_student_result(INDEX, database.password_digest(PASSWORD), 100).grades[0]
+
+
+def set_first_grade(grade):
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        conn.execute("UPDATE grades SET grade = ? WHERE student_id = 1 AND course_id = 1", (grade,))
+    conn.close()
+
+
+def test_reads_do_not_touch_the_file(db, monkeypatch):
+    assert first_grade() == (1, 'A+')
+    pool = database.get_pool()
+    assert pool.in_memory and database.memory_bytes() == pool.memory_bytes > 0
+    with database.connection() as conn:
+        assert conn.execute("PRAGMA database_list").fetchone()[2].startswith('/ussd-')
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM grades")
+
+    def no_file(*args, **kwargs):
+        raise AssertionError("in-memory reads should not open the database file")
+    monkeypatch.setattr(database, 'SNAPSHOT_CHECK_INTERVAL', 60)
+    monkeypatch.setattr(sqlite3, 'connect', no_file)
+    for _ in range(pool.size + 1):
+        assert first_grade() == (1, 'A+')
+
+
+def test_reloads_when_the_file_changes(db):
+    assert first_grade() == (1, 'A+')
+    old = database.get_pool()
+    set_first_grade('C')
+    assert first_grade() == (1, 'C')
+    assert database.get_pool() is not old and old.closed
+
+
+def test_catalog_reloads_with_the_copy(db):
+    assert 'Research Methods' not in get_catalog().course_ids
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        conn.execute("INSERT INTO courses (name, level, semester) VALUES ('Research Methods', 100, 1)")
+    conn.close()
+    assert 'Research Methods' in get_catalog().course_ids
+
+
+def test_reloads_on_snapshot_publish(db):
+    live = snapshot.publish()
+    assert database.get_pool().path == live and database.get_pool().in_memory
+    set_first_grade('D')
+    assert first_grade() == (1, 'A+')
+    snapshot.publish()
+    assert first_grade() == (1, 'D')
@@ -0,0 +1,35 @@
+"""
+Load generator tests: recorded scripts round-trip through JSONL, and a
+replay against the app ends every session the way its kind should.
+"""
+
+import pytest
+
+import app as app_module
+import loadgen
+
+
+@pytest.fixture
+def sessions(client):
+    return loadgen.record_sessions(200, seed=3)
+
+
+def test_recording_is_deterministic(sessions, tmp_path):
+    assert loadgen.record_sessions(200, seed=3) == sessions
+    assert {session['kind'] for session in sessions} == {kind for kind, _ in loadgen.SESSION_MIX}
+
+    path = tmp_path / 'sessions.jsonl'
+    loadgen.save_sessions(sessions, path)
+    assert loadgen.load_sessions(path) == sessions
+
+
+def test_replay_in_process(sessions):
+    result = loadgen.Replay(loadgen.InProcessTarget(), rate=10000, run_id='test').run(sessions)
+    assert result['errors'] == 0
+    assert result['unexpected_replies'] == 0
+    assert result['hops'] == sum(len(session['hops']) for session in sessions)
+    assert set(result['steps']) == set(loadgen.STEP_NAMES)
+    assert result['steps']['dial']['count'] == len(sessions)
+    # Abandoned sessions are left open in the store
+    abandoned = sum(session['kind'] == 'abandoned' for session in sessions)
+    assert app_module.session_store_size() == abandoned
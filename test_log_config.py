@@ -0,0 +1,62 @@
+"""
+Logging pipeline tests: passwords never reach the log output, sampled
+events are dropped, and formatting happens on the writer thread.
+"""
+
+import io
+import logging
+
+import pytest
+
+import app as app_module
+import log_config
+import menu
+from log_config import REDACTED, redact_input
+
+
+@pytest.fixture
+def log_output(client):
+    stream = io.StringIO()
+    log_config.configure_logging('INFO', {'ussd.auth': 0}, stream, app_module.LOG_REDACTION)
+    yield lambda: (log_config.stop_logging(), stream.getvalue())[1]
+    log_config.configure_logging(redact=app_module.LOG_REDACTION)
+
+
+@pytest.mark.parametrize('data, screen, redacted', [
+    ('password1', (1, 2), '***'),
+    ('0722000040', (1, 1), '0722000040'),
+    ('*928*230*1*0722000040#', None, '*928*230*1*0722000040#'),
+    ('*928*230*1*0722000040*password1#', None, '*928*230*1*0722000040*' + REDACTED + '#'),
+    ('*928*230*1*0722000040*password1*2#', None, '*928*230*1*0722000040*' + REDACTED + '*2#'),
+    ('1*0722000040*password1*2', None, '1*0722000040*' + REDACTED + '*2'),
+    ('', None, ''),
+])
+def test_redact_input(data, screen, redacted):
+    assert redact_input(data, screen, menu.SERVICE_CODE, menu.ASK_PASSWORD) == redacted
+
+
+def test_configuring_leaves_record_fields_alone(log_output):
+    # Only USSD_LOG_SKIP_RECORD_FIELDS=1 changes the logging module itself
+    assert logging.logThreads and logging._srcfile is not None
+
+
+def test_ussd_flow_logs_no_passwords(log_output, client, post_session):
+    post_session('logs', ['1', '0722000040', 'password1', '1'])
+    client.post('/ussd/at', data={'sessionId': 'logs', 'text': '1*0722000040*password1*1'})
+
+    output = log_output()
+    assert 'password1' not in output
+    assert "Session level: 1, step: 2, Data: '***'" in output
+    assert f"Data: '1*0722000040*{REDACTED}*1'" in output
+    assert "Dialled: '*928*230#'" in output
+    # ussd.auth is sampled at 0
+    assert 'Attempting authentication' not in output
+
+
+def test_records_are_queued_unformatted():
+    records = []
+    handler = log_config.LazyQueueHandler(type('Queue', (), {'put_nowait': staticmethod(records.append)})())
+    record = logging.LogRecord('root', logging.INFO, __file__, 1, "Data: %(data)r", ({'data': 'x'},), None)
+    handler.handle(record)
+    assert records[0].msg == "Data: %(data)r"
+    assert records[0].args == {'data': 'x'}
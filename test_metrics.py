@@ -0,0 +1,65 @@
+"""
+Metrics tests: histogram and counter rendering, and the /metrics endpoint
+after a real session.
+"""
+
+import app as app_module
+import menu
+from metrics import Counter, Histogram, Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = Histogram('step_seconds', 'Step time', ('step',), buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'year')
+    assert registry.render().splitlines() == [
+        '# TYPE step_seconds histogram',
+        '# HELP step_seconds Step time',
+        'step_seconds_bucket{step="year",le="0.1"} 2',
+        'step_seconds_bucket{step="year",le="1.0"} 3',
+        'step_seconds_bucket{step="year",le="+Inf"} 4',
+        'step_seconds_count{step="year"} 4',
+        'step_seconds_sum{step="year"} 3.65',
+        '# EOF',
+    ]
+
+
+def test_counter_labels_are_escaped():
+    registry = Registry()
+    counter = Counter('events', 'Events', ('name',), registry=registry)
+    counter.inc('a"b')
+    counter.inc('a"b', amount=2)
+    assert 'events_total{name="a\\"b"} 3' in registry.render()
+
+
+def test_metrics_endpoint(client, post_session):
+    started = menu.SESSION_EVENTS.value('started')
+    completed = menu.SESSION_EVENTS.value('completed')
+    failed_auth = menu.SESSION_EVENTS.value('failed_auth')
+    invalid = menu.SESSION_EVENTS.value('invalid')
+    exited = menu.SESSION_EVENTS.value('exited')
+    year_hops = app_module.REQUEST_SECONDS.count('arkesel', '1.3')
+
+    post_session('metrics', ['1', '0722000040', 'password1', '1'])
+    post_session('wrong-password', ['1', '0722000040', 'wrong', '1'])
+    post_session('invalid', ['3'])
+    post_session('exit', ['2'])
+    client.post('/ussd', json={'sessionID': 'gone', 'newSession': False, 'userData': '1'})
+
+    assert menu.SESSION_EVENTS.value('started') == started + 4
+    assert menu.SESSION_EVENTS.value('completed') == completed + 1
+    assert menu.SESSION_EVENTS.value('failed_auth') == failed_auth + 1
+    assert menu.SESSION_EVENTS.value('invalid') == invalid + 1
+    assert menu.SESSION_EVENTS.value('exited') == exited + 1
+    assert app_module.REQUEST_SECONDS.count('arkesel', '1.3') == year_hops + 2
+
+    response = client.get('/metrics')
+    assert response.content_type.startswith('application/openmetrics-text')
+    text = response.get_data(as_text=True)
+    assert text.endswith('# EOF\n')
+    for line in ('# TYPE ussd_request_seconds histogram', 'ussd_session_store_size 0',
+                 'ussd_session_events_total{event="expired"}', 'ussd_result_cache_hits_total',
+                 'ussd_prefetch_used_total',
+                 'ussd_db_query_seconds_count{query='):
+        assert line in text
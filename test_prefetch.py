@@ -0,0 +1,85 @@
+"""
+Prefetch tests: with prefetch on, the year step is answered from results
+rendered in the background after the password step.
+"""
+
+import sqlite3
+from concurrent.futures import Future
+
+import pytest
+
+import database
+import menu
+from prefetch import Prefetcher
+from result_cache import ResultCache
+from session_store import SessionState
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture
+def prefetcher(db, monkeypatch):
+    cache = ResultCache()
+    prefetcher = Prefetcher(menu.render_result, menu.YEAR_LEVELS.values(), enabled=True, cache=cache)
+    monkeypatch.setattr(menu, 'results', cache)
+    monkeypatch.setattr(menu, 'prefetcher', prefetcher)
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+def run_session(password=PASSWORD, year='1'):
+    state = SessionState(*menu.ASK_INDEX)
+    menu.advance(state, INDEX)
+    menu.advance(state, password)
+    return menu.advance(state, year).message
+
+
+def test_final_step_uses_prefetched_results(prefetcher, monkeypatch):
+    def no_query(*args):
+        raise AssertionError("prefetched result should not be queried again")
+    state = SessionState(*menu.ASK_INDEX)
+    menu.advance(state, INDEX)
+    menu.advance(state, PASSWORD)
+    monkeypatch.setattr(menu, 'get_result_message', no_query)
+    monkeypatch.setattr(menu, 'get_student_result', no_query)
+
+    for year in '12':
+        assert menu.advance(SessionState(*menu.ASK_YEAR, INDEX, state.password_hash), year).message \
+            .startswith('Mensah Miguel Etornam Kwame\n')
+    stats = prefetcher.stats()
+    assert stats['used'] == 2
+    assert 'final_step_prefetched_p50_ms' in stats
+
+
+def test_wrong_password_is_not_prefetched(prefetcher):
+    assert run_session(password='wrong') == menu.NO_RECORD
+    assert prefetcher.stats()['used'] == 0
+
+
+def test_password_changed_after_index_is_checked_again(prefetcher):
+    prefetcher.cache.version_check_interval = 0
+    state = SessionState(*menu.ASK_INDEX)
+    menu.advance(state, INDEX)
+    prefetcher._students.get(INDEX).result()
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        conn.execute("UPDATE students SET password = 'changed' WHERE index_number = ?", (INDEX,))
+    conn.close()
+
+    menu.advance(state, PASSWORD)
+    assert prefetcher._resolved.get((INDEX, state.password_hash)).result() is False
+    assert menu.advance(state, '1').message == menu.NO_RECORD
+
+
+def test_queued_prefetch_is_not_waited_for(prefetcher):
+    password_hash = database.password_digest(PASSWORD)
+    prefetcher._resolved[(INDEX, password_hash)] = Future()
+    assert prefetcher.wait(INDEX, password_hash) is False
+    assert prefetcher.stats()['not_waited'] == 1
+
+
+def test_disabled_prefetch_starts_no_work(prefetcher):
+    prefetcher.enabled = False
+    assert run_session().startswith('Mensah Miguel Etornam Kwame\n')
+    assert prefetcher.started == 0
+    assert 'final_step_not_prefetched_p50_ms' in prefetcher.stats()
@@ -0,0 +1,61 @@
+"""
+Query-plan regression tests: every query in database.py must be answered
+through an index. A plan step that SCANs a table means a lookup that grows
+with the number of students, and fails the test.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import database_schema
+
+QUERIES = {
+    name: value.format(placeholders="?,?,?")
+    for name, value in vars(database).items()
+    if name.endswith('_SQL')
+}
+
+
+@pytest.fixture(params=['empty', 'analyzed'])
+def conn(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'students.db'))
+    database_schema.create_tables()
+    conn = sqlite3.connect(database.DB_PATH)
+    if request.param == 'analyzed':
+        # Give the planner real statistics, as on a production database
+        conn.executemany(
+            "INSERT INTO students (index_number, password, name) VALUES (?, ?, ?)",
+            ((f"07220{i:05d}", f"pw{i}", f"Student {i}") for i in range(500))
+        )
+        conn.execute(
+            "INSERT INTO grades (student_id, course_id, grade) "
+            "SELECT s.id, c.id, 'B+' FROM students s CROSS JOIN courses c"
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
+    yield conn
+    conn.close()
+
+
+def query_plan(conn, sql):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count('?'))]
+
+
+def test_every_query_is_checked():
+    assert {'AUTHENTICATE_SQL', 'STUDENT_BY_INDEX_SQL', 'LEVEL_GRADES_SQL'} <= set(QUERIES)
+
+
+@pytest.mark.parametrize('name', sorted(QUERIES))
+def test_query_uses_indexes(conn, name):
+    plan = query_plan(conn, QUERIES[name])
+    assert plan, name
+    scans = [step for step in plan if step.startswith('SCAN')]
+    assert not scans, f"{name} falls back to a table scan: {plan}"
+
+
+@pytest.mark.parametrize('name', ['STUDENT_GRADES_SQL', 'LEVEL_GRADES_SQL'])
+def test_grade_lookups_use_covering_index(conn, name):
+    plan = query_plan(conn, QUERIES[name])
+    assert any('COVERING INDEX idx_grades_student_course' in step for step in plan), plan
@@ -0,0 +1,190 @@
+"""
+RedisSessionBackend tests against an in-process fake Redis server, so no
+real Redis is needed.
+"""
+
+import socketserver
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from redis_session import RedisConnection, RedisError, RedisSessionBackend
+from session_store import SessionState, session_key
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    """Just enough of Redis for the session backend: AUTH/GET/SET EX/EXPIRE/DEL/TTL."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}  # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+        self.now = time.monotonic
+        self.connections = 0
+        self.commands = []
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'redis://{host}:{port}/0'
+
+    def run(self, command):
+        name, args = command[0].upper(), command[1:]
+        self.commands.append(name)
+        with self.lock:
+            if name == b'PING':
+                return b'+PONG\r\n'
+            if name == b'AUTH':
+                return b'-WRONGPASS invalid username-password pair\r\n'
+            if name == b'SET':
+                expires_at = None
+                if len(args) == 4 and args[2].upper() == b'EX':
+                    expires_at = self.now() + int(args[3])
+                self.data[args[0]] = (args[1], expires_at)
+                return b'+OK\r\n'
+            if name == b'GET':
+                value = self._live(args[0])
+                if value is None:
+                    return b'$-1\r\n'
+                return b'$%d\r\n%s\r\n' % (len(value), value)
+            if name == b'EXPIRE':
+                value = self._live(args[0])
+                if value is None:
+                    return b':0\r\n'
+                self.data[args[0]] = (value, self.now() + int(args[1]))
+                return b':1\r\n'
+            if name == b'DEL':
+                return b':%d\r\n' % sum(self.data.pop(key, None) is not None for key in args)
+            if name == b'TTL':
+                entry = self.data.get(args[0])
+                if entry is None:
+                    return b':-2\r\n'
+                return b':%d\r\n' % round(entry[1] - self.now()) if entry[1] else b':-1\r\n'
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= self.now():
+            del self.data[key]
+            return None
+        return entry[0]
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                command.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.run(command))
+
+
+@pytest.fixture
+def server():
+    fake = FakeRedis()
+    thread = threading.Thread(target=fake.serve_forever, daemon=True)
+    thread.start()
+    yield fake
+    fake.shutdown()
+    fake.server_close()
+
+
+@pytest.fixture
+def backend(server):
+    backend = RedisSessionBackend(server.url, ttl=180)
+    yield backend
+    backend.close()
+
+
+def test_each_operation_is_one_round_trip(backend, server):
+    state = SessionState(1, 3, '0722000040', b'\x01' * 32)
+    backend.set('abc', state)
+    assert backend.pool.round_trips == 1
+    assert server.data[b'ussd:session:abc'][1] is not None
+
+    restored = backend.get('abc')
+    assert backend.pool.round_trips == 2
+    assert (restored.level, restored.step, restored.index_number, restored.password_hash) == \
+        (1, 3, '0722000040', b'\x01' * 32)
+
+    assert backend.pop('abc').index_number == '0722000040'
+    assert backend.pool.round_trips == 3
+    assert backend.get('abc') is None
+    assert server.commands == [b'SET', b'GET', b'GET', b'DEL', b'GET']
+
+
+def test_write_refreshes_ttl(backend, server):
+    clock = [1000.0]
+    server.now = lambda: clock[0]
+    backend.set('abc', SessionState())
+    clock[0] += 150
+    assert backend.get('abc') is not None
+    backend.set('abc', SessionState())  # the hop continues the session
+    clock[0] += 150
+    assert backend.get('abc') is not None
+    clock[0] += 31
+    assert backend.get('abc') is None
+
+
+def test_connections_are_pooled(backend, server):
+    threads = [
+        threading.Thread(target=lambda i=i: [backend.set(f'{i}-{n}', SessionState()) for n in range(50)])
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(server.data) == 400
+    assert server.connections <= backend.pool.max_connections
+
+
+def test_error_reply_raises(backend, server):
+    with pytest.raises(RedisError):
+        backend.pool.execute((b'NOPE',))
+    # The connection went back to the pool and is still usable
+    assert backend.pool._idle.qsize() == 1
+    backend.set('abc', SessionState())
+    assert server.connections == 1
+
+
+def test_failed_connection_is_closed(backend, server):
+    with pytest.raises(ValueError):
+        with backend.pool.connection():
+            raise ValueError
+    assert backend.pool._idle.qsize() == 0
+
+
+def test_delete_sends_only_del(backend, server):
+    backend.set('abc', SessionState())
+    backend.delete('abc')
+    assert backend.get('abc') is None
+    assert server.commands == [b'SET', b'DEL', b'GET']
+
+
+def test_failed_auth_closes_the_socket(server, monkeypatch):
+    closed = []
+    monkeypatch.setattr(RedisConnection, 'close', lambda self: closed.append(self))
+    host, port = server.server_address
+    with pytest.raises(RedisError):
+        RedisConnection(host, port, password='wrong')
+    assert len(closed) == 1
+
+
+def test_ussd_flow_with_redis_backend(backend, post_session, monkeypatch):
+    monkeypatch.setattr(app_module, 'cache_data', backend)
+    reply = post_session('redis-flow', ['1', '0722000040', 'password1', '1'])
+    assert reply['message'].startswith('Mensah Miguel Etornam Kwame')
+    assert backend.get(session_key('redis-flow')) is None
@@ -0,0 +1,128 @@
+"""
+Pre-rendered result tests: imports and seeding render result_blobs, the
+final hop serves them without reading grades, and a grade written outside
+an import drops the stale message.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import database_schema
+import menu
+from import_grades import import_grades
+from result_blobs import LEVELS, NO_GRADES, rebuild_result_blobs
+from result_cache import ResultCache
+from session_store import SessionState
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(menu, 'results', ResultCache(version_check_interval=0))
+    conn = sqlite3.connect(db)
+    yield conn
+    conn.close()
+
+
+def check(year='1'):
+    state = SessionState(1, 3, INDEX, database.password_digest(PASSWORD))
+    menu.results.clear()
+    return menu.show_results(state, year).message
+
+
+def rendered(conn, level=100):
+    row = conn.execute("SELECT message FROM result_blobs WHERE student_id = 1 AND level = ?", (level,)).fetchone()
+    return row and row[0]
+
+
+def test_rebuild_matches_rendering_from_grades(db):
+    from_grades = check()
+    with db:
+        # A student with no grades still gets a message for every level
+        db.execute("INSERT INTO students (index_number, password, name) VALUES ('0799000001', 'x', 'New')")
+        assert rebuild_result_blobs(db.cursor()) == 6 * len(LEVELS)
+    assert rendered(db) == from_grades
+    new_id = db.execute("SELECT id FROM students WHERE index_number = '0799000001'").fetchone()[0]
+    assert db.execute("SELECT message FROM result_blobs WHERE student_id = ? AND level = 200",
+                      (new_id,)).fetchone()[0] == f"New\n{NO_GRADES}"
+
+
+def test_final_hop_reads_only_the_blob(db, monkeypatch):
+    with db:
+        rebuild_result_blobs(db.cursor())
+
+    def no_grades(*args):
+        raise AssertionError("a rendered result should not be read from the grades")
+    monkeypatch.setattr(menu, 'get_student_result', no_grades)
+    assert check() == rendered(db)
+    state = SessionState(1, 3, INDEX, database.password_digest('wrong'))
+    assert menu.show_results(state, '1').message == menu.NO_RECORD
+
+
+def test_import_renders_affected_results(db, tmp_path):
+    with db:
+        rebuild_result_blobs(db.cursor())
+    untouched = rendered(db, 200)
+    path = tmp_path / 'grades.csv'
+    path.write_text(f"index_number,course,grade\n{INDEX},Communication Skills,B\n")
+    import_grades(path)
+    assert 'Communication Skills: B\n' in rendered(db)
+    assert rendered(db, 200) == untouched
+    assert check() == rendered(db)
+
+
+def test_grade_written_elsewhere_drops_the_blob(db):
+    with db:
+        rebuild_result_blobs(db.cursor())
+        db.execute("UPDATE grades SET grade = 'F' WHERE student_id = 1 AND course_id = 1")
+    assert rendered(db) is None
+    assert rendered(db, 200) is not None
+    assert 'Communication Skills: F\n' in check()
+
+
+def test_every_menu_level_is_rendered(db, monkeypatch):
+    assert sorted(menu.YEAR_LEVELS.values()) == list(LEVELS)
+    with db:
+        rebuild_result_blobs(db.cursor())
+    monkeypatch.setattr(menu, 'get_student_result', lambda *args: None)
+    # Level 400 has no courses, but is still one lookup
+    assert check('4') == f"Mensah Miguel Etornam Kwame\n{NO_GRADES}"
+
+
+def test_create_tables_migrates_an_older_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'old.db'))
+    database_schema.create_tables()
+    database_schema.insert_sample_data()
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        conn.execute("DROP TABLE result_blobs")
+    database_schema.create_tables()
+    # App startup only migrates the schema; hops fall back to the grades
+    assert conn.execute("SELECT COUNT(*) FROM result_blobs").fetchone()[0] == 0
+    database_schema.create_tables(render_results=True)
+    assert conn.execute("SELECT COUNT(*) FROM result_blobs").fetchone()[0] == 5 * len(LEVELS)
+    conn.close()
+
+
+def test_grades_of_unknown_courses_are_skipped(tmp_path, monkeypatch, caplog):
+    # A database from before the courses table, with a course the catalog lacks
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'old.db'))
+    conn = sqlite3.connect(database.DB_PATH)
+    conn.executescript(
+        "CREATE TABLE students (id INTEGER PRIMARY KEY AUTOINCREMENT, index_number VARCHAR(20) UNIQUE, "
+        "password VARCHAR(100), email VARCHAR(100), name VARCHAR(100), phone VARCHAR(15));"
+        "CREATE TABLE grades (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, "
+        "course_name VARCHAR(200), grade CHAR(2));"
+        "INSERT INTO students (index_number, password, name) VALUES ('0722000040', 'password1', 'Ama');"
+        "INSERT INTO grades (student_id, course_name, grade) VALUES "
+        "(1, 'Communication Skills', 'A'), (1, 'Legacy Elective', 'B');")
+    conn.close()
+    database_schema.create_tables(render_results=True)
+    conn = sqlite3.connect(database.DB_PATH)
+    assert rendered(conn) == "Ama\nCommunication Skills: A"
+    assert conn.execute("SELECT COUNT(*) FROM result_blobs").fetchone()[0] == len(LEVELS)
+    conn.close()
+    assert "Skipped 1 grades" in caplog.text
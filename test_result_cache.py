@@ -0,0 +1,110 @@
+"""
+Result cache tests: repeat checks are served without SQLite, and a grade
+written through another connection (as another worker would) invalidates
+cached results.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import menu
+from result_cache import ResultCache
+from session_store import SessionState
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    clock = [0.0]
+    cache = ResultCache(version_check_interval=1.0, timer=lambda: clock[0])
+    cache.clock = clock
+    monkeypatch.setattr(menu, 'results', cache)
+    return cache
+
+
+def check(year='1', password=PASSWORD):
+    state = SessionState(1, 3, INDEX, database.password_digest(password))
+    return menu.show_results(state, year).message
+
+
+def test_repeat_lookup_skips_sqlite(cache, monkeypatch):
+    first = check()
+    assert first.startswith('Mensah Miguel Etornam Kwame\nCommunication Skills: A+')
+
+    def no_sqlite(*args):
+        raise AssertionError("cache hit should not query the database")
+    monkeypatch.setattr(menu, 'get_result_message', no_sqlite)
+    monkeypatch.setattr(menu, 'get_student_result', no_sqlite)
+    monkeypatch.setattr(cache, '_version_source', no_sqlite)
+    assert check() == first
+    assert cache.stats()['hits'] == 1
+
+
+def test_wrong_password_is_not_served_from_cache(cache):
+    check()
+    assert check(password='wrong') == menu.NO_RECORD
+    assert cache.stats()['hits'] == 0
+
+
+def test_grade_write_from_another_connection_invalidates(cache, db):
+    assert 'Communication Skills: A+' in check()
+
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute("UPDATE grades SET grade = 'B' WHERE student_id = 1 AND course_id = 1")
+    conn.close()
+
+    # Still within the version check interval: the old message may be served
+    cache.clock[0] += 0.5
+    assert 'Communication Skills: A+' in check()
+
+    cache.clock[0] += 1.0
+    assert 'Communication Skills: B\n' in check()
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_cache_is_bounded(cache):
+    cache.maxsize = 2
+    for year in '1234':
+        check(year)
+    assert len(cache) == 2
+
+
+def test_import_drops_only_changed_results(cache, db, tmp_path):
+    from import_grades import import_grades
+
+    assert 'Communication Skills: A+' in check('1')
+    other_year = check('2')
+    path = tmp_path / 'grades.csv'
+    path.write_text(f"index_number,course,grade\n{INDEX},Communication Skills,B\n")
+    import_grades(path)
+
+    cache.clock[0] += 1.0
+    assert 'Communication Skills: B\n' in check('1')
+    assert cache.stats()['targeted_invalidations'] == 1
+    assert cache.stats()['invalidations'] == 0
+    assert len(cache) == 2
+    assert cache.stats()['hits'] == 0
+    assert check('2') == other_year
+    assert cache.stats()['hits'] == 1
+
+
+def test_version_errors_never_fail_a_check(cache, db, monkeypatch):
+    first = check()
+
+    def broken(*args):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(cache, '_version_source', broken)
+    cache.clock[0] += 1.0
+    assert check() == first
+
+    # Changes that cannot be read count as unknown: everything is dropped
+    monkeypatch.setattr(cache, '_version_source', lambda: cache._version + 1)
+    monkeypatch.setattr(cache, '_changes_source', broken)
+    cache.clock[0] += 1.0
+    assert check() == first
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['version'] == database.get_grades_version() + 1
@@ -0,0 +1,131 @@
+"""
+Session backend tests, including USSD sessions driven round-robin across
+several worker processes the way gunicorn spreads hops between workers.
+"""
+
+import multiprocessing
+import os
+
+import pytest
+
+from session_store import SessionState, SessionStore, SQLiteSessionBackend, create_session_backend
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKERS = 3
+STUDENT = ('0722000040', 'password1', 'Mensah Miguel Etornam Kwame')
+
+
+def _worker(backend, session_db, requests, responses):
+    # Runs in a fresh process: configure the backend before app is imported.
+    os.chdir(REPO_DIR)
+    os.environ['USSD_SESSION_BACKEND'] = backend
+    os.environ['USSD_SESSION_DB'] = session_db
+    from app import app
+
+    client = app.test_client()
+    for payload in iter(requests.get, None):
+        responses.put(client.post('/ussd', json=payload).get_json())
+
+
+def _run_round_robin(backend, session_db, n_sessions=6):
+    ctx = multiprocessing.get_context('spawn')
+    responses = ctx.Queue()
+    queues = [ctx.Queue() for _ in range(WORKERS)]
+    workers = [
+        ctx.Process(target=_worker, args=(backend, session_db, q, responses))
+        for q in queues
+    ]
+    for worker in workers:
+        worker.start()
+
+    index, password, _ = STUDENT
+    hops = ['*928*230#', '1', index, password, '1']
+    finals = []
+    try:
+        for session in range(n_sessions):
+            for hop, user_data in enumerate(hops):
+                # Hop n of session s goes to worker (s + n) % WORKERS, so no
+                # two consecutive hops of a session hit the same process.
+                queues[(session + hop) % WORKERS].put({
+                    'sessionID': f'rr-{backend}-{session}',
+                    'userID': 'test',
+                    'newSession': hop == 0,
+                    'msisdn': '233500000000',
+                    'userData': user_data,
+                    'network': 'MTN',
+                })
+                reply = responses.get(timeout=30)
+                if not reply['continueSession']:
+                    break
+            finals.append(reply)
+    finally:
+        for q in queues:
+            q.put(None)
+        for worker in workers:
+            worker.join(timeout=30)
+    return finals
+
+
+def test_sqlite_backend_shares_sessions_across_workers(tmp_path):
+    finals = _run_round_robin('sqlite', str(tmp_path / 'sessions.db'))
+    assert len(finals) == 6
+    for reply in finals:
+        assert reply['continueSession'] is False
+        assert reply['message'].startswith(STUDENT[2])
+
+
+def test_memory_backend_loses_sessions_across_workers(tmp_path):
+    finals = _run_round_robin('memory', str(tmp_path / 'sessions.db'))
+    assert all(reply['message'] == "Session expired. Please try again." for reply in finals)
+
+
+@pytest.mark.parametrize('make_backend', [
+    lambda path, timer: SessionStore(ttl=10, timer=timer),
+    lambda path, timer: SQLiteSessionBackend(path, ttl=10, timer=timer),
+], ids=['memory', 'sqlite'])
+def test_backend_expiry_pop_and_delete(tmp_path, make_backend):
+    now = [1000.0]
+    backend = make_backend(str(tmp_path / 'sessions.db'), lambda: now[0])
+
+    backend['a'] = SessionState(1, 2, '0722000040')
+    assert backend.get('a').index_number == '0722000040'
+    assert backend.pop('a').step == 2
+    assert backend.get('a') is None
+    backend['a'] = SessionState(1, 2)
+    backend.delete('a')
+    assert backend.get('a') is None
+
+    backend['b'] = SessionState(1, 1)
+    now[0] += 11
+    assert backend.get('b') is None
+    assert backend.stats()['expirations'] >= 1
+
+
+def test_create_session_backend_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        create_session_backend('carrier-pigeon')
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_sqlite_backend_reconnects_after_fork(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    backend = SQLiteSessionBackend(path)
+    assert not os.path.exists(path)  # nothing is opened until first use
+    backend['a'] = SessionState(1, 2, '0722000040')
+    backend.start_sweeper()
+    parent_conn = backend._connection()
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: a fresh connection and its own sweeper thread
+        ok = (backend._connection() is not parent_conn
+              and backend.get('a').index_number == '0722000040')
+        backend['b'] = SessionState(1, 1)
+        backend.start_sweeper()
+        ok = ok and backend._sweeper.is_alive()
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert backend._connection() is parent_conn
+    assert backend.get('b') is not None
+    backend.stop_sweeper()
@@ -0,0 +1,118 @@
+"""
+In-process session store tests: LRU eviction at maxsize, sweeping expired
+entries from the front, the background sweeper, the counters, and the
+SessionState record a session is kept in, with the byte encoding the
+shared backends store.
+"""
+
+import hashlib
+import time
+
+import pytest
+
+from database import password_digest
+from session_store import SessionState, SessionStore
+
+
+@pytest.fixture
+def clock():
+    return [1000.0]
+
+
+@pytest.fixture
+def store(clock):
+    return SessionStore(maxsize=3, ttl=10, timer=lambda: clock[0])
+
+
+def test_evicts_least_recently_written_at_maxsize(store, clock):
+    for key in 'abc':
+        store[key] = key
+        clock[0] += 1
+    store['a'] = 'a2'  # rewriting moves 'a' to the back
+    store['d'] = 'd'
+    assert list(store._data) == ['c', 'a', 'd']
+    assert store.stats()['evictions'] == 1
+    assert store.get('b') is None
+
+
+def test_full_store_drops_expired_before_evicting(store, clock):
+    store['a'] = 'a'
+    clock[0] += 5
+    store['b'] = 'b'
+    store['c'] = 'c'
+    clock[0] += 6  # only 'a' has expired
+    store['d'] = 'd'
+    assert list(store._data) == ['b', 'c', 'd']
+    assert store.stats()['evictions'] == 0
+    assert store.stats()['expirations'] == 1
+
+
+def test_sweep_removes_only_the_expired_front(store, clock):
+    store['a'] = 'a'
+    clock[0] += 5
+    store['b'] = 'b'
+    clock[0] += 5
+    assert store.sweep() == 1
+    assert list(store._data) == ['b']
+    clock[0] += 5
+    assert store.sweep() == 1
+    assert len(store) == 0
+
+
+def test_counters(store, clock):
+    store['a'] = 'a'
+    assert store.get('a') == 'a'
+    assert store.get('missing') is None
+    clock[0] += 10
+    assert store.get('a') is None  # expired on read
+    stats = store.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 2, 1)
+    assert stats['size'] == 0
+
+
+def test_background_sweeper(clock):
+    store = SessionStore(ttl=10, sweep_interval=0.01, timer=lambda: clock[0])
+    store['a'] = 'a'
+    clock[0] += 10
+    store.start_sweeper()
+    try:
+        deadline = time.monotonic() + 2
+        while len(store) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(store) == 0
+        first = store._sweeper
+        store.start_sweeper()  # already running: no second thread
+        assert store._sweeper is first
+    finally:
+        store.stop_sweeper()
+    assert store._sweeper is None and not first.is_alive()
+
+
+def test_session_state_is_one_record_updated_in_place(store):
+    state = SessionState()
+    assert [getattr(state, name) for name in SessionState.__slots__] == [0, 0, None, None, None]
+    with pytest.raises(AttributeError):
+        state.history = []  # slotted: no per-instance dict
+    store['s'] = state
+    state.level, state.step, state.index_number = 1, 2, '0722000040'
+    store['s'] = state
+    assert store.get('s') is state
+    assert len(store) == 1
+
+
+def test_session_state_keeps_only_the_password_digest():
+    state = SessionState(1, 3, '0722000040', password_digest('password1'))
+    assert state.password_hash == hashlib.sha256(b'password1').digest()
+    assert repr(state) == "SessionState(level=1, step=3, index_number='0722000040')"
+
+
+@pytest.mark.parametrize('state', [
+    SessionState(),
+    SessionState(1, 3, '0722000040', bytes(range(32)), '2'),
+    SessionState(1, 2, 'Kɔfi-ŋ ✓'),
+    SessionState(1, 2, '9' * 1000),
+], ids=['empty', 'full', 'non-ascii', 'long-index'])
+def test_session_state_round_trip(state):
+    copy = SessionState.from_bytes(state.to_bytes())
+    assert [getattr(copy, name) for name in SessionState.__slots__] == \
+        [getattr(state, name) for name in SessionState.__slots__]
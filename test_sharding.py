@@ -0,0 +1,57 @@
+"""
+Session key derivation and consistent-hash routing tests.
+"""
+
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from session_store import SessionState, SessionStore, fallback_session_id, session_key
+from sharding import HashRing, ShardedSessionBackend
+
+SESSION_IDS = [f"ATUid_{i:08d}" for i in range(20000)]
+
+
+def test_session_key_is_stable_across_processes():
+    code = "from session_store import session_key; print(session_key('ATUid_1').hex())"
+    outputs = {
+        subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                       env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+        for seed in ('1', '2', '3')
+    }
+    assert outputs == {session_key('ATUid_1').hex() + '\n'}
+    assert len(session_key('ATUid_1')) == 16
+    assert fallback_session_id('233500000000') == fallback_session_id('233500000000')
+
+
+def test_ring_spreads_sessions_evenly():
+    ring = HashRing(['w1', 'w2', 'w3', 'w4'])
+    counts = Counter(ring.shard_for_session(sid) for sid in SESSION_IDS)
+    assert set(counts) == {'w1', 'w2', 'w3', 'w4'}
+    assert max(counts.values()) < 1.25 * len(SESSION_IDS) / 4
+
+
+def test_adding_a_shard_moves_only_its_share():
+    ring = HashRing(['w1', 'w2', 'w3', 'w4'])
+    before = {sid: ring.shard_for_session(sid) for sid in SESSION_IDS}
+    ring.add('w5')
+    moved = [sid for sid in SESSION_IDS if ring.shard_for_session(sid) != before[sid]]
+    assert all(ring.shard_for_session(sid) == 'w5' for sid in moved)
+    assert len(moved) < 0.3 * len(SESSION_IDS)
+
+    ring.remove('w5')
+    assert all(ring.shard_for_session(sid) == before[sid] for sid in SESSION_IDS)
+
+
+def test_sharded_backend_routes_by_ring():
+    backend = ShardedSessionBackend({'a': SessionStore(), 'b': SessionStore()})
+    for sid in SESSION_IDS[:200]:
+        backend.set(session_key(sid), SessionState(1, 1, sid))
+    for sid in SESSION_IDS[:200]:
+        key = session_key(sid)
+        owner = backend.backends[backend.ring.shard_for_session(sid)]
+        assert owner.get(key).index_number == sid
+        assert backend.get(key).index_number == sid
+    assert all(len(store) > 0 for store in backend.backends.values())
@@ -0,0 +1,104 @@
+"""
+Snapshot publishing tests: readers move to a published snapshot without a
+restart, never see writes made after it, and go back on rollback. A
+snapshot that fails verification is never switched to.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import catalog
+import database
+import snapshot
+from import_grades import import_grades
+
+INDEX, PASSWORD = '0722000040', 'password1'
+
+
+@pytest.fixture
+def db(db, monkeypatch):
+    monkeypatch.setattr(database, 'SNAPSHOT_CHECK_INTERVAL', 0)
+    return db
+
+
+def first_grade():
+    result = database.get_student_result(INDEX, database.password_digest(PASSWORD), 100)
+    return result.grades[0]
+
+
+def set_first_grade(tmp_path, grade):
+    path = tmp_path / 'grades.csv'
+    path.write_text(f"index_number,course,grade\n{INDEX},Communication Skills,{grade}\n")
+    import_grades(path)
+
+
+def add_course(name):
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        course_id = conn.execute("INSERT INTO courses (name, level, semester) VALUES (?, 100, 1)", (name,)).lastrowid
+        conn.execute("INSERT INTO grades (student_id, course_id, grade) VALUES (1, ?, 'B')", (course_id,))
+    conn.close()
+
+
+def test_publish_switches_readers_to_an_immutable_snapshot(db, tmp_path):
+    assert not database.get_pool().read_only
+    path = snapshot.publish()
+    assert database.serving_path() == path
+    pool = database.get_pool()
+    assert pool.read_only and pool.path == path
+    with database.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM grades")
+
+    # Writes after the publish are not served until the next one
+    set_first_grade(tmp_path, 'C')
+    assert first_grade() == (1, 'A+')
+    snapshot.publish()
+    assert first_grade() == (1, 'C')
+
+
+def test_rollback_goes_back_to_the_previous_snapshot(db, tmp_path):
+    first = snapshot.publish()
+    version = database.get_grades_version()
+    set_first_grade(tmp_path, 'D')
+    snapshot.publish()
+    assert first_grade() == (1, 'D')
+
+    assert snapshot.rollback() == first
+    assert first_grade() == (1, 'A+')
+    assert database.get_grades_version() == version
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.rollback()
+
+
+def test_failed_verification_keeps_the_live_snapshot(db):
+    live = snapshot.publish()
+    conn = sqlite3.connect(database.DB_PATH)
+    with conn:
+        conn.execute("DELETE FROM courses")
+    conn.close()
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.publish()
+    assert database.serving_path() == live
+    assert set(os.listdir(database.snapshot_dir())) == {os.path.basename(live), snapshot.HISTORY_FILE}
+
+
+def test_old_snapshots_are_pruned(db, monkeypatch):
+    monkeypatch.setattr(snapshot, 'KEEP_SNAPSHOTS', 2)
+    published = [snapshot.publish() for _ in range(3)]
+    assert [os.path.exists(path) for path in published] == [False, True, True]
+    assert snapshot.read_history() == [os.path.basename(path) for path in published[1:]]
+
+
+def test_catalog_follows_the_served_database(db, monkeypatch):
+    monkeypatch.setattr(catalog, 'CATALOG_CHECK_INTERVAL', 0)
+    add_course('Research Methods')
+    assert 'Research Methods' in catalog.get_catalog().course_ids
+
+    snapshot.publish()
+    add_course('Data Ethics')
+    assert 'Data Ethics' not in catalog.get_catalog().course_ids
+    snapshot.publish()
+    assert 'Data Ethics' in catalog.get_catalog().course_ids
@@ -0,0 +1,59 @@
+"""
+Synthetic dataset tests: generation is deterministic from the seed, and
+the bulk insert leaves the schema's index and triggers in place.
+"""
+
+import sqlite3
+
+import pytest
+
+import database
+import database_schema
+
+
+def build(path, monkeypatch, n_students=50, seed=7):
+    monkeypatch.setattr(database, 'DB_PATH', str(path))
+    database_schema.create_tables()
+    database_schema.insert_synthetic_data(n_students, seed)
+    return sqlite3.connect(path)
+
+
+def dump(conn):
+    return (conn.execute("SELECT * FROM students ORDER BY id").fetchall(),
+            conn.execute("SELECT student_id, course_id, grade FROM grades ORDER BY id").fetchall())
+
+
+def schema_objects(conn):
+    return sorted(conn.execute("SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger')"))
+
+
+def test_same_seed_same_data(tmp_path, monkeypatch):
+    first = dump(build(tmp_path / 'a.db', monkeypatch))
+    assert dump(build(tmp_path / 'b.db', monkeypatch)) == first
+    assert dump(build(tmp_path / 'c.db', monkeypatch, seed=8)) != first
+
+
+def test_every_student_has_every_course(tmp_path, monkeypatch):
+    conn = build(tmp_path / 'students.db', monkeypatch)
+    students, grades = dump(conn)
+    assert len(students) == 50
+    assert len({row[1] for row in students}) == 50
+    assert len(grades) == 50 * len(database_schema.COURSES)
+    assert {grade for _, _, grade in grades} <= set(database_schema.GRADE_SCALE)
+    assert conn.execute("SELECT value FROM meta WHERE key = 'grades_version'").fetchone() == (1,)
+
+
+def test_schema_is_restored(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'students.db'))
+    database_schema.create_tables()
+    conn = sqlite3.connect(database.DB_PATH)
+    expected = schema_objects(conn)
+
+    database_schema.insert_synthetic_data(10)
+    assert schema_objects(conn) == expected
+
+    # A failed batch (same index numbers again) is rolled back entirely
+    with pytest.raises(sqlite3.IntegrityError):
+        database_schema.insert_synthetic_data(10)
+    assert schema_objects(conn) == expected
+    assert conn.execute("SELECT COUNT(*) FROM students").fetchone() == (10,)